@@ -0,0 +1,96 @@
+"""
+benchmark_writes.py
+Compare chunk write throughput of WriteMethod.VALUES and WriteMethod.COPY.
+
+Writes the same synthetic chunks with each method through write_updates,
+against the database configured in the environment (see
+simon.environment.get_db_config), and reports rows/sec. Everything
+written is deleted again afterwards.
+
+    python benchmark_writes.py --chunks 100000
+"""
+
+import argparse
+import logging
+import random
+import time
+import uuid
+
+import psycopg2
+
+from simon.environment import get_db_config
+from simon.models import AgentContext, ParsedDocument, WriteMethod
+from simon.components.documents import write_updates
+
+# distinct embeddings to draw from; rows share them to save memory
+VECTORS = 64
+
+def _batches(chunks, batch, paragraphs, dims):
+    rng = random.Random(0)
+    vectors = [[rng.uniform(-1, 1) for _ in range(dims)] for _ in range(VECTORS)]
+    text = "A sentence of about the usual length for a chunk. "*6
+
+    written = 0
+    while written < chunks:
+        n = min(batch, chunks-written)
+        documents = []
+        updates = []
+        for _ in range(0, n, paragraphs):
+            chunk = [text]*min(paragraphs, n-len(updates))
+            doc = ParsedDocument(" ".join(chunk), chunk, {"source": "benchmark", "title": "Benchmark"},
+                                 uuid.uuid4().hex)
+            documents.append(doc)
+            updates += [[doc.hash, None, i, rng.choice(vectors), "benchmark", "Benchmark",
+                         1.0, indx, len(chunk), [0, len(i)]]
+                        for indx, i in enumerate(chunk)]
+
+        written += len(updates)
+        yield documents, updates
+
+def run(cnx, method, chunks, batch, paragraphs, dims):
+    context = AgentContext(None, None, None, cnx, f"benchmark-{uuid.uuid4().hex}")
+    elapsed = 0.0
+
+    try:
+        for documents, updates in _batches(chunks, batch, paragraphs, dims):
+            for i in updates:
+                i[1] = context.uid
+
+            st = time.perf_counter()
+            write_updates(documents, updates, context, method)
+            cnx.commit()
+            elapsed += time.perf_counter()-st
+    finally:
+        cnx.rollback()
+        with cnx.cursor() as cur:
+            for table in ["simon_paragraphs", "simon_fulltext", "simon_corpus_version"]:
+                cur.execute(f"DELETE FROM {table} WHERE uid = %s;", (context.uid,))
+        cnx.commit()
+
+    return elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--chunks", type=int, default=100000, help="chunks to write per method")
+    parser.add_argument("--batch", type=int, default=10000, help="chunks per write_updates call")
+    parser.add_argument("--paragraphs", type=int, default=10, help="chunks per document")
+    parser.add_argument("--dims", type=int, default=1536, help="embedding dimensions")
+    parser.add_argument("--rounds", type=int, default=3, help="runs of each method")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    cnx = psycopg2.connect(**get_db_config(raise_on_missing=True))
+
+    results = {i: [] for i in WriteMethod}
+    for _ in range(args.rounds):
+        # alternate, so neither method always runs on a warmer database
+        for method in WriteMethod:
+            results[method].append(run(cnx, method, args.chunks, args.batch,
+                                       args.paragraphs, args.dims))
+
+    print(f"{args.chunks} chunks of {args.dims} dimensions, {args.batch} per call, best of {args.rounds}:")
+    for method, times in results.items():
+        print(f"  {method.name:>6}: {min(times):7.2f}s, {args.chunks/min(times):8.0f} rows/sec")
+    print(f"  COPY is {min(results[WriteMethod.VALUES])/min(results[WriteMethod.COPY]):.2f}x VALUES")
+
+    cnx.close()
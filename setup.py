@@ -31,6 +31,11 @@ setup(
     extras_require={
         "web": ["Flask==2.3.2", "gunicorn==21.2.0",
                 "flask_cors==4.0.0", "Requests==2.31.0"],
+        "async": ["Quart==0.18.4", "quart-cors==0.7.0",
+                  # Quart 0.18 needs these from before their breaking releases
+                  "Werkzeug<3", "blinker<1.6",
+                  "hypercorn==0.14.4", "Requests==2.31.0",
+                  "psycopg[binary,pool]==3.1.10"],
     },
     include_package_data=True,
     package_data={
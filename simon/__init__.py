@@ -1,8 +1,10 @@
 from .search import Search
 from .store import Datastore
 from .start import create_context
-from .models import AgentContext, ParsedDocument, IndexClass
+from .components.pool import ConnectionPool
+from .models import AgentContext, ParsedDocument, IndexClass, WriteMethod, VectorIndex, StreamFormat, SearchBackend
 from .components.documents import index_document, parse_web, parse_text, parse_tika, bulk_index
-from .provision import setup
+from .provision import setup, migrate, reindex, cluster
+from .registry import Registry
 
 
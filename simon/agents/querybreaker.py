@@ -8,8 +8,17 @@ from langchain.output_parsers import CommaSeparatedListOutputParser
 from langchain.prompts import StringPromptTemplate
 from langchain.schema import BaseOutputParser
 import re
+import hashlib
 
 from ..models import *
+from ..utils.cache import LRUCache
+from ..components.embeddings import normalize_query
+from ..components.documents import get_query_rewrite, cache_query_rewrite
+from ..components.adocuments import aget_query_rewrite, acache_query_rewrite
+
+# rewrites shared by every QueryBreaker in this process
+_MEMO = LRUCache(maxsize=4096)
+_MISSING = object()
 
 
 TEMPLATE = """
@@ -74,7 +83,7 @@ class QueryOutputParser(BaseOutputParser):
         return [i.strip() for i in str.split(",")]
 
 class QueryBreaker(object):
-    def __init__(self, context, verbose=False):
+    def __init__(self, context, verbose=False, persistent=False):
         """Context-Aware follow-up assistant
 
         Parameters
@@ -83,17 +92,113 @@ class QueryBreaker(object):
             The context to operate the RIO under
         verbose : bool
             Whether the chain should be verbose
+        persistent : bool
+            Whether to also cache rewrites in the database, so they
+            survive restarts and are shared between processes
         """
         
         self.__prompt = QueryPromptFormatter(input_variables=["entities", "input"],
                                              output_parser=QueryOutputParser())
         self.__chain = LLMChain(llm=context.llm, prompt=self.__prompt, verbose=verbose)
 
-    def __call__(self, question, entities={}):
-        out =  self.__chain.predict(input=question,
-                                    entities=entities)
+        self.__context = context
+        self.__persistent = persistent
+        self.__model = getattr(context.llm, "model_name", type(context.llm).__name__)
+
+    def __parse(self, out):
         res =  self.__prompt.output_parser.parse(out)
         if not res:
             return None
 
         return list(set(res))
+
+    def __break(self, question, entities):
+        out =  self.__chain.predict(input=question,
+                                    entities=entities)
+        return self.__parse(out)
+
+    def __key(self, question):
+        return hashlib.sha256(f"{self.__model}\n{normalize_query(question)}".encode()).hexdigest()
+
+    def __call__(self, question, entities={}):
+        # rewrites depend on the entities too, so only
+        # memoize the plain question
+        if entities:
+            return self.__break(question, entities)
+
+        key = self.__key(question)
+
+        # in-memory tier; a cached None means the question had no rewrite
+        cached = _MEMO.get(key, _MISSING)
+        if cached is not _MISSING:
+            return list(cached) if cached else None
+
+        # persistent tier
+        if self.__persistent:
+            found, res = get_query_rewrite(key, self.__context)
+            if found:
+                _MEMO.put(key, res)
+                return list(res) if res else None
+
+        res = self.__break(question, entities)
+
+        _MEMO.put(key, res)
+        if self.__persistent:
+            cache_query_rewrite(key, res, self.__context)
+
+        return res
+
+    async def acall(self, question, entities={}):
+        """Break a question into search queries, asynchronously
+
+        Parameters
+        ----------
+        question : str
+            The question to break.
+        entities : optional, dict
+            Extra entities to seed the rewrite with.
+
+        Returns
+        -------
+        Optional[List[str]]
+            The search queries, or None if there are none.
+        """
+
+        if entities:
+            out = await self.__chain.apredict(input=question,
+                                              entities=entities)
+            return self.__parse(out)
+
+        key = self.__key(question)
+
+        cached = _MEMO.get(key, _MISSING)
+        if cached is not _MISSING:
+            return list(cached) if cached else None
+
+        if self.__persistent:
+            found, res = await aget_query_rewrite(key, self.__context)
+            if found:
+                _MEMO.put(key, res)
+                return list(res) if res else None
+
+        out = await self.__chain.apredict(input=question,
+                                          entities=entities)
+        res = self.__parse(out)
+
+        _MEMO.put(key, res)
+        if self.__persistent:
+            await acache_query_rewrite(key, res, self.__context)
+
+        return res
+
+    @staticmethod
+    def cache_stats():
+        """Hit and miss counters for the in-memory rewrite cache
+
+        Returns
+        -------
+        Dict[str, int]
+            hits, misses, hit rate, evictions, current size, and maximum size.
+        """
+
+        return _MEMO.stats
@@ -18,7 +18,8 @@ import threading
 
 from collections import defaultdict
 
-from ..utils.helpers import sent_tokenize_d
+from ..utils.helpers import kb_sentences
+from .streaming import StreamParser, StreamingCallbackHandler, AsyncStreamingCallbackHandler, stream, astream, streaming_llm
 from langchain.schema import (
     AIMessage,
     HumanMessage,
@@ -129,39 +130,155 @@ class ReasonOutputParser(BaseOutputParser):
                                 "resource": j} for i,j in zip(extrapolations, ex_citations)],
         }
 
+class ReasonStreamParser(StreamParser):
+    """Parses Reason's output incrementally; see ReasonOutputParser
+
+    Emits an update as each search result line (or its citation)
+    completes, and as the response grows. Completed lines are joined
+    and their citations resolved once, as they complete; each token
+    only costs the unfinished line.
+
+    Parameters
+    ----------
+    output_parser : ReasonOutputParser
+        Parses the full output when the stream closes.
+    postprocess : Callable[[dict], Optional[dict]]
+        Resolves the citations of a parsed output.
+    resolve : Callable[[int], dict]
+        Resolves one citation; raises KeyError if there is no such one.
+    """
+
+    SEARCH_RESULTS = re.compile(r"^\s*Search Results\s*:\s*(.*)$")
+    RESPONSE = re.compile(r"^\s*Response\s*:\s*(.*)$")
+    CITATION = re.compile(r"\[(\d+)\]")
+
+    def __init__(self, output_parser, postprocess, resolve):
+        super().__init__()
+
+        self.__parser = output_parser
+        self.__postprocess = postprocess
+        self.__resolve = resolve
+
+        self.__section = None
+        # resolved search results, the joined response lines, and
+        # the resolved citations in them, of the completed lines
+        self.__results = []
+        self.__answer = None
+        self.__resources = {}
+
+        # the unfinished response line only grows until it completes,
+        # so its citations are kept too, and only its new tail scanned
+        self.__partial = ""
+        self.__partial_resources = {}
+
+    def __result(self, line):
+        line = line.replace('"', '').replace("`", "").strip()
+        if line == "":
+            return
+
+        citations = self.CITATION.findall(line)
+        headline = self.CITATION.sub("", line.strip()[2:]).strip()
+
+        # results citing nothing we know are left out
+        try:
+            return {"headline": headline,
+                    "resource": self.__resolve(int(citations[0]) if citations else -1)}
+        except KeyError:
+            return
+
+    def __citations(self, line):
+        resources = {}
+        for i in self.CITATION.findall(line):
+            i = int(i)
+            if i in self.__resources or i in resources:
+                continue
+            try:
+                resources[i] = self.__resolve(i)
+            except KeyError:
+                continue
+
+        return resources
+
+    def __partial_citations(self, partial):
+        if not partial.startswith(self.__partial):
+            self.__partial, self.__partial_resources = "", {}
 
-# TODO the streaming API is currently really poorly designed
-# so TODO make it better lol - hjl
-class ReasonSingleUseCallbackHandler(BaseCallbackHandler):
-    def __init__(self, formatter, destructor):
-        self.__scratchpad = ""
-        self.__formatter = formatter
-        self.__destructor = destructor
-        self.__cache = None
-        self.__last_output = None
-        self.done = False
+        # from the last citation seen, in case it was cut off
+        start = max(self.__partial.rfind("["), 0)
+        self.__partial_resources.update(self.__citations(partial[start:]))
+        self.__partial = partial
 
-    def blocking_next(self):
-        while not self.__last_output:
-            if self.done:
-                break
+        return self.__partial_resources
 
-        lo = self.__last_output
-        self.__last_output = None
-        return lo
+    def line(self, line):
+        self.__partial, self.__partial_resources = "", {}
 
-    def on_llm_new_token(self, **kwargs):
-        self.__scratchpad += kwargs["token"]
+        match = self.SEARCH_RESULTS.match(line)
+        if match and self.__section is None:
+            self.__section = "results"
+            line = match.group(1)
+        else:
+            match = self.RESPONSE.match(line)
+            if match and self.__section != "response":
+                self.__section = "response"
+                line = match.group(1)
+                if line.strip() == "":
+                    return False
+
+        if self.__section == "results":
+            result = self.__result(line)
+            if result:
+                self.__results.append(result)
+            return bool(result)
+        elif self.__section == "response":
+            self.__answer = line if self.__answer is None else self.__answer+"\n"+line
+            self.__resources.update(self.__citations(line))
+            return True
+
+        return False
+
+    def output(self, partial, changed):
+        results = self.__results
+        answer = self.__answer
+        resources = self.__resources
+
+        # the unfinished line may be starting the next section
+        section = self.__section
+        match = self.RESPONSE.match(partial)
+        if match and section != "response":
+            section = "response"
+            partial = match.group(1)
+        else:
+            match = self.SEARCH_RESULTS.match(partial)
+            if match and section is None:
+                section = "results"
+                partial = match.group(1)
+
+        if section == "results":
+            # a result line counts once its citation is complete
+            result = self.__result(partial) if self.CITATION.search(partial) else None
+            if result:
+                results = results+[result]
+            elif not changed:
+                return
+        elif section == "response":
+            answer = partial if answer is None else answer+"\n"+partial
+            resources = {**resources, **self.__partial_citations(partial)}
+        elif not changed:
+            return
 
-        out = self.__formatter(self.__scratchpad)
-        if out and out != self.__cache:
-            self.__cache = out
-            self.__last_output = {"output": self.__cache, "done": False}
+        answer = (answer or "").strip("\"").strip('"').strip("`").replace("`", "").strip()
+        if answer.lower() == "n/a":
+            return
 
-    def on_llm_end(self, res, **kwargs):
-        self.__last_output = {"output": self.__cache, "done": True}
-        self.done = True
-        self.__destructor()
+        return {
+            "answer": answer if answer != "" else None,
+            "answer_resources": dict(resources),
+            "search_results": list(results),
+        }
+
+    def parse(self, text):
+        return self.__postprocess(self.__parser.parse(text))
 
 class Reason(object):
     def __init__(self, context, verbose=False):
@@ -178,7 +295,12 @@ class Reason(object):
         self.__prompt = ReasonPromptFormatter(input_variables=["input", "kb"],
                                               output_parser=ReasonOutputParser())
         self.__chain = LLMChain(llm=context.reason_llm, prompt=self.__prompt, verbose=verbose)
+        self.__stream_chain = LLMChain(llm=streaming_llm(context.reason_llm), prompt=self.__prompt, verbose=verbose)
+
 
+    def __resolve(self, id, kb, resource_ids, chunks):
+        return {"quote": resource_ids[id],
+                "chunk": kb[chunks[id]]}
 
     def __postprocess_res(self, res, kb, resource_ids, chunks):
         # if we have no response, return
@@ -186,30 +308,27 @@ class Reason(object):
             return 
 
         # set answer citations and the result citations
-        res["answer_resources"] = {i: {"quote": resource_ids[i],
-                                       "chunk": kb[chunks[i]]} for i in res["answer_resources"]}
+        res["answer_resources"] = {i: self.__resolve(i, kb, resource_ids, chunks)
+                                   for i in res["answer_resources"]}
         try:
             for i in res["search_results"]:
-                id = i["resource"]
-
-                i["resource"] = {"quote": resource_ids[id],
-                                 "chunk": kb[chunks[id]]}
+                i["resource"] = self.__resolve(i["resource"], kb, resource_ids, chunks)
         except KeyError:
             return
 
         return res
 
-    def __call__(self, input, kb, streaming=None):
+    def __label(self, kb):
         # initialize the dictionary for text-to-number labeling
         # this dictionary increments a number for every new key
         resource_ids = defaultdict(lambda : len(resource_ids))
 
         # chunk the resource into sentences and label them
         # this is a dictionary of resource_id:kb_entry
+        sentences = kb_sentences(kb)
         chunks = {k:v
-                  for indx, i in enumerate(kb)
-                  for k,v in [(resource_ids[j], indx)
-                              for j in sent_tokenize_d((i["metadata"]["title"] if i["metadata"]["title"] != None else "")+" "+i["text"])]}
+                  for indx, i in enumerate(sentences)
+                  for k,v in [(resource_ids[j], indx) for j in i]}
 
         # freeze and reverse the resource id dictionary
         # so this is now a dict of resource_id:text
@@ -220,6 +339,11 @@ class Reason(object):
         # hard limit of 5500
         sentences = "".join([text+f" [{indx}]\n " for indx, text in resource_ids.items()])[:5500]
 
+        return resource_ids, chunks, sentences
+
+    def __call__(self, input, kb, streaming=None):
+        resource_ids, chunks, sentences = self.__label(kb)
+
         L.debug(f"Starting reasoning request!!!")
 
         # run llm prediciton
@@ -227,36 +351,17 @@ class Reason(object):
         # if we are streaming, inject the streaming tools into the llm
         # and parse accordingly
         if streaming:
-            def format_callback(output):
-                res = self.__prompt.output_parser.parse(output)
+            def postprocess(res):
                 return self.__postprocess_res(res, kb, resource_ids, chunks)
+            def resolve(id):
+                return self.__resolve(id, kb, resource_ids, chunks)
 
-            def remove_callback():
-                self.__chain.llm.callbacks = [i for i in self.__chain.llm.callbacks if type(i) != ReasonSingleUseCallbackHandler]
-                
-            # create the callback handler 
-            callback = ReasonSingleUseCallbackHandler(format_callback, remove_callback)
-
-            def streaming_generator():
-                while not callback.done:
-                    yield callback.blocking_next()
-
-            # and bind it to the llm
-            self.__chain.llm.streaming = True
-            if type(self.__chain.llm.callbacks) == list:
-                self.__chain.llm.callbacks.append(callback)
-            else:
-                self.__chain.llm.callbacks = [callback]
+            # create the callback handler, bound to this call only
+            callback = StreamingCallbackHandler(ReasonStreamParser(self.__prompt.output_parser, postprocess, resolve))
 
-            self.__chain.llm.temperature = 0
-
-            # kick that puppy into motion 
-            thread = threading.Thread(target=self.__chain.predict,
-                                      kwargs={"input": input,
-                                              "kb": sentences.strip()})
-            thread.start()
-            # return nothing
-            return streaming_generator()
+            # kick that puppy into motion
+            return stream(self.__stream_chain.predict, callback,
+                          input=input, kb=sentences.strip())
 
         
         output = self.__chain.predict(input=input,
@@ -267,3 +372,43 @@ class Reason(object):
         # perform postprocessing and return
         return self.__postprocess_res(res, kb, resource_ids, chunks)
 
+    async def acall(self, input, kb, streaming=None):
+        """Reason about the knowledge base to answer `input`, asynchronously
+
+        Parameters
+        ----------
+        input : str
+            The query.
+        kb : List[Dict]
+            Resources found by searching the knowledge base.
+        streaming : optional, bool
+            Return an async generator of partial outputs instead.
+
+        Returns
+        -------
+        Optional[dict]
+            The parsed answer, or an async generator if streaming.
+        """
+
+        resource_ids, chunks, sentences = self.__label(kb)
+
+        L.debug(f"Starting async reasoning request!!!")
+
+        if streaming:
+            def postprocess(res):
+                return self.__postprocess_res(res, kb, resource_ids, chunks)
+            def resolve(id):
+                return self.__resolve(id, kb, resource_ids, chunks)
+
+            callback = AsyncStreamingCallbackHandler(ReasonStreamParser(self.__prompt.output_parser, postprocess, resolve))
+
+            return astream(self.__stream_chain.apredict(callbacks=[callback],
+                                                        input=input,
+                                                        kb=sentences.strip()), callback)
+
+        output = await self.__chain.apredict(input=input,
+                                             kb=sentences.strip())
+        res = self.__prompt.output_parser.parse(output)
+
+        L.debug(f"All done now with async reasoning")
+        return self.__postprocess_res(res, kb, resource_ids, chunks)
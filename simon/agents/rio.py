@@ -12,6 +12,8 @@ from langchain.callbacks.base import BaseCallbackHandler
 from collections import defaultdict
 
 from ..utils.helpers import *
+from ..utils.segmentation import segmenter
+from .streaming import StreamParser, StreamingCallbackHandler, AsyncStreamingCallbackHandler, stream, astream, streaming_llm
 import threading
 
 import logging
@@ -114,40 +116,69 @@ class RIOOutputParser(BaseOutputParser):
 
         return questions, ex_citations, input_citations
 
-# TODO the streaming API is currently really poorly designed
-# so TODO make it better lol - hjl
-class RIOSingleUseCallbackHandler(BaseCallbackHandler):
-    def __init__(self, formatter, destructor):
-        self.__scratchpad = ""
-        self.__formatter = formatter
-        self.__destructor = destructor
-        self.__cache = None
-        self.__last_output = None
-        self.done = False
+class RIOStreamParser(StreamParser):
+    """Parses RIO's output incrementally; see RIOOutputParser
 
-    def blocking_next(self):
-        while not self.__last_output:
-            if self.done:
-                break
+    Emits an update as soon as each entry's citations are complete.
+    Each entry is cited once, as its line completes; each token only
+    costs the unfinished line.
 
-        lo = self.__last_output
-        self.__last_output = None
-        return lo
+    Parameters
+    ----------
+    output_parser : RIOOutputParser
+        Parses the full output when the stream closes.
+    cite : Callable[[List[str], List[int], List[int]], List[dict]]
+        Resolves (headlines, resource citations, input citations).
+    """
 
-    def on_llm_new_token(self, **kwargs):
-        self.__scratchpad += kwargs["token"]
+    ENTRY = re.compile(r".* ?<(\d+)> ?\[(\d+)\]")
+    RESOURCE = re.compile(r"\[(\d+)\]")
+    INPUT = re.compile(r"<(\d+)>")
 
-        out = self.__formatter(self.__scratchpad)
+    def __init__(self, output_parser, cite):
+        super().__init__()
 
-        if out and out != self.__cache:
-            self.__cache = out
-            self.__last_output = {"output": self.__cache, "done": False}
+        self.__parser = output_parser
+        self.__cite = cite
+        # cited entries of the completed lines
+        self.__entries = []
 
-    def on_llm_end(self, res, **kwargs):
-        self.__last_output = {"output": self.__cache, "done": True}
-        self.done = True
-        self.__destructor()
+    def __entry(self, line):
+        line = line.strip().strip("\"").strip('"').strip("`").strip("-").strip()
+        if not self.ENTRY.match(line):
+            return
+
+        headline = self.INPUT.sub("", self.RESOURCE.sub("", line)).strip()
+
+        # entries citing nothing we know are left out
+        try:
+            (entry,) = self.__cite([headline],
+                                   [int(self.RESOURCE.findall(line)[0])],
+                                   [int(self.INPUT.findall(line)[0])])
+        except KeyError:
+            return
+
+        return entry
+
+    def line(self, line):
+        entry = self.__entry(line)
+        if entry:
+            self.__entries.append(entry)
+        return bool(entry)
+
+    def output(self, partial, changed):
+        entry = self.__entry(partial)
+        if not entry and not changed:
+            return
+
+        entries = self.__entries+([entry] if entry else [])
+        if len(entries) == 0:
+            return
 
+        return entries
+
+    def parse(self, text):
+        return self.__cite(*self.__parser.parse(text))
 
 class RIO(object):
     def __init__(self, context, verbose=False):
@@ -164,12 +195,13 @@ class RIO(object):
         self.__prompt = RIOPromptFormatter(input_variables=["input", "kb"],
                                            output_parser=RIOOutputParser())
         self.__chain = LLMChain(llm=context.reason_llm, prompt=self.__prompt, verbose=verbose)
+        self.__stream_chain = LLMChain(llm=streaming_llm(context.reason_llm), prompt=self.__prompt, verbose=verbose)
 
 
-    def __call__(self, input, kb=[], streaming=False):
+    def __label(self, input, kb):
         # Tokenize the sentence
         sent_ids = defaultdict(lambda : len(sent_ids))
-        [sent_ids[k] for i in [sent_tokenize_d(j) for j in input.split(",")] for k in i]
+        [sent_ids[k] for i in segmenter().segment_many(input.split(",")) for k in i]
         sent_ids = dict(sent_ids)
 
         # freeze and reverse the resource id dictionary
@@ -188,10 +220,10 @@ class RIO(object):
 
         # chunk the resource into sentences and label them
         # this is a dictionary of resource_id:kb_entry
+        sentences = kb_sentences(kb)
         chunks = {k:v
-                  for indx, i in enumerate(kb)
-                  for k,v in [(resource_ids[j], indx)
-                              for j in sent_tokenize_d((i["metadata"]["title"] if i["metadata"]["title"] != None else "")+" "+i["text"])]}
+                  for indx, i in enumerate(sentences)
+                  for k,v in [(resource_ids[j], indx) for j in i]}
 
         # freeze and reverse the resource id dictionary
         # so this is now a dict of resource_id:text
@@ -202,59 +234,88 @@ class RIO(object):
         # hard limit of 5500
         sentences = "".join([text+f" [{indx}]\n " for indx, text in resource_ids.items()])[:5500]
 
+        return sent_ids, resource_ids, chunks, tagged_input, sentences
+
+    def __resources(self, output, kb, sent_ids, resource_ids, chunks):
+        res, citations, inputs = self.__prompt.output_parser.parse(output)
+
+        return self.__cite(res, citations, inputs, kb, sent_ids, resource_ids, chunks)
+
+    def __cite(self, res, citations, inputs, kb, sent_ids, resource_ids, chunks):
+        # parse citations
+        return [{"headline": headline,
+                 "relavent_input": sent_ids[inp],
+                 "resource": {"quote": resource_ids[i],
+                              "chunk": kb[chunks[i]]}}
+                for i, headline, inp in zip(citations, res, inputs)]
+
+    def __call__(self, input, kb=[], streaming=False):
+        labels = self.__label(input, kb)
+        if not labels:
+            return
+        sent_ids, resource_ids, chunks, tagged_input, sentences = labels
+
         L.debug(f"Starting brainstorm request!!!")
 
         # if we are streaming, inject the streaming tools into the llm
         # and parse accordingly
         if streaming:
             L.debug(f"Streaming !!!")
-            def format_callback(output):
-                res, citations, inputs = self.__prompt.output_parser.parse(output)
-                return [{"headline": headline,
-                        "relavent_input": sent_ids[inp],
-                        "resource": {"quote": resource_ids[i],
-                                    "chunk": kb[chunks[i]]}} for i, headline, inp in zip(citations, res, inputs)]
+            def cite(res, citations, inputs):
+                return self.__cite(res, citations, inputs, kb, sent_ids, resource_ids, chunks)
 
             
-            def remove_callback():
-                self.__chain.llm.callbacks = [i for i in self.__chain.llm.callbacks if type(i) != RIOSingleUseCallbackHandler]
-                
-            # create the callback handler 
-            callback = RIOSingleUseCallbackHandler(format_callback, remove_callback)
-
-            def streaming_generator():
-                while not callback.done:
-                    yield callback.blocking_next()
-
-            # and bind it to the llm
-            self.__chain.llm.streaming = True
-            if type(self.__chain.llm.callbacks) == list:
-                self.__chain.llm.callbacks.append(callback)
-            else:
-                self.__chain.llm.callbacks = [callback]
-
-            self.__chain.llm.temperature = 0
-
-
-            # kick that puppy into motion 
-            thread = threading.Thread(target=self.__chain.predict,
-                                      kwargs={"input": tagged_input,
-                                              "kb": sentences})
-            thread.start()
-            # return nothing
-            return streaming_generator()
+            # create the callback handler, bound to this call only
+            callback = StreamingCallbackHandler(RIOStreamParser(self.__prompt.output_parser, cite))
+
+            # kick that puppy into motion
+            return stream(self.__stream_chain.predict, callback,
+                          input=tagged_input, kb=sentences)
         
 
         output = self.__chain.predict(input=tagged_input, kb=sentences)
-        res, citations, inputs = self.__prompt.output_parser.parse(output)
-
-        # parse citations
-        resources = [{"headline": headline,
-                      "relavent_input": sent_ids[inp],
-                      "resource": {"quote": resource_ids[i],
-                                   "chunk": kb[chunks[i]]}}
-                     for i, headline, inp in zip(citations, res, inputs)]
+        resources = self.__resources(output, kb, sent_ids, resource_ids, chunks)
 
         L.debug(f"All done now with brainstorm")
 
         return resources
+
+    async def acall(self, input, kb=[], streaming=False):
+        """Brainstorm salient comments on `input` from the kb, asynchronously
+
+        Parameters
+        ----------
+        input : str
+            The human's partial thoughts.
+        kb : List[Dict]
+            Resources found by searching the knowledge base.
+        streaming : optional, bool
+            Return an async generator of partial outputs instead.
+
+        Returns
+        -------
+        Optional[List[dict]]
+            The brainstormed resources, or an async generator if streaming.
+        """
+
+        labels = self.__label(input, kb)
+        if not labels:
+            return
+        sent_ids, resource_ids, chunks, tagged_input, sentences = labels
+
+        L.debug(f"Starting async brainstorm request!!!")
+
+        if streaming:
+            def cite(res, citations, inputs):
+                return self.__cite(res, citations, inputs, kb, sent_ids, resource_ids, chunks)
+
+            callback = AsyncStreamingCallbackHandler(RIOStreamParser(self.__prompt.output_parser, cite))
+
+            return astream(self.__stream_chain.apredict(callbacks=[callback],
+                                                        input=tagged_input,
+                                                        kb=sentences), callback)
+
+        output = await self.__chain.apredict(input=tagged_input, kb=sentences)
+
+        L.debug(f"All done now with async brainstorm")
+        return self.__resources(output, kb, sent_ids, resource_ids, chunks)
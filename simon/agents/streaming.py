@@ -0,0 +1,317 @@
+"""
+streaming.py
+Token streaming plumbing shared by the Reason and RIO agents.
+"""
+
+import queue
+import asyncio
+import threading
+
+from langchain.callbacks.base import BaseCallbackHandler, AsyncCallbackHandler
+
+import logging
+L = logging.getLogger("simon")
+
+class StreamParser:
+    """Incrementally parses an LLM's output as tokens arrive
+
+    Only the new suffix of the output is looked at per token: whole
+    lines are handed to `line` once, as they complete, and the
+    unfinished last line to `output`. The full text is parsed once,
+    by `parse`, when the stream closes.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.__line = ""
+
+    def feed(self, token):
+        """Take the next token, returning a new output if there is one
+
+        Parameters
+        ----------
+        token : str
+            The token the LLM just generated.
+
+        Returns
+        -------
+        Optional[any]
+            The output so far, or None if there's nothing new.
+        """
+
+        self.text += token
+        *lines, self.__line = (self.__line+token).split("\n")
+
+        changed = False
+        for i in lines:
+            changed = self.line(i) or changed
+
+        return self.output(self.__line, changed)
+
+    def close(self):
+        """Parse the full text, once generation is done
+
+        Returns
+        -------
+        Optional[any]
+            The final output.
+        """
+
+        return self.parse(self.text)
+
+    def line(self, line):
+        """Take in one complete line; return whether the output changed"""
+        raise NotImplementedError
+
+    def output(self, partial, changed):
+        """The output so far, given the unfinished line, or None"""
+        raise NotImplementedError
+
+    def parse(self, text):
+        """The output of the full text"""
+        raise NotImplementedError
+
+class StreamCancelled(Exception):
+    """Raised into a streaming LLM call to stop it early"""
+
+class StreamingCallbackHandler(BaseCallbackHandler):
+    """Collects parsed outputs of a streaming LLM on a queue
+
+    Iterating over the handler blocks (without spinning) until the
+    next output arrives, and yields every output in order, ending
+    with the one marked done. If the consumer stops iterating early
+    (closes the generator), the LLM call is cancelled at its next token.
+
+    Parameters
+    ----------
+    parser : StreamParser
+        Turns tokens into outputs as they arrive.
+    """
+
+    # so that StreamCancelled propagates into, and stops, the LLM call
+    raise_error = True
+
+    def __init__(self, parser):
+        self.queue = queue.Queue()
+
+        self.__parser = parser
+        self.__cache = None
+        self.__lock = threading.Lock()
+        self.__cancelled = False
+        self.done = False
+
+    def cancel(self):
+        """Stop the LLM call at its next token"""
+
+        self.__cancelled = True
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.__cancelled:
+            raise StreamCancelled("The consumer of this stream went away.")
+
+        try:
+            out = self.__parser.feed(token)
+        except Exception:
+            # a malformed partial output shouldn't end the stream
+            L.debug("Failed to parse partial streaming output.", exc_info=True)
+            return
+
+        if out and out != self.__cache:
+            self.__cache = out
+            self.queue.put({"output": self.__cache, "done": False})
+
+    def on_llm_end(self, response, **kwargs):
+        try:
+            final = self.__parser.close()
+        except Exception:
+            L.exception("Failed to parse final streaming output.")
+            final = None
+
+        self.finish(final)
+
+    def on_llm_error(self, error, **kwargs):
+        L.error(f"Streaming LLM call failed: {error}")
+        self.finish(self.__cache)
+
+    def finish(self, output=None):
+        """Mark the stream done with a final output, if it isn't already"""
+
+        with self.__lock:
+            if self.done:
+                return
+            self.done = True
+
+        self.queue.put({"output": output if output is not None else self.__cache, "done": True})
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.queue.get()
+                yield item
+
+                if item["done"]:
+                    return
+        finally:
+            if not self.done:
+                self.cancel()
+
+def streaming_llm(llm):
+    """A copy of an LLM that streams its tokens
+
+    Agents stream through this copy rather than switching on
+    `streaming` in the LLM they were given, which may be shared
+    with other agents and other requests.
+
+    Parameters
+    ----------
+    llm : BaseChatModel
+        The LLM to copy.
+
+    Returns
+    -------
+    BaseChatModel
+        The same LLM, streaming, at temperature 0.
+    """
+
+    update = {"streaming": True, "temperature": 0}
+
+    # not llm.copy(update=...), which leaves out the fields pydantic
+    # is told to exclude; for langchain's models, that's callbacks
+    return type(llm).construct(_fields_set=llm.__fields_set__ | set(update),
+                               **{**llm.__dict__, **update})
+
+def stream(prediction, callback, **kwargs):
+    """Run a prediction on a thread, yielding the outputs its callback collects
+
+    Parameters
+    ----------
+    prediction : Callable
+        The chain's `predict` method.
+    callback : StreamingCallbackHandler
+        The handler to collect outputs with; it is attached to this
+        call only, so concurrent calls on one chain don't interfere.
+    **kwargs
+        Inputs to the prediction.
+
+    Returns
+    -------
+    Generator[Dict]
+        {"output": formatted output, "done": bool}
+    """
+
+    def run():
+        try:
+            prediction(callbacks=[callback], **kwargs)
+        except StreamCancelled:
+            L.debug("Streaming prediction cancelled.")
+        except Exception:
+            L.exception("Streaming prediction failed.")
+        finally:
+            # in case the LLM never started, or never ended
+            callback.finish()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    return iter(callback)
+
+class AsyncStreamingCallbackHandler(AsyncCallbackHandler):
+    """Collects parsed outputs of a streaming LLM on an asyncio queue
+
+    Like StreamingCallbackHandler, the queue always ends with exactly
+    one output marked done, even if parsing or the LLM call fails.
+
+    Parameters
+    ----------
+    parser : StreamParser
+        Turns tokens into outputs as they arrive.
+    """
+
+    def __init__(self, parser):
+        self.queue = asyncio.Queue()
+
+        self.__parser = parser
+        self.__cache = None
+        self.done = False
+
+    async def on_llm_new_token(self, token, **kwargs):
+        try:
+            out = self.__parser.feed(token)
+        except Exception:
+            # a malformed partial output shouldn't end the stream
+            L.debug("Failed to parse partial streaming output.", exc_info=True)
+            return
+
+        if out and out != self.__cache:
+            self.__cache = out
+            await self.queue.put({"output": self.__cache, "done": False})
+
+    async def on_llm_end(self, response, **kwargs):
+        try:
+            final = self.__parser.close()
+        except Exception:
+            L.exception("Failed to parse final streaming output.")
+            final = None
+
+        self.finish(final)
+
+    async def on_llm_error(self, error, **kwargs):
+        L.error(f"Streaming LLM call failed: {error}")
+        self.finish()
+
+    def finish(self, output=None):
+        """Mark the stream done with a final output, if it isn't already"""
+
+        # everything here runs on the event loop, so no lock is needed
+        if self.done:
+            return
+        self.done = True
+
+        self.queue.put_nowait({"output": output if output is not None else self.__cache, "done": True})
+
+async def astream(prediction, callback):
+    """Run a prediction, yielding the outputs its callback collects
+
+    The prediction is cancelled if the consumer stops early.
+
+    Parameters
+    ----------
+    prediction : Awaitable
+        The chain's `apredict(...)` call, with `callback` attached.
+    callback : AsyncStreamingCallbackHandler
+        The handler collecting outputs for the prediction.
+
+    Yields
+    ------
+    Dict
+        {"output": formatted output, "done": bool}
+    """
+
+    task = asyncio.ensure_future(prediction)
+
+    try:
+        while True:
+            getter = asyncio.ensure_future(callback.queue.get())
+            await asyncio.wait([getter, task], return_when=asyncio.FIRST_COMPLETED)
+
+            if not getter.done():
+                getter.cancel()
+                # the prediction ended (or failed) without a final
+                # output; end the stream with what we have
+                if task.exception() is not None:
+                    L.error(f"Streaming prediction failed: {task.exception()}")
+                callback.finish()
+                while not callback.queue.empty():
+                    item = callback.queue.get_nowait()
+                    yield item
+                    if item["done"]:
+                        return
+                return
+
+            item = getter.result()
+            yield item
+
+            if item["done"]:
+                return
+    finally:
+        if not task.done():
+            task.cancel()
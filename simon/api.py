@@ -30,7 +30,7 @@ import json
 
 # importing everything
 import simon
-from psycopg2 import connect
+from simon.utils import framing
 
 # decorator business
 from functools import wraps
@@ -42,9 +42,19 @@ rest = Flask("simon")
 rest.config['JSON_SORT_KEYS'] = False
 flask.json.provider.DefaultJSONProvider.sort_keys = False
 
-# we first get the database environment
+# we first get the database environment; each request
+# borrows connections from this pool as it needs them
+POOL_SIZE = 16
+
 db = simon.environment.get_db_config()
-cnx = connect(**db)
+pool = simon.ConnectionPool(maxconn=POOL_SIZE, **db)
+
+# LLM and embedding clients, and the agents over them, are built
+# once here; each user gets a light context over them. chunks are
+# searched with pgvector unless SIMON_SEARCH_BACKEND=numpy, which
+# searches them exactly in-process (see components.vectorstore)
+backend = simon.SearchBackend(simon.environment.get_search_backend())
+registry = simon.Registry(pool, backend=backend)
 
 # and create a utility function to hydrate a context
 def get_key_from_request():
@@ -68,12 +78,8 @@ def context(key=None):
     if not key:
         return
 
-    # make open ai
-    (g3, g4, em) = simon.start.make_open_ai()
-    # hydrate!
-    context = simon.AgentContext(g3, g4, em, cnx, key)
-
-    return context
+    # hydrate, over the clients built once for the process
+    return registry.context(key)
 
 # Wrapper function to provide a endpoint below with an
 # already constructed context, by reading from the request
@@ -93,11 +99,22 @@ def contextify(f):
         return f(context=c, *args, **kwds)
     return wrapper
 
-import time
 def json_stream(stream):
     for i in stream:
         yield json.dumps(i)
 
+STREAM_FORMATS = [i.value for i in simon.StreamFormat]
+
+def stream_response(stream, response):
+    """Frame a stream of outputs in the format the client asked for"""
+
+    format = simon.StreamFormat(response)
+
+    if format == simon.StreamFormat.JSON:
+        return json_stream(stream), {"Content-Type": "application/json"}
+
+    return framing.frames(stream, format), {"Content-Type": framing.CONTENT_TYPES[format], **framing.HEADERS}
+
 # call the llm directly
 @rest.route('/query', methods=['GET'])
 @cross_origin()
@@ -107,7 +124,10 @@ def query(context):
 
     @params
     - q : str --- string question/query to provide to the model
-    - response : str --- "stream" to get streaming output
+    - response : str --- "streaming" for back-to-back JSON objects, or "sse" / "ndjson"
+      for framed streams with heartbeats
+    - delta : str --- "1" to stream the resources once and then only what changed,
+      with a final frame holding the whole output; composes with any response format
 
     @headers
     authorization: bearer - context ID
@@ -120,7 +140,8 @@ def query(context):
     arguments = request.args
     q = arguments.get("q", "").strip()
     response = arguments.get("response", "").strip()
-    streaming = (response == "streaming")
+    streaming = (response in STREAM_FORMATS)
+    delta = (arguments.get("delta", "").strip().lower() in ("1", "true"))
 
     if q == "":
         return {
@@ -128,10 +149,10 @@ def query(context):
             "message": "no query was provided"
         }, 400
 
-    search = simon.Search(context)
+    search = registry.search(context.uid)
 
     if streaming:
-        return json_stream(search.query(q, True)), {"Content-Type": "application/json"}
+        return stream_response(search.query(q, True, delta), response)
     else:
         return {
             "response": search.query(q),
@@ -146,7 +167,10 @@ def brainstorm(context):
 
     @params
     - q : str --- string question/query to provide to the model
-    - response : str --- "stream" to get streaming output
+    - response : str --- "streaming" for back-to-back JSON objects, or "sse" / "ndjson"
+      for framed streams with heartbeats
+    - delta : str --- "1" to stream the resources once and then only what changed,
+      with a final frame holding the whole output; composes with any response format
 
     @headers
     authorization: bearer - context ID
@@ -159,7 +183,8 @@ def brainstorm(context):
     arguments = request.args
     q = arguments.get("q", "").strip()
     response = arguments.get("response", "").strip()
-    streaming = (response == "streaming")
+    streaming = (response in STREAM_FORMATS)
+    delta = (arguments.get("delta", "").strip().lower() in ("1", "true"))
 
     if q == "":
         return {
@@ -167,10 +192,10 @@ def brainstorm(context):
             "message": "no query was provided"
         }, 400
 
-    s = simon.Search(context)
+    s = registry.search(context.uid)
 
     if streaming:
-        return json_stream(s.brainstorm(q, True)), {"Content-Type": "application/json"}
+        return stream_response(s.brainstorm(q, True, delta), response)
     else:
         return {
             "response": s.brainstorm(q),
@@ -205,7 +230,7 @@ def search(context):
             "message": "no query was provided"
         }, 400
 
-    search = simon.Search(context)
+    search = registry.search(context.uid)
 
     return {
         "response": search.search(q),
@@ -241,7 +266,7 @@ def autocomplete(context):
             "message": "no query was provided"
         }, 400
 
-    search = simon.Search(context)
+    search = registry.search(context.uid)
 
     return {
         "response": list(set(search.autocomplete(q))),
@@ -287,7 +312,7 @@ def store_text(context):
             "message": "no title is provided"
         }, 400
 
-    search = simon.Datastore(context)
+    search = registry.datastore(context.uid)
 
     return {
         "response": search.store_text(text, title, source),
@@ -328,7 +353,7 @@ def store_media(context):
             "message": "no title is provided"
         }, 400
 
-    search = simon.Datastore(context)
+    search = registry.datastore(context.uid)
 
     return {
         "response": search.store_remote_remote(url, title),
@@ -359,7 +384,7 @@ def forget(context):
             "message": "no resource id was provided"
         }, 400
 
-    search = simon.Datastore(context)
+    search = registry.datastore(context.uid)
 
     return {
         "response": search.delete(hash),
@@ -368,9 +393,26 @@ def forget(context):
 
 
 
-# remember to close the connection
+# database pool health
+@rest.route('/stats', methods=['GET'])
+@cross_origin()
+def stats():
+    """connection pool metrics
+
+    @returns JSON
+    - response: JSON --- connections in use, pool bounds, and wait times; and
+      setup time saved by building clients once
+    - status: str --- status, usually success
+    """
+
+    return {
+        "response": {"pool": pool.stats, "registry": registry.stats},
+        "status": "success"
+    }
+
+# remember to close the connections
 import atexit
-atexit.register(lambda:cnx.close())
+atexit.register(lambda:pool.close())
 
 # debug 
 if __name__ == "__main__":
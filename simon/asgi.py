@@ -0,0 +1,422 @@
+"""
+asgi.py
+An async (ASGI) variant of the reference Simon REST API.
+
+Exposes the same routes as api.py on an event loop; serve it
+with any ASGI server, e.g. `hypercorn simon.asgi:rest`.
+"""
+
+# logging
+import logging as L
+
+LOG_FORMAT = '[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s'
+L.basicConfig(format=LOG_FORMAT, level=L.WARNING)
+L.getLogger('simon').setLevel(L.DEBUG)
+
+# quart!
+try:
+    from quart import Quart, request
+    from quart_cors import route_cors
+except ModuleNotFoundError:
+    raise ModuleNotFoundError("We can't find the async API dependencies. Ensure you have installed the \'async\' variant of Simon with 'pip install simon-search[async]'.")
+
+# api handling
+import json
+import asyncio
+
+# importing everything
+import simon
+from simon.utils import framing
+
+# decorator business
+from functools import wraps, partial
+from concurrent.futures import ThreadPoolExecutor
+
+rest = Quart("simon")
+rest.config['JSON_SORT_KEYS'] = False
+rest.json.sort_keys = False
+
+# we first get the database environment; each request
+# borrows connections from these pools as it needs them:
+# reads go through the async pool, ingestion through the other
+POOL_SIZE = 32
+
+db = simon.environment.get_db_config()
+pool = simon.ConnectionPool(maxconn=POOL_SIZE, **db)
+apool = simon.components.pool.async_pool(maxconn=POOL_SIZE, **db)
+
+# LLM and embedding clients, and the agents over them, are built
+# once here; each user gets a light context over them. chunks are
+# searched with pgvector unless SIMON_SEARCH_BACKEND=numpy, which
+# searches them exactly in-process (see components.vectorstore)
+backend = simon.SearchBackend(simon.environment.get_search_backend())
+registry = simon.Registry(pool, apool, backend=backend)
+
+# ingestion calls, which still block, run here so that the
+# event loop itself never waits on them
+_EXECUTOR = ThreadPoolExecutor(max_workers=128, thread_name_prefix="simon-asgi")
+
+async def blocking(f, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, partial(f, *args, **kwargs))
+
+# and create a utility function to hydrate a context
+def get_key_from_request():
+    headers = request.headers.get('Authorization')
+
+    if not headers:
+        return None
+
+    token = headers.split()[1].strip()
+
+    if token == "":
+        return None
+
+    return token
+
+def context(key=None):
+    # TODO validate api key here
+
+    if not key:
+        key = get_key_from_request()
+    if not key:
+        return
+
+    # hydrate, over the clients built once for the process
+    return registry.context(key)
+
+# Wrapper function to provide a endpoint below with an
+# already constructed context, by reading from the request
+# authorization header for the UID
+def contextify(f):
+    @wraps(f)
+    async def wrapper(*args, **kwds):
+        c = context()
+
+        if not c:
+            return {
+                "status": "error",
+                "message": "the UID or API key you provided in the Authorization header is not found or incorrect"
+            }, 403
+
+        return await f(context=c, *args, **kwds)
+    return wrapper
+
+async def json_stream(stream):
+    async for i in stream:
+        yield json.dumps(i)
+
+STREAM_FORMATS = [i.value for i in simon.StreamFormat]
+
+def stream_response(stream, response):
+    """Frame a stream of outputs in the format the client asked for"""
+
+    format = simon.StreamFormat(response)
+
+    if format == simon.StreamFormat.JSON:
+        return json_stream(stream), {"Content-Type": "application/json"}
+
+    return framing.aframes(stream, format), {"Content-Type": framing.CONTENT_TYPES[format], **framing.HEADERS}
+
+# call the llm directly
+@rest.route('/query', methods=['GET'])
+@route_cors(allow_origin="*")
+@contextify
+async def query(context):
+    """ask your model a question
+
+    @params
+    - q : str --- string question/query to provide to the model
+    - response : str --- "streaming" for back-to-back JSON objects, or "sse" / "ndjson"
+      for framed streams with heartbeats
+    - delta : str --- "1" to stream the resources once and then only what changed,
+      with a final frame holding the whole output; composes with any response format
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: JSON --- JSON paylod returned from the model
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    q = arguments.get("q", "").strip()
+    response = arguments.get("response", "").strip()
+    streaming = (response in STREAM_FORMATS)
+    delta = (arguments.get("delta", "").strip().lower() in ("1", "true"))
+
+    if q == "":
+        return {
+            "status": "error",
+            "message": "no query was provided"
+        }, 400
+
+    search = registry.search(context.uid)
+
+    if streaming:
+        return stream_response(await search.aquery(q, True, delta), response)
+    else:
+        return {
+            "response": await search.aquery(q),
+            "status": "success"
+        }
+
+@rest.route('/brainstorm', methods=['GET'])
+@route_cors(allow_origin="*")
+@contextify
+async def brainstorm(context):
+    """make your model underline text and fetch approrpiate resources
+
+    @params
+    - q : str --- string question/query to provide to the model
+    - response : str --- "streaming" for back-to-back JSON objects, or "sse" / "ndjson"
+      for framed streams with heartbeats
+    - delta : str --- "1" to stream the resources once and then only what changed,
+      with a final frame holding the whole output; composes with any response format
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: JSON --- JSON paylod returned from the model
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    q = arguments.get("q", "").strip()
+    response = arguments.get("response", "").strip()
+    streaming = (response in STREAM_FORMATS)
+    delta = (arguments.get("delta", "").strip().lower() in ("1", "true"))
+
+    if q == "":
+        return {
+            "status": "error",
+            "message": "no query was provided"
+        }, 400
+
+    s = registry.search(context.uid)
+
+    if streaming:
+        return stream_response(await s.abrainstorm(q, True, delta), response)
+    else:
+        return {
+            "response": await s.abrainstorm(q),
+            "status": "success"
+        }
+
+# regular search
+@rest.route('/search', methods=['GET'])
+@route_cors(allow_origin="*")
+@contextify
+async def search(context):
+    """good ol' fashion search
+
+    @params
+    - q : str --- the beginning of your query
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: JSON --- JSON paylod returned from the model
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    q = arguments.get("q", "").strip()
+
+    if q == "":
+        return {
+            "status": "error",
+            "message": "no query was provided"
+        }, 400
+
+    search = registry.search(context.uid)
+
+    return {
+        "response": await search.asearch(q),
+        "status": "success"
+    }
+
+# automcomplete document title
+@rest.route('/autocomplete', methods=['GET'])
+@route_cors(allow_origin="*")
+@contextify
+async def autocomplete(context):
+    """come up with possible documents based on the title
+
+    @params
+    - q : str --- the beginning of your query
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: JSON --- JSON paylod returned from the model
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    q = arguments.get("q", "").strip()
+
+    if q == "":
+        return {
+            "status": "error",
+            "message": "no query was provided"
+        }, 400
+
+    search = registry.search(context.uid)
+
+    return {
+        "response": list(set(await search.aautocomplete(q))),
+        "status": "success"
+    }
+
+# store text
+@rest.route('/store_text', methods=['PUT'])
+@route_cors(allow_origin="*")
+@contextify
+async def store_text(context):
+    """store text into the system
+
+    @params
+    - text : str --- the body content of the document to store
+    - title : str --- title of the document
+    - source : str --- reference to the source of this document for backtracing
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: str --- the text that you just ingested
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    text = arguments.get("text", "").strip()
+    title = arguments.get("title", "").strip()
+    source = arguments.get("source", "").strip()
+
+    if text == "":
+        return {
+            "status": "error",
+            "message": "no source text was provided"
+        }, 400
+
+    if title == "":
+        return {
+            "status": "error",
+            "message": "no title is provided"
+        }, 400
+
+    store = registry.datastore(context.uid)
+
+    return {
+        "response": await blocking(store.store_text, text, title, source),
+        "status": "success"
+    }
+
+@rest.route('/store_media', methods=['PUT'])
+@route_cors(allow_origin="*")
+@contextify
+async def store_media(context):
+    """store media into the system
+
+    @params
+    - url : str --- the url to the media object to store
+    - title : str --- title of the document
+
+    @headers
+    authorization: bearer - context ID
+
+    @returns JSON
+    - response: str --- the text that you just ingested
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    url = arguments.get("url", "").strip()
+    title = arguments.get("title", "").strip()
+
+    if url == "":
+        return {
+            "status": "error",
+            "message": "no media url was provided"
+        }, 400
+
+    if title == "":
+        return {
+            "status": "error",
+            "message": "no title is provided"
+        }, 400
+
+    store = registry.datastore(context.uid)
+
+    return {
+        "response": await blocking(store.store_remote, url, title),
+        "status": "success"
+    }
+
+# forget a document
+@rest.route('/forget', methods=['POST'])
+@route_cors(allow_origin="*")
+@contextify
+async def forget(context):
+    """make the assistant unread a URL based on the hash
+
+    @params
+    - resource_id : str --- the resource ID, given by /read
+
+    @returns JSON:
+    - resource_id: str --- string hash representing the ID of the document, useful for /forget
+    - status: str --- status, usually success
+    """
+
+    arguments = request.args
+    hash = arguments.get("resource_id", "").strip()
+
+    if hash == "":
+        return {
+            "status": "error",
+            "message": "no resource id was provided"
+        }, 400
+
+    store = registry.datastore(context.uid)
+
+    return {
+        "response": await blocking(store.delete, hash),
+        "status": "success"
+    }
+
+# database pool health
+@rest.route('/stats', methods=['GET'])
+@route_cors(allow_origin="*")
+async def stats():
+    """connection pool metrics
+
+    @returns JSON
+    - response: JSON --- connections in use, pool bounds, and wait times; and
+      setup time saved by building clients once
+    - status: str --- status, usually success
+    """
+
+    return {
+        "response": {"pool": pool.stats, "registry": registry.stats},
+        "status": "success"
+    }
+
+# async pools must be opened inside the serving loop
+@rest.before_serving
+async def startup():
+    await apool.open()
+
+# remember to close the connections
+@rest.after_serving
+async def shutdown():
+    _EXECUTOR.shutdown(wait=False)
+    await apool.close()
+    pool.close()
+
+# debug
+if __name__ == "__main__":
+    rest.run(debug=True, port=8086)
@@ -0,0 +1,170 @@
+"""
+adocuments.py
+Async counterparts of the read paths in documents.py.
+
+These run on AgentContext.apool (a psycopg 3 AsyncConnectionPool).
+Without one, they fall back to running their blocking counterpart
+on a worker thread, so they are safe to call with any context.
+"""
+
+import asyncio
+from functools import wraps
+
+import logging
+L = logging.getLogger("simon")
+
+from ..models import *
+from .embeddings import aembed_queries
+from .documents import (_context_of, search, get_range_chunks, autocomplete,
+                        get_query_rewrite, corpus_version, cache_query_rewrite,
+                        search_results, plan_chunks, stitch_chunks,
+                        range_chunks, range_chunks_params, RANGE_CHUNKS,
+                        BATCHED_CHUNK_SEARCH, BATCHED_FULLTEXT_SEARCH)
+
+# Async counterpart to dbsafe: runs `f` on the context's async pool,
+# or `fallback` on a thread if the context has none
+def adbsafe(fallback):
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwds):
+            context = _context_of(args, kwds)
+
+            if not context or context.apool is None:
+                return await asyncio.to_thread(fallback, *args, **kwds)
+
+            from psycopg.errors import UndefinedTable
+            try:
+                return await f(*args, **kwds)
+            except UndefinedTable:
+                raise ValueError("The database we are provided has not been initialized.\nHint: call `simon.setup(context)` to set up the tables needed for Simon. You only have to do this once per new psql database you use.")
+        return wrapper
+    return decorator
+
+#### GETTERS ####
+@adbsafe(get_range_chunks)
+async def aget_range_chunks(queries, context):
+    """Read a group of documents possibly stored in the cache by chunk.
+
+    Parameters
+    ----------
+    queries: List[Tuple[str, int, int]]
+        [(hash, start, end), ...]
+    context : AgentContext
+        The context pointer to use to perform parsing.
+
+    Return
+    ------
+    Dict[str, List[Tuple[int, str]]]
+        (seq, text) of each chunk fetched per hash; see get_range_chunks.
+    """
+
+    if len(queries) == 0:
+        return {}
+
+    async with context.apool.connection() as cnx:
+        cur = await cnx.execute(RANGE_CHUNKS, range_chunks_params(queries, context))
+        res = await cur.fetchall()
+
+    return range_chunks(res)
+
+@adbsafe(get_query_rewrite)
+async def aget_query_rewrite(key:str, context:AgentContext):
+    """Read a cached QueryBreaker rewrite; see get_query_rewrite."""
+
+    async with context.apool.connection() as cnx:
+        cur = await cnx.execute("SELECT queries FROM simon_query_cache WHERE hash = %s LIMIT 1;", (key,))
+        res = await cur.fetchone()
+
+    if not res:
+        return False, None
+
+    return True, res[0]
+
+@adbsafe(corpus_version)
+async def acorpus_version(context:AgentContext):
+    """Read the version of this uid's corpus; see corpus_version."""
+
+    async with context.apool.connection() as cnx:
+        cur = await cnx.execute("SELECT version FROM simon_corpus_version WHERE uid = %s;", (context.uid,))
+        res = await cur.fetchone()
+
+    if not res:
+        return 0
+
+    return res[0]
+
+@adbsafe(autocomplete)
+async def aautocomplete(query:str, context:AgentContext, k=8):
+    """string automcomplete to suggest article titles; see autocomplete."""
+
+    async with context.apool.connection() as cnx:
+        cur = await cnx.execute("SELECT title FROM simon_paragraphs WHERE uid = %s AND LOWER( title ) LIKE %s LIMIT %s;",
+                                (context.uid, query.lower()+"%", k))
+        res = await cur.fetchall()
+
+    return [i[0] for i in res]
+
+@adbsafe(search)
+async def asearch(context:AgentContext, queries=[], query:str=None, search_type=IndexClass.CHUNK, k=5, tf_threshold=1.5,
+                  batched=True):
+    """search the database based on a query, asynchronously
+
+    Always sends every query in one statement; see search for the
+    meaning of each parameter.
+
+    Return
+    ------
+    List[str]
+        Results of the search.
+    """
+
+    # the local vector store is searched on a thread, as it blocks
+    if search_type==IndexClass.CHUNK and context.backend==SearchBackend.NUMPY:
+        return await asyncio.to_thread(search, context, queries, query, search_type, k, tf_threshold, batched)
+
+    if not queries:
+        queries = [query]
+
+    # calculate result to return per query
+    k = (k//len(queries))+1
+
+    L.debug(f"fufilling async search request for {queries}...")
+
+    if search_type==IndexClass.FULLTEXT:
+        sql = BATCHED_FULLTEXT_SEARCH
+        targets = list(queries)
+    else:
+        # ivfflat.probes is set per connection by the async pool
+        sql = BATCHED_CHUNK_SEARCH
+        targets = [str(i) for i in await aembed_queries(queries, context)]
+
+    async with context.apool.connection() as cnx:
+        cur = await cnx.execute(sql, (targets, context.uid, tf_threshold, k))
+        res = await cur.fetchall()
+
+    L.debug(f"done with {queries}...")
+    return search_results(res)
+
+#### SETTERS ####
+@adbsafe(cache_query_rewrite)
+async def acache_query_rewrite(key:str, queries, context:AgentContext):
+    """cache a QueryBreaker rewrite; see cache_query_rewrite."""
+
+    async with context.apool.connection() as cnx:
+        await cnx.execute("INSERT INTO simon_query_cache (hash, queries) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                          (key, queries if queries else None))
+
+#### GLUE ####
+async def aassemble_chunks(results, context, padding=1):
+    """Assemble CHUNK type results into a string; see assemble_chunks."""
+
+    # otherwise it'd be empty!
+    if len(results) == 0:
+        return ""
+
+    hashes, stitched_ranges, to_fetch = plan_chunks(results, padding)
+
+    # fetch the text
+    chunks = await aget_range_chunks(to_fetch, context)
+
+    return stitch_chunks(hashes, stitched_ranges, chunks)
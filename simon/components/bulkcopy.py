@@ -0,0 +1,151 @@
+"""
+bulkcopy.py
+Binary COPY writers for the paragraph and fulltext indicies.
+"""
+
+import struct
+
+import logging
+L = logging.getLogger("simon")
+
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+INT4_OID = 23
+
+#### FIELD ENCODERS ####
+def _field(data):
+    if data is None:
+        return struct.pack("!i", -1)
+
+    return struct.pack("!i", len(data)) + data
+
+def _text(value):
+    return _field(None if value is None else str(value).encode("utf-8"))
+
+def _float8(value):
+    return _field(None if value is None else struct.pack("!d", float(value)))
+
+def _int4(value):
+    return _field(None if value is None else struct.pack("!i", int(value)))
+
+def _vector(value):
+    # pgvector's binary form: int16 dimensions, int16 unused, float4s
+    if value is None:
+        return _field(None)
+
+    return _field(struct.pack(f"!hh{len(value)}f", len(value), 0, *value))
+
+def _int4_array(value):
+    # one dimensional int4[]: ndim, has nulls, element oid, then the
+    # dimension's length and lower bound, then each element
+    if value is None:
+        return _field(None)
+    if len(value) == 0:
+        return _field(struct.pack("!iii", 0, 0, INT4_OID))
+
+    return _field(struct.pack(f"!iiiii{'ii'*len(value)}", 1, 0, INT4_OID, len(value), 1,
+                              *[j for i in value for j in (4, int(i))]))
+
+class CopyStream:
+    """File-like adapter which lazily renders rows in binary COPY format
+
+    psycopg2's `copy_expert` calls `read` on this as it streams to the
+    server, so the whole payload never has to sit in memory at once.
+
+    Parameters
+    ----------
+    rows : Iterable[tuple]
+        The rows to write.
+    encoders : List[Callable]
+        One field encoder per column, in column order.
+    """
+
+    def __init__(self, rows, encoders):
+        self.__chunks = self.__render(rows, encoders)
+        self.__buffer = b""
+        self.rows = 0
+
+    def __render(self, rows, encoders):
+        yield COPY_HEADER
+        count = struct.pack("!h", len(encoders))
+
+        for row in rows:
+            self.rows += 1
+            yield count + b"".join(encode(value) for encode, value in zip(encoders, row))
+
+        yield COPY_TRAILER
+
+    def read(self, size=-1):
+        while size < 0 or len(self.__buffer) < size:
+            try:
+                self.__buffer += next(self.__chunks)
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self.__buffer)
+
+        res, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return res
+
+    readline = read
+
+#### WRITERS ####
+def copy_paragraphs(cur, rows):
+    """Write chunk-level rows with binary COPY
+
+    Parameters
+    ----------
+    cur : cursor
+        The psycopg2 cursor to write with.
+    rows : Iterable[list]
+        (hash, uid, text, embedding, src, title, tf, seq, total, sentences)
+        rows, as built by `bulk_index`.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+    """
+
+    stream = CopyStream(rows, [_text, _text, _text, _vector, _text,
+                               _text, _float8, _int4, _int4, _int4_array])
+    cur.copy_expert("COPY simon_paragraphs (hash, uid, text, embedding, src, title, tf, seq, total, sentences) FROM STDIN WITH (FORMAT binary);",
+                    stream)
+
+    return stream.rows
+
+def copy_fulltext(cur, rows):
+    """Write document-level rows with binary COPY, skipping indexed ones
+
+    COPY can't skip conflicting rows, so the rows are copied into a
+    temporary staging table first, and moved over with
+    ON CONFLICT DO NOTHING.
+
+    Parameters
+    ----------
+    cur : cursor
+        The psycopg2 cursor to write with.
+    rows : Iterable[tuple]
+        (hash, uid, text, src, title) rows, as built by `bulk_index`.
+
+    Returns
+    -------
+    List[str]
+        The hashes of the documents actually written.
+    """
+
+    cur.execute("CREATE TEMPORARY TABLE IF NOT EXISTS simon_fulltext_staging "
+                "(hash TEXT, uid TEXT, text TEXT, src TEXT, title TEXT) ON COMMIT DELETE ROWS;")
+    cur.execute("TRUNCATE simon_fulltext_staging;")
+
+    stream = CopyStream(rows, [_text, _text, _text, _text, _text])
+    cur.copy_expert("COPY simon_fulltext_staging (hash, uid, text, src, title) FROM STDIN WITH (FORMAT binary);",
+                    stream)
+
+    cur.execute("INSERT INTO simon_fulltext (hash, uid, text, src, title) "
+                "SELECT hash, uid, text, src, title FROM simon_fulltext_staging "
+                "ON CONFLICT (uid, hash) DO NOTHING RETURNING hash;")
+
+    return [i[0] for i in cur.fetchall()]
@@ -27,6 +27,7 @@ from langchain.embeddings.base import Embeddings
 
 # nltk
 from ..utils.helpers import sent_tokenize_d
+from ..utils.segmentation import segmenter, sentence_spans
 
 # tika
 from tika import parser
@@ -34,8 +35,6 @@ from tika import parser
 # soup
 from bs4 import BeautifulSoup
 
-# TFIDF
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 # decorator business
 from functools import wraps
@@ -44,23 +43,41 @@ from functools import wraps
 import json
 
 from ..models import *
+from .embeddings import embed_documents, embed_queries
+from .bulkcopy import copy_paragraphs, copy_fulltext
+from .tfidf import score_batch
+from .pool import borrow
+from . import vectorstore
 
 from psycopg2.errors import InFailedSqlTransaction, UndefinedTable
 
+def _context_of(args, kwds):
+    # try to get the context from the function
+    context = kwds.get("context")
+    if not context:
+        for i in args:
+            if type(i) == AgentContext:
+                context = i
+
+    return context
+
 # Wrapper function to provide database safety (caching db errors
-# or warning about undefined table)
+# or warning about undefined table); if the context is backed by
+# a connection pool, a connection is borrowed for the call
 def dbsafe(f):
     @wraps(f)
     def wrapper(*args, **kwds):
+        context = _context_of(args, kwds)
+
+        if context and context.pool is not None:
+            with borrow(context) as borrowed:
+                args = tuple(borrowed if i is context else i for i in args)
+                kwds = {k:(borrowed if v is context else v) for k,v in kwds.items()}
+                return wrapper(*args, **kwds)
+
         try: 
             return f(*args, **kwds)
         except (InFailedSqlTransaction, UndefinedTable) as e:
-            # try to get the context from the function
-            context = kwds.get("context")
-            if not context:
-                for i in args:
-                    if type(i) == AgentContext:
-                        context = i
 
             # try to retry any failed transactions
             if type(e) == InFailedSqlTransaction:
@@ -78,9 +95,10 @@ def dbsafe(f):
 
 
 #### SANITIZERS ####
-def __chunk(text):
+def __chunk(text, sentences=None):
 
-    sentences = sent_tokenize_d(text)
+    if sentences is None:
+        sentences = sent_tokenize_d(text)
      
     # makes groups of 5 sentences, joined, as the chunks
     parsed_chunks = [re.sub(r" +", " "," ".join(sentences[i:i+3]).strip()).strip()
@@ -125,7 +143,42 @@ def parse_text(text, title=None, source=None) -> ParsedDocument:
     parsed_chunks, parsed_text, hash = __chunk(text)
 
     # return!
-    return ParsedDocument(parsed_text, parsed_chunks, meta)
+    return ParsedDocument(parsed_text, parsed_chunks, meta, hash)
+
+def parse_texts(texts, titles=None, sources=None) -> List[ParsedDocument]:
+    """Parse many texts at once; see parse_text.
+
+    Sentence segmentation runs over the whole batch, spread across
+    worker processes if the batch is large.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The raw texts to be parsed.
+    titles : optional, List[str]
+        Force a specific title for each text.
+    sources : optional, List[str]
+        Force a specific source for each text.
+
+    Returns
+    -------
+    List[ParsedDocument]
+        The parsed documents.
+    """
+
+    titles = titles if titles else [None]*len(texts)
+    sources = sources if sources else [None]*len(texts)
+
+    parsed = []
+    for text, sentences, title, source in zip(texts, segmenter().segment_many(texts),
+                                              titles, sources):
+        parsed_chunks, parsed_text, hash = __chunk(text, sentences)
+        parsed.append(ParsedDocument(parsed_text, parsed_chunks, {
+            "source": source,
+            "title": title,
+        }, hash))
+
+    return parsed
 
 def parse_tika(uri, title=None, source=None) -> ParsedDocument:
     """Parse a local document using Tika and Tesseract
@@ -317,6 +370,28 @@ def get_range_chunk(hash, start, end, context):
 
     return result
 
+# one index range scan per (hash, start, end) triple; ordinality keeps
+# the chunks grouped by range, and in order within each range
+RANGE_CHUNKS = ("SELECT p.text, p.hash, p.seq, p.sentences FROM unnest(%s::text[], %s::integer[], %s::integer[]) WITH ORDINALITY AS q(hash, start, stop, indx) "
+                "CROSS JOIN LATERAL (SELECT text, hash, seq, sentences FROM simon_paragraphs "
+                "WHERE uid = %s AND hash = q.hash AND seq >= q.start AND seq <= q.stop) p "
+                "ORDER BY q.indx, p.seq;")
+
+def range_chunks_params(queries, context):
+    """Parameters for RANGE_CHUNKS given (hash, start, end) triples"""
+
+    hashes, starts, ends = zip(*queries)
+    return (list(hashes), list(starts), list(ends), context.uid)
+
+def range_chunks(rows):
+    """Group rows of (text, hash, seq, sentences) by hash, keeping their order"""
+
+    data = defaultdict(list)
+    for (text, hash, seq, sentences) in rows:
+        data[hash].append((seq, text, sentence_spans(sentences)))
+
+    return dict(data)
+
 @dbsafe
 def get_range_chunks(queries, context):
     """Read a group of documents possibly stored in the cache by chunk.
@@ -330,25 +405,20 @@ def get_range_chunks(queries, context):
 
     Return
     ------
-    Optional[List[str]]
-        list of results, or None.
+    Dict[str, List[Tuple[int, str, Optional[List[Tuple[int, int]]]]]]
+        (seq, text, sentence spans) of each chunk fetched per hash,
+        in the order of the queried ranges, and by seq within each range.
     """
 
-    cur = context.cnx.cursor()
+    if len(queries) == 0:
+        return {}
 
     cur = context.cnx.cursor()
-    sqls = [cur.mogrify("(SELECT text,hash FROM simon_paragraphs WHERE hash = %s AND uid = %s AND seq >= %s AND seq <= %s ORDER BY seq)", (hash, context.uid, start, end))
-            for (hash, start, end) in queries]
-
-    cur.execute(b" UNION ".join(sqls)+b";")
+    cur.execute(RANGE_CHUNKS, range_chunks_params(queries, context))
     res = cur.fetchall()
-
-    data = defaultdict(list)
-    for (text, hash) in res:
-        data[hash].append(text)
     cur.close()
 
-    return dict(data)
+    return range_chunks(res)
 
 @dbsafe
 def top_tf(hash:str, context:AgentContext, k=3):
@@ -380,6 +450,61 @@ def top_tf(hash:str, context:AgentContext, k=3):
 
     return result
 
+@dbsafe
+def get_query_rewrite(key:str, context:AgentContext):
+    """Read a cached QueryBreaker rewrite.
+
+    Parameters
+    ----------
+    key : str
+        The rewrite's cache key.
+    context : AgentContext
+        The context pointer to use to perform parsing.
+
+    Return
+    ------
+    Tuple[bool, Optional[List[str]]]
+        Whether the rewrite was found, and the rewritten queries
+        (None if the question could not be rewritten).
+    """
+
+    cur = context.cnx.cursor()
+
+    cur.execute("SELECT queries FROM simon_query_cache WHERE hash = %s LIMIT 1;", (key,))
+    res = cur.fetchone()
+    cur.close()
+
+    if not res:
+        return False, None
+
+    return True, res[0]
+
+@dbsafe
+def corpus_version(context:AgentContext):
+    """Read the version of this uid's corpus, which changes on every write.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The context pointer to use to perform parsing.
+
+    Return
+    ------
+    int
+        The version; 0 if nothing was ever written.
+    """
+
+    cur = context.cnx.cursor()
+
+    cur.execute("SELECT version FROM simon_corpus_version WHERE uid = %s;", (context.uid,))
+    res = cur.fetchone()
+    cur.close()
+
+    if not res:
+        return 0
+
+    return res[0]
+
 @dbsafe
 def autocomplete(query:str, context:AgentContext, k=8):
     """string automcomplete to suggest article titles
@@ -409,8 +534,42 @@ def autocomplete(query:str, context:AgentContext, k=8):
 
     return result
 
+# one lateral lookup per query; ordinality keeps the results
+# grouped by query, in rank order within each query
+BATCHED_FULLTEXT_SEARCH = ("SELECT r.text, r.hash, r.src, r.title, r.tf, r.seq, r.total, r.sentences FROM unnest(%s::text[]) WITH ORDINALITY AS q(query, indx) "
+                           "CROSS JOIN LATERAL (SELECT text, hash, src, title, tf, seq, total, sentences FROM simon_paragraphs "
+                           "WHERE uid = %s AND TF > %s AND text_fuzzy @@ plainto_tsquery('english', q.query) LIMIT %s) r "
+                           "ORDER BY q.indx;")
+BATCHED_CHUNK_SEARCH = ("SELECT r.text, r.hash, r.src, r.title, r.tf, r.seq, r.total, r.sentences FROM unnest(%s::vector[]) WITH ORDINALITY AS q(embedding, indx) "
+                        "CROSS JOIN LATERAL (SELECT text, hash, src, title, tf, seq, total, sentences, embedding <#> q.embedding AS distance FROM simon_paragraphs "
+                        "WHERE uid = %s AND TF > %s ORDER BY embedding <#> q.embedding LIMIT %s) r "
+                        "ORDER BY q.indx, r.distance;")
+
+# chunks found by the vector store, by (hash, seq), in the order given
+LOCAL_CHUNKS = ("SELECT p.text, p.hash, p.src, p.title, p.tf, p.seq, p.total, p.sentences "
+                "FROM unnest(%s::text[], %s::integer[]) WITH ORDINALITY AS q(hash, seq, indx) "
+                "JOIN simon_paragraphs p ON p.uid = %s AND p.hash = q.hash AND p.seq = q.seq "
+                "ORDER BY q.indx;")
+
+def search_results(rows):
+    """Shape rows of (text, hash, src, title, tf, seq, total, sentences) as search results"""
+
+    return [{
+        "text": text,
+        "hash": hash,
+        "metadata": {
+            "title": title,
+            "source": src,
+            "tf": tf,
+            "seq": seq,
+            "total": total,
+            "sentences": sentence_spans(sentences),
+        }
+    } for (text, hash, src, title, tf, seq, total, sentences) in rows]
+
 @dbsafe
-def search(context:AgentContext, queries=[], query:str=None, search_type=IndexClass.CHUNK, k=5, tf_threshold=1.5):
+def search(context:AgentContext, queries=[], query:str=None, search_type=IndexClass.CHUNK, k=5, tf_threshold=1.5,
+           batched=False):
     """search the database based on a query!
 
     Parameters
@@ -428,6 +587,16 @@ def search(context:AgentContext, queries=[], query:str=None, search_type=IndexCl
         Number of values to return.
     tf_threshold : optional, float
         The TFIDF threshold.
+    batched : optional, bool
+        Send every query in one statement (one network round trip),
+        instead of one statement per query. Results are identical.
+
+    Notes
+    -----
+    If context.backend is SearchBackend.NUMPY, chunk searches are
+    answered exactly from the tenant's vector store instead of the
+    ivfflat index, unless the tenant is too large for one; only the
+    chunks found are then read from the database.
 
     Return
     ------
@@ -444,13 +613,34 @@ def search(context:AgentContext, queries=[], query:str=None, search_type=IndexCl
 
     L.debug(f"fufilling search request for {queries}...")
 
+    if search_type==IndexClass.CHUNK and context.backend==SearchBackend.NUMPY:
+        vectors = vectorstore.store(context, corpus_version(context))
+        if vectors is not None:
+            L.debug(f"searching {len(vectors)} chunks locally for {queries}...")
+            found = [j for i in vectors.search(embed_queries(queries, context), k, tf_threshold) for j in i]
+
+            cur = context.cnx.cursor()
+            cur.execute(LOCAL_CHUNKS, ([i[0] for i in found], [i[1] for i in found], context.uid))
+            results = search_results(cur.fetchall())
+            cur.close()
+
+            return results
+
     requests = []
     embeddings = []
 
-    query_base = "SET LOCAL ivfflat.probes = 20; SELECT text, hash, src, title, tf, seq, total FROM simon_paragraphs "
+    query_base = "SET LOCAL ivfflat.probes = 20; SELECT text, hash, src, title, tf, seq, total, sentences FROM simon_paragraphs "
 
     L.debug(f"building queries for {queries}...")
-    if search_type==IndexClass.FULLTEXT:
+    if batched:
+        if search_type==IndexClass.FULLTEXT:
+            requests.append(BATCHED_FULLTEXT_SEARCH)
+        elif search_type==IndexClass.CHUNK:
+            requests.append("SET LOCAL ivfflat.probes = 20; "+BATCHED_CHUNK_SEARCH)
+
+            L.debug(f"building embeddings for {queries}...")
+            embeddings = embed_queries(queries, context)
+    elif search_type==IndexClass.FULLTEXT:
         for _ in range(len(queries)):
             requests.append(query_base+"WHERE uid = %s AND TF > %s AND text_fuzzy @@ plainto_tsquery('english', %s) LIMIT %s;")
     elif search_type==IndexClass.CHUNK:
@@ -458,29 +648,24 @@ def search(context:AgentContext, queries=[], query:str=None, search_type=IndexCl
             requests.append(query_base+"WHERE uid = %s AND TF > %s ORDER BY embedding <#> %s LIMIT %s;")
 
         L.debug(f"building embeddings for {queries}...")
-        embeddings = [context.embedding.embed_query(q) for q in queries]
+        embeddings = embed_queries(queries, context)
 
     results = []
 
     L.debug(f"executing {queries}...")
     cur = context.cnx.cursor()
 
-    for indx, querystring in enumerate(requests):
-        cur.execute(querystring, (context.uid, tf_threshold, queries[indx] if search_type==IndexClass.FULLTEXT else str(embeddings[indx]), k))
+    if batched:
+        cur.execute(requests[0], (list(queries) if search_type==IndexClass.FULLTEXT else [str(i) for i in embeddings],
+                                  context.uid, tf_threshold, k))
         results += cur.fetchall()
+    else:
+        for indx, querystring in enumerate(requests):
+            cur.execute(querystring, (context.uid, tf_threshold, queries[indx] if search_type==IndexClass.FULLTEXT else str(embeddings[indx]), k))
+            results += cur.fetchall()
 
     L.debug(f"assembling results for {queries}...")
-    results = [{
-        "text": text,
-        "hash": hash,
-        "metadata": {
-            "title": title,
-            "source": src,
-            "tf": tf,
-            "seq": seq,
-            "total": total,
-        }
-    } for (text, hash, src, title, tf, seq, total) in results]
+    results = search_results(results)
 
     L.debug(f"done with {queries}...")
     cur.close()
@@ -505,121 +690,245 @@ def delete_document(hash:str, context:AgentContext):
     cur.execute("DELETE FROM simon_paragraphs WHERE uid = %s AND hash = %s;", (context.uid, hash))
     cur.execute("DELETE FROM simon_fulltext WHERE uid = %s AND hash = %s;", (context.uid, hash))
     cur.execute("DELETE FROM simon_cache WHERE uid = %s AND hash = %s;", (context.uid, hash))
+    bump_corpus_version(context)
 
     context.cnx.commit()
     cur.close()
 
 #### SETTERS ####
-@dbsafe
-def bulk_index(documents:List[ParsedDocument], context:AgentContext):
-    assert len(documents) > 0, "we can't index 0 documents"
+# The phases of bulk_index, shared with the streaming IngestionPipeline
+def indexed_hashes(hashes, context:AgentContext):
+    """Find which of `hashes` are already indexed for this uid.
 
-    L.info(f"Bulk indexing {len(documents)} documents...")
+    Parameters
+    ----------
+    hashes : List[str]
+        Document hashes to check.
+    context : AgentContext
+        Context pointer to be used for operations.
 
-    # get the hashes from the documents
-    hashes = [i.hash for i in documents]
+    Return
+    ------
+    Set[str]
+        The subset of hashes which are already indexed.
+    """
 
-    # and search through for those hashes
-    prefetch = []
+    if len(hashes) == 0:
+        return set()
 
-    L.debug(f"Identifying already indexed documents...")
     cur = context.cnx.cursor()
-    sqls = [cur.mogrify("SELECT hash FROM simon_fulltext WHERE hash = %s AND uid = %s LIMIT 1;", (hash, context.uid))
-            for hash in hashes]
-    cur.execute(b";".join(sqls))
+    cur.execute("SELECT hash FROM simon_fulltext WHERE uid = %s AND hash = ANY(%s);", (context.uid, list(hashes)))
     res = cur.fetchall()
-    res = [i[0] for i in res]
+    cur.close()
 
-    # for hash in hashes:
-                             
-    #     cur.execute("SELECT hash FROM simon_fulltext WHERE hash = %s AND uid = %s LIMIT 1;", (hash, context.uid))
-    #     res = cur.fetchone()
-    #     prefetch.append(res)
+    return {i[0] for i in res}
 
-    # documents to index
-    filtered_documents = list(filter(lambda x:x.hash not in res, documents))
+def bump_corpus_version(context:AgentContext):
+    """Mark this uid's corpus as changed, without committing.
 
-    if len(filtered_documents) == 0:
-        L.debug(f"All of {len(res)} documents are all indexed. Returning...")
-        return
+    Parameters
+    ----------
+    context : AgentContext
+        Context pointer to be used for operations.
+    """
 
-    # remove duplicates
-    filtered_documents = list(set(filtered_documents))
+    cur = context.cnx.cursor()
+    cur.execute("INSERT INTO simon_corpus_version (uid, version) VALUES (%s, 1) ON CONFLICT (uid) DO UPDATE SET version = simon_corpus_version.version + 1;",
+                (context.uid,))
+    cur.close()
 
-    L.debug(f"Total of {len(filtered_documents)} documents remain to truly index.")
+def tfidf(documents:List[ParsedDocument], workers=None):
+    """Score each paragraph of each document by its summed TFIDF.
 
-    L.debug(f"TFIDF analyzing {len(filtered_documents)} documents...")
+    Parameters
+    ----------
+    documents : List[ParsedDocument]
+        Documents to score; IDF is computed within each document.
+    workers : optional, int
+        Processes to fan large batches out over; see score_batch.
 
-    # calculate tfidf for use later
-    tfs = []
-
-    for doc in filtered_documents:
-        try:
-            vectorizer = TfidfVectorizer()
-            X = vectorizer.fit_transform(doc.paragraphs)
-            tf_sum = X.sum(1).squeeze().tolist()[0]
-            tfs.append(tf_sum)
-        except ValueError:
-            L.warning(f"Found document with no analyzable content: {doc.paragraphs}.")
-            tfs.append([0 for _ in doc.paragraphs])
+    Return
+    ------
+    List[List[float]]
+        One score per paragraph, per document.
+    """
+
+    return score_batch([doc.paragraphs for doc in documents], workers)
+
+def chunk_updates(documents:List[ParsedDocument], tfs, context:AgentContext):
+    """Build the strings to embed and the chunk-level rows to write.
+
+    Parameters
+    ----------
+    documents : List[ParsedDocument]
+        Documents to index.
+    tfs : List[List[float]]
+        Output of tfidf(documents).
+    context : AgentContext
+        Context pointer to be used for operations.
+
+    Return
+    ------
+    Tuple[List[str], List[list]]
+        The text to embed per chunk, and the chunk rows with
+        their embedding slot (index 3) left empty.
+    """
 
-    # calculate the documents to embed and chunks to update
     embed_text = []
     updates = []
 
-    L.debug(f"calculating chunk-level updates for {len(filtered_documents)} documents...")
     # We now go through each of the paragraphs. Index if needed, update the hash
     # if we already have the paragraph.
-    for i, doc in enumerate(filtered_documents):
-        tf_vec = tfs[i]
-
+    for doc, tf_vec in zip(documents, tfs):
         for indx, (tf, paragraph) in enumerate(zip(tf_vec, doc.paragraphs)):
             # check if the we already have the element indexed
             embed_text.append((doc.meta.get("title", "")
                                 if doc.meta.get("title", "") else "")+": "+paragraph.strip())
 
             updates.append([doc.hash, context.uid, paragraph, None, doc.meta.get("source", ""),
-                            doc.meta.get("title", ""), tf, indx, len(doc.paragraphs)])
+                            doc.meta.get("title", ""), tf, indx, len(doc.paragraphs), None])
+
+    # store where each sentence is, so agents needn't tokenize chunks at query time
+    spans = segmenter().spans_many([i[2] for i in updates])
+    for i, span in zip(updates, spans):
+        i[9] = [j for pair in span for j in pair]
+
+    return embed_text, updates
+
+def write_updates(documents:List[ParsedDocument], updates, context:AgentContext,
+                  method=WriteMethod.VALUES):
+    """Write embedded chunk rows and their documents, without committing.
+
+    Documents are written first, skipping any another writer has
+    indexed in the meantime; only the chunks of the documents
+    actually written are then written. If any were, the corpus
+    version is bumped.
+
+    Parameters
+    ----------
+    documents : List[ParsedDocument]
+        Documents being indexed.
+    updates : List[list]
+        Chunk rows from chunk_updates, with embeddings filled in.
+    context : AgentContext
+        Context pointer to be used for operations.
+    method : optional, WriteMethod
+        How rows are written.
+
+    Return
+    ------
+    Set[str]
+        The hashes of the documents actually written.
+    """
+
+    cur = context.cnx.cursor()
+
+    L.debug(f"calculating fulltext-level updates for {len(documents)} documents...")
+    # create the document-level updates
+    fulltext = [(doc.hash, context.uid, doc.main_document, doc.meta.get("source", ""),
+                 doc.meta.get("title", "")) for doc in documents]
+
+    L.debug(f"submitting {len(documents)} documents to the document-level index...")
+    if method == WriteMethod.COPY:
+        written = set(copy_fulltext(cur, fulltext))
+    else:
+        written = {i[0] for i in execute_values (
+            cur, "INSERT INTO simon_fulltext (hash, uid, text, src, title) VALUES %s ON CONFLICT (uid, hash) DO NOTHING RETURNING hash;",
+            fulltext, fetch=True
+        )}
+
+    if len(written) < len(documents):
+        L.debug(f"{len(documents)-len(written)} documents were indexed concurrently; skipping their chunks.")
+        updates = [i for i in updates if i[0] in written]
+
+    # perform the updates
+    L.debug(f"submitting {len(written)} documents to the chunk-level index...")
+    write_st = time.time()
+    if method == WriteMethod.COPY:
+        copy_paragraphs(cur, updates)
+    else:
+        execute_values (
+            cur, "INSERT INTO simon_paragraphs (hash, uid, text, embedding, src, title, tf, seq, total, sentences) VALUES %s;",
+            updates
+        )
+    write_et = time.time()
+    L.debug(f"wrote {len(updates)} chunks in {(write_et-write_st):.2f} seconds ({len(updates)/max(write_et-write_st, 1e-6):.0f} rows/sec).")
+
+    cur.close()
+
+    if written:
+        bump_corpus_version(context)
+
+    return written
+
+@dbsafe
+def bulk_index(documents:List[ParsedDocument], context:AgentContext, workers=4,
+               method=WriteMethod.VALUES):
+    """Indexes a list of documents, skipping those already indexed.
+
+    Parameters
+    ----------
+    documents : List[ParsedDocument]
+        Documents to index.
+    context : AgentContext
+        Information about data stores, etc. which determines
+        the context.
+    workers : optional, int
+        How many embedding requests to keep in flight.
+    method : optional, WriteMethod
+        How rows are written. WriteMethod.VALUES renders INSERT
+        statements; WriteMethod.COPY streams them with binary COPY,
+        which is much cheaper for large ingests.
+    """
+
+    assert len(documents) > 0, "we can't index 0 documents"
+
+    L.info(f"Bulk indexing {len(documents)} documents...")
+
+    # get the hashes from the documents
+    hashes = [i.hash for i in documents]
+
+    # and search through for those hashes
+    L.debug(f"Identifying already indexed documents...")
+    res = indexed_hashes(hashes, context)
+
+    # documents to index, without duplicates
+    filtered_documents = {}
+    for doc in documents:
+        if doc.hash not in res:
+            filtered_documents.setdefault(doc.hash, doc)
+    filtered_documents = list(filtered_documents.values())
+
+    if len(filtered_documents) == 0:
+        L.debug(f"All of {len(res)} documents are all indexed. Returning...")
+        return
+
+    L.debug(f"Total of {len(filtered_documents)} documents remain to truly index.")
+
+    L.debug(f"TFIDF analyzing {len(filtered_documents)} documents...")
+
+    # calculate tfidf for use later
+    tfs = tfidf(filtered_documents)
+
+    # calculate the documents to embed and chunks to update
+    L.debug(f"calculating chunk-level updates for {len(filtered_documents)} documents...")
+    embed_text, updates = chunk_updates(filtered_documents, tfs, context)
 
     # create embeddings in bulk
     L.debug(f"embedding {len(embed_text)} chunks...")
-    embeddings = []
-
-    for i in range(0, len(embed_text), 16):
-        chunk = embed_text[i:i+16]
-        embeddings += context.embedding.embed_documents(chunk)
+    embeddings = embed_documents(embed_text, context, workers=workers)
 
     # slice the embeddings in
     for i, em in zip(updates, embeddings):
         i[3] = em
 
-    # perform the updates
-    L.debug(f"submitting {len(filtered_documents)} documents to the chunk-level index...")
-    execute_values (
-        cur, "INSERT INTO simon_paragraphs (hash, uid, text, embedding, src, title, tf, seq, total) VALUES %s;",
-        updates
-    )
-
-    updates = []
-    L.debug(f"calculating fulltext-level updates for {len(filtered_documents)} documents...")
-    # create the document-level updates
-    for doc in filtered_documents:
-        updates.append((doc.hash, context.uid, doc.main_document, doc.meta.get("source", ""),
-                        doc.meta.get("title", "")))
-
-    L.debug(f"submitting {len(filtered_documents)} documents to the document-level index...")
-    execute_values (
-        cur, "INSERT INTO simon_fulltext (hash, uid, text, src, title) VALUES %s;",
-        updates
-    )
+    written = write_updates(filtered_documents, updates, context, method)
 
     # refresh indicies
     L.debug(f"committing changes for {len(filtered_documents)}...")
     context.cnx.commit()
 
-    L.debug(f"Done with indexing {len(documents)} documents; {len(filtered_documents)} actually indexed; rest cached.")
-
-    cur.close()
+    L.debug(f"Done with indexing {len(documents)} documents; {len(written)} actually indexed; rest cached.")
 
 @dbsafe
 def index_document(doc:ParsedDocument, context:AgentContext):
@@ -657,37 +966,54 @@ def cache(uri:str, hash:str, context:AgentContext):
     cur = context.cnx.cursor()
 
     cur.execute("INSERT INTO simon_cache (uri, hash, uid) VALUES (%s, %s, %s);", (uri, hash, context.uid))
+    bump_corpus_version(context)
 
     context.cnx.commit()
     cur.close()
 
+@dbsafe
+def cache_query_rewrite(key:str, queries, context:AgentContext):
+    """cache a QueryBreaker rewrite to share it across processes
+
+    Parameters
+    ----------
+    key : str
+        The rewrite's cache key.
+    queries : Optional[List[str]]
+        The rewritten queries, or None if there were none.
+    context : AgentContext
+        the agent context to cache with
+    """
+
+    cur = context.cnx.cursor()
+
+    cur.execute("INSERT INTO simon_query_cache (hash, queries) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+                (key, queries if queries else None))
+
+    context.cnx.commit()
+    cur.close()
 
 #### GLUE ####
 # A function to assemble CHUNK-type search results
 
-def assemble_chunks(results, context, padding=1):
-    """Assemble CHUNK type results into a string
+def plan_chunks(results, padding=1):
+    """Work out which chunk ranges to fetch to assemble search results
 
     Parameters
     ----------
     results : str
         Output of search().
-    context : AgentContext
-        Context to use.
     padding : optional,int
         The context padding to provide the model.
-        
+
     Return
     ------
-    List[Tuple[float, str, str]]
-        A list of score, title, range.
+    Tuple[List[str], List[list], List[Tuple[str, int, int]]]
+        Hashes in ranked order, [title, None, source, hash, None] per
+        document to be filled by stitch_chunks, and the
+        (hash, start, end) ranges to fetch.
     """
 
-
-    # otherwise it'd be empty!
-    if len(results) == 0:
-        return ""
-
     # keep the original order of hashes
     # we do this dictionary dedplication instead of list(set()) to preserve order
     seen = {}
@@ -720,7 +1046,8 @@ def assemble_chunks(results, context, padding=1):
         while len(chunks) != 0:
             new_start, new_end = chunks.pop(0)
 
-            if end <= new_start:
+            # ranges that touch are merged too, so no chunk is fetched twice
+            if end < new_start:
                 to_fetch.append((hash, start, end))
                 start = new_start
                 end = new_end
@@ -729,28 +1056,80 @@ def assemble_chunks(results, context, padding=1):
         to_fetch.append((hash, start, end))
         # now, get these actual chunks + stich them together with "..."
         # metadat
-        stitched_ranges.append([title, None, source, hash])
+        stitched_ranges.append([title, None, source, hash, None])
 
+    return hashes, stitched_ranges, to_fetch
 
-    # fetch the text
-    chunks = get_range_chunks(to_fetch, context)
+def stitch_chunks(hashes, stitched_ranges, chunks):
+    """Fill the planned documents with fetched chunks, in ranked order
+
+    Parameters
+    ----------
+    hashes : List[str]
+        Hashes in ranked order, from plan_chunks.
+    stitched_ranges : List[list]
+        Documents to fill, from plan_chunks.
+    chunks : Dict[str, List[Tuple[int, str, Optional[List[Tuple[int, int]]]]]]
+        Output of get_range_chunks.
+
+    Return
+    ------
+    List[Tuple[str, str, str, str, Optional[List[Tuple[int, int]]]]]
+        A list of title, range text, source, hash, and the sentence
+        spans within the range text (None if any chunk has none stored).
+    """
 
     # iterate through the data
     for res in stitched_ranges:
-        hash = res[-1]
-        chunk_data = chunks[hash]
-        res[1] = "\n".join(chunk_data)
+        hash = res[3]
+        chunk_data = chunks.get(hash, [])
+        res[1] = "\n".join(text for (_, text, _) in chunk_data)
+
+        # shift each chunk's sentence spans by where it starts in the range
+        spans = []
+        offset = 0
+        for (_, text, sentences) in chunk_data:
+            if sentences is None:
+                spans = None
+                break
+            spans += [(start+offset, end+offset) for (start, end) in sentences]
+            offset += len(text)+1
+        res[4] = spans
 
     # reorder the results based on the original ranking
     ordered_results = []
     for hash in hashes:
         ordered_results += [i for i in stitched_ranges if i[3] == hash]
+
+    # and now, assemble everything with slashes between and return
+    return ordered_results
+
+def assemble_chunks(results, context, padding=1):
+    """Assemble CHUNK type results into a string
+
+    Parameters
+    ----------
+    results : str
+        Output of search().
+    context : AgentContext
+        Context to use.
+    padding : optional,int
+        The context padding to provide the model.
         
+    Return
+    ------
+    List[Tuple[str, str, str, str, Optional[List[Tuple[int, int]]]]]
+        A list of title, range text, source, hash, sentence spans.
+    """
+
 
-    # range_text = "\n\n...\n\n".join(["\n".join(get_range_chunk(hash, i,j, context))
-    #                         for i,j in smooth_chunks])
+    # otherwise it'd be empty!
+    if len(results) == 0:
+        return ""
 
-    # stitched_ranges = sorted(stitched_ranges, key=lambda x:x[0], reverse=True)
+    hashes, stitched_ranges, to_fetch = plan_chunks(results, padding)
 
-    # and now, assemble everything with slashes between and return
-    return ordered_results
+    # fetch the text
+    chunks = get_range_chunks(to_fetch, context)
+
+    return stitch_chunks(hashes, stitched_ranges, chunks)
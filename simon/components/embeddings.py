@@ -0,0 +1,378 @@
+"""
+embeddings.py
+Content-addressed embedding cache in front of the embedding provider.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import execute_values
+from openai.error import (RateLimitError, Timeout, APIError,
+                          APIConnectionError, ServiceUnavailableError)
+
+import logging
+L = logging.getLogger("simon")
+
+from ..utils.cache import LRUCache
+
+# entries in the in-process tier; each holds a packed float32 vector
+# (about 6KB for ada-002), and every worker process has its own
+MEMORY_SIZE = int(os.environ.get("SIMON_EMBEDDING_CACHE_SIZE", 2048))
+
+# in-process tier in front of the simon_embedding_cache table
+# shared by every context in this process
+_MEMORY = LRUCache(maxsize=MEMORY_SIZE)
+
+# query vectors, keyed by normalized query text and model
+_QUERIES = LRUCache(maxsize=4096, ttl=60*60*24)
+
+_COUNTERS = {
+    "memory_hits": 0,
+    "database_hits": 0,
+    "misses": 0,
+}
+_COUNTER_LOCK = threading.Lock()
+
+# provider errors worth retrying; the same ones langchain's client
+# retries, which dispatch takes over from it
+_TRANSIENT = (RateLimitError, Timeout, APIError,
+              APIConnectionError, ServiceUnavailableError)
+
+# vectors are kept as float32 arrays rather than lists of Python
+# floats, which take about eight times the memory
+def _pack(em):
+    return array("f", em)
+
+def _unpack(em):
+    return em.tolist() if em is not None else None
+
+def _count(key, n):
+    with _COUNTER_LOCK:
+        _COUNTERS[key] += n
+
+def model_name(embedding):
+    """Get a stable name for the model behind an embedding provider
+
+    Parameters
+    ----------
+    embedding : Embeddings
+        The langchain embedding provider.
+
+    Returns
+    -------
+    str
+        The model name, or the provider class name if none is available.
+    """
+
+    return (getattr(embedding, "model", None) or
+            getattr(embedding, "deployment", None) or
+            type(embedding).__name__)
+
+def embedding_key(text, model):
+    """Content address of an embedded string under a model
+
+    Parameters
+    ----------
+    text : str
+        The exact text that is embedded.
+    model : str
+        The model used to embed it.
+
+    Returns
+    -------
+    str
+        The sha256 hex digest of the pair.
+    """
+
+    return hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+def cache_stats():
+    """Hit and miss counters for the embedding cache
+
+    Returns
+    -------
+    Dict[str, int]
+        Hits served from memory and from the database, strings which
+        had to be sent to the provider, and the in-memory tier size.
+    """
+
+    with _COUNTER_LOCK:
+        stats = dict(_COUNTERS)
+
+    stats["memory_size"] = len(_MEMORY)
+    stats["queries"] = _QUERIES.stats
+    return stats
+
+def normalize_query(query):
+    """Normalize query text so trivially different queries share a vector
+
+    Parameters
+    ----------
+    query : str
+        The raw query.
+
+    Returns
+    -------
+    str
+        The query, lowercased with whitespace collapsed.
+    """
+
+    return " ".join(query.split()).lower()
+
+def embed_queries(queries, context):
+    """Embed the queries of a search, consulting the query vector cache
+
+    All queries which miss the cache are embedded together in one
+    provider call.
+
+    Parameters
+    ----------
+    queries : List[str]
+        The queries to embed.
+    context : AgentContext
+        The context whose embedding model to use.
+
+    Returns
+    -------
+    List[List[float]]
+        Embeddings, in the same order as `queries`.
+    """
+
+    model, normalized, results, missing = __lookup_queries(queries, context)
+
+    if len(missing) > 0:
+        embeddings = context.embedding.embed_documents(list(missing.values()))
+        results = __fill_queries(model, normalized, results, missing, embeddings)
+
+    return results
+
+async def aembed_queries(queries, context):
+    """Embed the queries of a search asynchronously; see embed_queries
+
+    Parameters
+    ----------
+    queries : List[str]
+        The queries to embed.
+    context : AgentContext
+        The context whose embedding model to use.
+
+    Returns
+    -------
+    List[List[float]]
+        Embeddings, in the same order as `queries`.
+    """
+
+    model, normalized, results, missing = __lookup_queries(queries, context)
+
+    if len(missing) > 0:
+        embeddings = await context.embedding.aembed_documents(list(missing.values()))
+        results = __fill_queries(model, normalized, results, missing, embeddings)
+
+    return results
+
+def __lookup_queries(queries, context):
+    model = model_name(context.embedding)
+    normalized = [normalize_query(q) for q in queries]
+
+    results = [_unpack(_QUERIES.get((model, q))) for q in normalized]
+
+    # normalized text is only the cache key; the provider gets the
+    # query as written, the first spelling of it if there are several
+    missing = {}
+    for q, query, em in zip(normalized, queries, results):
+        if em is None:
+            missing.setdefault(q, query)
+
+    return model, normalized, results, missing
+
+def __fill_queries(model, normalized, results, missing, embeddings):
+    embeddings = dict(zip(missing, embeddings))
+    for q, em in embeddings.items():
+        _QUERIES.put((model, q), _pack(em))
+
+    return [em if em is not None else embeddings[q]
+            for q, em in zip(normalized, results)]
+
+class AdaptiveBackoff:
+    """Delay shared between embedding workers to back off on rate limits
+
+    Every rate limit doubles the delay each worker waits before its
+    next request; every success halves it again.
+
+    Parameters
+    ----------
+    initial : optional, float
+        Delay, in seconds, after the first rate limit.
+    maximum : optional, float
+        Upper bound on the delay, in seconds.
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.rate_limits = 0
+
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        delay = self.delay
+        if delay > 0:
+            time.sleep(delay)
+
+    def limited(self):
+        with self.__lock:
+            self.rate_limits += 1
+            self.delay = min(self.maximum, max(self.initial, self.delay*2))
+
+    def succeeded(self):
+        with self.__lock:
+            self.delay = self.delay/2 if self.delay/2 >= self.initial/8 else 0.0
+
+def dispatch(texts, embedding, batch_size=16, workers=4, max_retries=8):
+    """Embed `texts` with several provider requests in flight at once
+
+    Parameters
+    ----------
+    texts : List[str]
+        The strings to embed.
+    embedding : Embeddings
+        The langchain embedding provider.
+    batch_size : optional, int
+        How many strings to send per request.
+    workers : optional, int
+        How many requests to keep in flight.
+    max_retries : optional, int
+        How many rate limits, timeouts, and transient provider errors
+        to tolerate per batch before giving up.
+
+    Returns
+    -------
+    List[List[float]]
+        Embeddings, in the same order as `texts`.
+    """
+
+    batches = [texts[i:i+batch_size] for i in range(0, len(texts), batch_size)]
+    backoff = AdaptiveBackoff()
+
+    # the client retries transient errors itself (up to six times, each
+    # with its own exponential wait) before we would ever see one; make
+    # it try once, so the backoff below, shared by every worker, decides
+    if getattr(embedding, "max_retries", 1) > 1:
+        embedding = embedding.copy(update={"max_retries": 1})
+
+    def embed_batch(batch):
+        for attempt in range(max_retries+1):
+            backoff.wait()
+            try:
+                res = embedding.embed_documents(batch)
+            except _TRANSIENT as e:
+                if attempt == max_retries:
+                    raise
+                backoff.limited()
+                L.warning(f"Embedding provider failed with {type(e).__name__}; backing off for {backoff.delay:.1f} seconds...")
+                continue
+
+            backoff.succeeded()
+            return res
+
+    if len(batches) <= 1 or workers <= 1:
+        results = [embed_batch(i) for i in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            # map() hands results back in submission order
+            results = list(executor.map(embed_batch, batches))
+
+    return [em for batch in results for em in batch]
+
+def embed_documents(texts, context, batch_size=16, workers=4):
+    """Embed a list of strings, consulting the embedding cache first
+
+    Strings are looked up in the in-process LRU, then in the
+    simon_embedding_cache table, and only the remainder is sent
+    to the embedding provider. New embeddings are written back to
+    both tiers; the database write is committed by the caller.
+
+    Parameters
+    ----------
+    texts : List[str]
+        The strings to embed.
+    context : AgentContext
+        The context whose embedding model and connection to use.
+    batch_size : optional, int
+        How many strings to send to the provider per request.
+    workers : optional, int
+        How many provider requests to keep in flight.
+
+    Returns
+    -------
+    List[List[float]]
+        Embeddings, in the same order as `texts`.
+    """
+
+    model = model_name(context.embedding)
+    results = [None for _ in texts]
+
+    # key -> positions in `texts` waiting on that key
+    missing = {}
+
+    for indx, text in enumerate(texts):
+        key = embedding_key(text, model)
+        em = _unpack(_MEMORY.get(key))
+
+        if em is not None:
+            results[indx] = em
+        else:
+            missing.setdefault(key, []).append(indx)
+
+    _count("memory_hits", len(texts)-sum(len(i) for i in missing.values()))
+
+    if len(missing) == 0:
+        return results
+
+    cur = context.cnx.cursor()
+
+    cur.execute("SELECT hash, embedding FROM simon_embedding_cache WHERE hash = ANY(%s) AND model = %s;",
+                (list(missing.keys()), model))
+
+    for key, em in cur.fetchall():
+        # pgvector hands back its text form, "[0.1,0.2,...]"
+        em = json.loads(em) if isinstance(em, str) else list(em)
+        _MEMORY.put(key, _pack(em))
+
+        positions = missing.pop(key)
+        for indx in positions:
+            results[indx] = em
+        _count("database_hits", len(positions))
+
+    if len(missing) == 0:
+        cur.close()
+        return results
+
+    # embed each distinct string once
+    keys = list(missing.keys())
+    to_embed = [texts[missing[key][0]] for key in keys]
+
+    L.debug(f"embedding cache missed {len(to_embed)} strings; embedding...")
+    embeddings = dispatch(to_embed, context.embedding, batch_size, workers)
+    _count("misses", len(to_embed))
+
+    rows = []
+    for key, em in zip(keys, embeddings):
+        _MEMORY.put(key, _pack(em))
+        for indx in missing[key]:
+            results[indx] = em
+        rows.append((key, model, em))
+
+    execute_values (
+        cur, "INSERT INTO simon_embedding_cache (hash, model, embedding) VALUES %s ON CONFLICT DO NOTHING;",
+        rows
+    )
+    cur.close()
+
+    return results
@@ -0,0 +1,319 @@
+"""
+pipeline.py
+Streaming ingestion: parse -> TFIDF -> embed -> insert as concurrent stages.
+"""
+
+import time
+import queue
+import threading
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+import logging
+L = logging.getLogger("simon")
+
+from ..models import *
+from .documents import indexed_hashes, tfidf, chunk_updates, write_updates
+from .embeddings import embed_documents
+from .pool import borrow
+
+# marks the end of the stream on each queue
+_DONE = object()
+
+@dataclass
+class StageStats:
+    name: str
+    documents: int = 0
+    batches: int = 0
+    busy: float = 0.0 # seconds spent working
+    blocked: float = 0.0 # seconds spent waiting on the queues either side
+
+    @property
+    def throughput(self):
+        """documents per second of busy time"""
+        return self.documents/self.busy if self.busy > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.name}: {self.documents} documents in {self.batches} batches, "
+                f"{self.busy:.2f}s busy, {self.blocked:.2f}s blocked, "
+                f"{self.throughput:.1f} documents/sec")
+
+class IngestionPipeline:
+    """Streaming ingestion engine with bounded queues between stages
+
+    Documents flow through four stages, each on its own thread:
+    parse (and skip already indexed documents), TFIDF, embed, and
+    insert. Stages are connected by bounded queues, so a slow stage
+    applies backpressure to those before it and only `queue_size`
+    batches are ever held in memory per queue. Each batch is committed
+    once it is inserted.
+
+    The stages which touch the database (parse, embed, and insert)
+    each borrow their own connection from the context's pool, so
+    their transactions stay apart and they don't wait on each other.
+    Without a pool, there is only the context's one connection, and
+    one stage's commit or rollback would take another's half done
+    work with it; so the stages then run one batch at a time on the
+    calling thread instead.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The context to ingest into.
+    parser : optional, Callable[[any], Optional[ParsedDocument]]
+        Turns each item of the input stream into a ParsedDocument, or
+        None to skip it. Without one, items must already be parsed.
+    batch_size : optional, int
+        Documents per batch moving between stages.
+    queue_size : optional, int
+        Batches allowed to wait between each pair of stages.
+    workers : optional, int
+        How many embedding requests to keep in flight.
+    method : optional, WriteMethod
+        How rows are written to the database.
+    """
+
+    def __init__(self, context:AgentContext, parser:Optional[Callable]=None,
+                 batch_size=32, queue_size=4, workers=4,
+                 method=WriteMethod.VALUES):
+        self.context = context
+        self.parser = parser
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.workers = workers
+        self.method = method
+
+        self.stats = {}
+
+    #### queue helpers ####
+    def __put(self, q, item, stats):
+        st = time.time()
+        while not self.__failed.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats.blocked += time.time()-st
+
+    def __get(self, q, stats):
+        st = time.time()
+        while not self.__failed.is_set():
+            try:
+                item = q.get(timeout=0.1)
+                stats.blocked += time.time()-st
+                return item
+            except queue.Empty:
+                continue
+        stats.blocked += time.time()-st
+        return _DONE
+
+    def __work(self, stats, work, batch):
+        st = time.time()
+        res = work(batch)
+        stats.busy += time.time()-st
+        stats.batches += 1
+        stats.documents += len(batch[0])
+
+        return res
+
+    def __stage(self, name, work, inbox, outbox):
+        stats = self.stats[name]
+
+        def run():
+            try:
+                while True:
+                    batch = self.__get(inbox, stats)
+                    if batch is _DONE:
+                        break
+
+                    res = self.__work(stats, work, batch)
+
+                    if outbox is not None:
+                        self.__put(outbox, res, stats)
+            except BaseException as e:
+                L.exception(f"Ingestion stage {name} failed.")
+                self.__errors.append(e)
+                self.__failed.set()
+            finally:
+                if outbox is not None:
+                    self.__put(outbox, _DONE, stats)
+
+        return threading.Thread(target=run, name=f"simon-ingest-{name}", daemon=True)
+
+    #### stages ####
+    def __batches(self, documents):
+        # parsed batches of documents not yet indexed
+        stats = self.stats["parse"]
+        context = self.__contexts["parse"]
+        seen = set()
+
+        def flush(batch):
+            # skip documents which are already indexed
+            st = time.time()
+            res = set(indexed_hashes([i.hash for i in batch], context))
+            batch = [i for i in batch if i.hash not in res]
+            stats.busy += time.time()-st
+
+            if len(batch) > 0:
+                stats.batches += 1
+            return batch
+
+        batch = []
+        st = time.time()
+        for item in documents:
+            if self.__failed.is_set():
+                break
+
+            doc = self.parser(item) if self.parser else item
+            if doc is not None:
+                self.__hashes.append(doc.hash)
+                stats.documents += 1
+
+                # remove duplicates within the stream
+                if doc.hash not in seen:
+                    seen.add(doc.hash)
+                    batch.append(doc)
+            stats.busy += time.time()-st
+
+            if len(batch) >= self.batch_size:
+                batch = flush(batch)
+                if len(batch) > 0:
+                    yield batch
+                batch = []
+            st = time.time()
+
+        if len(batch) > 0 and not self.__failed.is_set():
+            batch = flush(batch)
+            if len(batch) > 0:
+                yield batch
+
+    def __parse(self, documents, outbox):
+        stats = self.stats["parse"]
+
+        try:
+            for batch in self.__batches(documents):
+                self.__put(outbox, (batch,), stats)
+        except BaseException as e:
+            L.exception(f"Ingestion stage parse failed.")
+            self.__errors.append(e)
+            self.__failed.set()
+        finally:
+            self.__put(outbox, _DONE, stats)
+
+    def __tfidf(self, batch):
+        (documents,) = batch
+        tfs = tfidf(documents)
+        embed_text, updates = chunk_updates(documents, tfs, self.context)
+
+        return (documents, embed_text, updates)
+
+    def __embed(self, batch):
+        (documents, embed_text, updates) = batch
+        context = self.__contexts["embed"]
+        embeddings = embed_documents(embed_text, context, workers=self.workers)
+        # new embeddings were written to the cache on this connection
+        context.cnx.commit()
+
+        # slice the embeddings in
+        for i, em in zip(updates, embeddings):
+            i[3] = em
+
+        return (documents, updates)
+
+    def __insert(self, batch):
+        (documents, updates) = batch
+        context = self.__contexts["insert"]
+        write_updates(documents, updates, context, self.method)
+        context.cnx.commit()
+
+        L.debug(f"Committed a batch of {len(documents)} documents.")
+
+    def __call__(self, documents:Iterable):
+        """Run the pipeline to completion over a stream of documents
+
+        Parameters
+        ----------
+        documents : Iterable
+            Documents, or raw items for `parser`, to index. This can
+            be a lazy generator; it is only consumed as fast as the
+            downstream stages allow.
+
+        Returns
+        -------
+        List[str]
+            Hashes of every document in the stream, including those
+            which were already indexed, in stream order.
+        """
+
+        self.__failed = threading.Event()
+        self.__errors = []
+        self.__hashes = []
+        self.stats = {name: StageStats(name)
+                      for name in ["parse", "tfidf", "embed", "insert"]}
+
+        if getattr(self.context, "pool", None) is None:
+            return self.__serial(documents)
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        scored = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self.__parse, args=(documents, parsed),
+                                    name="simon-ingest-parse", daemon=True),
+                   self.__stage("tfidf", self.__tfidf, parsed, scored),
+                   self.__stage("embed", self.__embed, scored, embedded),
+                   self.__stage("insert", self.__insert, embedded, None)]
+
+        st = time.time()
+        L.info(f"Starting streaming ingestion...")
+
+        # each stage that touches the database holds its own
+        # connection for the whole run
+        with ExitStack() as stack:
+            self.__contexts = {name: stack.enter_context(borrow(self.context))
+                               for name in ["parse", "embed", "insert"]}
+
+            for i in threads:
+                i.start()
+            for i in threads:
+                i.join()
+
+            if self.__errors:
+                # roll back whatever was in flight
+                for context in self.__contexts.values():
+                    context.cnx.rollback()
+
+        for i in self.stats.values():
+            L.info(str(i))
+        L.info(f"Streaming ingestion done in {(time.time()-st):.2f} seconds.")
+
+        if self.__errors:
+            raise self.__errors[0]
+
+        return self.__hashes
+
+    def __serial(self, documents):
+        # one connection, so one batch at a time through every stage
+        self.__contexts = {name: self.context for name in ["parse", "embed", "insert"]}
+        stages = [("tfidf", self.__tfidf), ("embed", self.__embed), ("insert", self.__insert)]
+
+        st = time.time()
+        L.info(f"Starting streaming ingestion, without a pool...")
+
+        try:
+            for batch in self.__batches(documents):
+                batch = (batch,)
+                for name, work in stages:
+                    batch = self.__work(self.stats[name], work, batch)
+        except BaseException:
+            L.exception(f"Streaming ingestion failed.")
+            self.context.cnx.rollback()
+            raise
+
+        for i in self.stats.values():
+            L.info(str(i))
+        L.info(f"Streaming ingestion done in {(time.time()-st):.2f} seconds.")
+
+        return self.__hashes
@@ -0,0 +1,187 @@
+"""
+pool.py
+Pooled database connections for AgentContext.
+"""
+
+import time
+import threading
+from dataclasses import replace
+from contextlib import contextmanager
+
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+import logging
+L = logging.getLogger("simon")
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections with wait-time metrics
+
+    Unlike psycopg2's ThreadedConnectionPool, which raises as soon as
+    it runs out of connections, borrowing from this pool waits for a
+    connection to be returned.
+
+    Parameters
+    ----------
+    minconn : optional, int
+        Connections to open up front.
+    maxconn : optional, int
+        Most connections to ever have open at once.
+    timeout : optional, float
+        Seconds to wait for a free connection before giving up, or
+        None to wait forever.
+    **db_config
+        Passed to psycopg2.connect (host, port, user, etc.).
+    """
+
+    def __init__(self, minconn=1, maxconn=10, timeout=None, **db_config):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+
+        self.__pool = ThreadedConnectionPool(minconn, maxconn, **db_config)
+        self.__slots = threading.BoundedSemaphore(maxconn)
+        self.__lock = threading.Lock()
+
+        self.in_use = 0
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, returning it to the pool afterwards
+
+        Anything left uncommitted when the connection is returned
+        is rolled back, so one failed operation can't poison the next.
+
+        Yields
+        ------
+        connection
+            A psycopg2 connection.
+        """
+
+        st = time.monotonic()
+        if not self.__slots.acquire(timeout=self.timeout):
+            raise PoolError(f"Timed out after {self.timeout} seconds waiting for a database connection.")
+        wait = time.monotonic()-st
+
+        try:
+            cnx = self.__pool.getconn()
+        except:
+            self.__slots.release()
+            raise
+
+        with self.__lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        try:
+            yield cnx
+        finally:
+            close = bool(cnx.closed)
+            if not close and cnx.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                try:
+                    cnx.rollback()
+                except Exception:
+                    close = True
+
+            self.__pool.putconn(cnx, close=close)
+
+            with self.__lock:
+                self.in_use -= 1
+            self.__slots.release()
+
+    @property
+    def stats(self):
+        """Pool size and wait-time metrics
+
+        Returns
+        -------
+        Dict[str, float]
+            Connections in use and the pool bounds, the number of
+            checkouts, and the total, mean and max seconds spent
+            waiting for a connection.
+        """
+
+        with self.__lock:
+            return {
+                "in_use": self.in_use,
+                "minconn": self.minconn,
+                "maxconn": self.maxconn,
+                "checkouts": self.checkouts,
+                "total_wait": self.total_wait,
+                "mean_wait": self.total_wait/self.checkouts if self.checkouts else 0.0,
+                "max_wait": self.max_wait,
+            }
+
+    def close(self):
+        self.__pool.closeall()
+
+@contextmanager
+def borrow(context):
+    """Get a context holding a live connection for the duration of a block
+
+    If the context is backed by a pool, a connection is checked out
+    and a copy of the context holding it is yielded; otherwise the
+    context is yielded as is.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The context to borrow a connection for.
+
+    Yields
+    ------
+    AgentContext
+        A context whose `cnx` is usable.
+    """
+
+    if getattr(context, "pool", None) is None:
+        yield context
+        return
+
+    with context.pool.connection() as cnx:
+        yield replace(context, cnx=cnx, pool=None)
+
+def async_pool(maxconn=10, probes=20, **db_config):
+    """Create an (unopened) psycopg 3 pool for Simon's async operations
+
+    Requires the `async` extra. Open it with `await pool.open()`
+    from inside the event loop that will use it.
+
+    Parameters
+    ----------
+    maxconn : optional, int
+        Most connections to ever have open at once.
+    probes : optional, int
+        ivfflat.probes to set on each connection as it opens.
+    **db_config
+        Connection parameters (host, port, user, etc.).
+
+    Returns
+    -------
+    psycopg_pool.AsyncConnectionPool
+        The pool, to be set as AgentContext.apool.
+    """
+
+    try:
+        from psycopg.conninfo import make_conninfo
+        from psycopg_pool import AsyncConnectionPool
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("We can't find the async database dependencies. Ensure you have installed the \'async\' variant of Simon with 'pip install simon-search[async]'.")
+
+    async def configure(cnx):
+        # set once per connection, rather than per search
+        await cnx.execute(f"SET ivfflat.probes = {int(probes)};")
+        await cnx.commit()
+
+    # libpq calls the database "dbname"
+    db_config = {("dbname" if k == "database" else k):v
+                 for k,v in db_config.items() if v is not None}
+
+    conninfo = make_conninfo(**db_config)
+    return AsyncConnectionPool(conninfo, min_size=1, max_size=maxconn,
+                               configure=configure, open=False)
@@ -0,0 +1,127 @@
+"""
+tfidf.py
+Batched TFIDF scoring of document paragraphs.
+
+Scores match running sklearn's TfidfVectorizer (smooth idf, l2 norm)
+on each document's paragraphs separately and summing each row, but a
+whole batch is counted with one shared vectorizer, and the per-document
+IDF and norms are computed with sparse array operations.
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+import logging
+L = logging.getLogger("simon")
+
+# batches with fewer paragraphs than this are scored in-process
+PARALLEL_THRESHOLD = 20000
+
+# workers: ProcessPoolExecutor
+_EXECUTORS = {}
+_EXECUTOR_LOCK = threading.Lock()
+
+def score(paragraphs):
+    """Score each paragraph by its summed TFIDF, with IDF per document
+
+    Parameters
+    ----------
+    paragraphs : List[List[str]]
+        The paragraphs of each document.
+
+    Returns
+    -------
+    List[List[float]]
+        One score per paragraph, per document.
+    """
+
+    if len(paragraphs) == 0:
+        return []
+
+    lengths = np.array([len(i) for i in paragraphs], dtype=np.int64)
+    flat = [j for i in paragraphs for j in i]
+
+    try:
+        counts = CountVectorizer().fit_transform(flat).tocoo()
+    except ValueError:
+        # not a single term in the whole batch
+        return [[0.0]*len(i) for i in paragraphs]
+
+    rows = counts.row.astype(np.int64)
+    terms = counts.col.astype(np.int64)
+    tf = counts.data.astype(np.float64)
+
+    # which document each nonzero count belongs to
+    documents = np.repeat(np.arange(len(lengths)), lengths)[rows]
+
+    # document frequency of each term within its own document: the
+    # number of nonzeros sharing a (document, term) pair
+    _, inverse, df = np.unique(documents*counts.shape[1]+terms,
+                               return_inverse=True, return_counts=True)
+    df = df[inverse.reshape(-1)]
+    n = lengths[documents]
+
+    weights = tf*(np.log((1+n)/(1+df))+1)
+
+    # l2 normalize each paragraph, then sum it
+    norms = np.sqrt(np.bincount(rows, weights**2, minlength=counts.shape[0]))
+    norms[norms == 0] = 1
+    sums = np.bincount(rows, weights/norms[rows], minlength=counts.shape[0])
+
+    return [i.tolist() for i in np.split(sums, np.cumsum(lengths)[:-1])]
+
+def __executor(workers):
+    with _EXECUTOR_LOCK:
+        if workers not in _EXECUTORS:
+            # spawned, not forked: we're called from threads (pipeline
+            # stages, request handlers), and a fork can copy a lock
+            # another thread holds, deadlocking the child
+            _EXECUTORS[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+        return _EXECUTORS[workers]
+
+def score_batch(paragraphs, workers=None):
+    """Score a batch of documents, fanning out over processes if large
+
+    Documents are scored independently, so sharding the batch by
+    document gives the same scores as scoring it whole.
+
+    Parameters
+    ----------
+    paragraphs : List[List[str]]
+        The paragraphs of each document.
+    workers : optional, int
+        Processes to use for batches of more than PARALLEL_THRESHOLD
+        paragraphs; defaults to the number of CPUs. 1 never fans out.
+
+    Returns
+    -------
+    List[List[float]]
+        One score per paragraph, per document.
+    """
+
+    workers = workers or os.cpu_count() or 1
+    total = sum(len(i) for i in paragraphs)
+
+    if workers <= 1 or total < PARALLEL_THRESHOLD or len(paragraphs) < 2:
+        return score(paragraphs)
+
+    # shard by document, into shards of about equal size
+    shards = [[]]
+    target = total/workers
+    size = 0
+    for doc in paragraphs:
+        if size >= target:
+            shards.append([])
+            size = 0
+        shards[-1].append(doc)
+        size += len(doc)
+
+    L.debug(f"scoring {total} paragraphs over {len(shards)} processes...")
+
+    return [j for i in __executor(workers).map(score, shards) for j in i]
@@ -0,0 +1,368 @@
+"""
+vectorstore.py
+Exact in-process vector search over a tenant's chunk embeddings.
+
+Each uid's embeddings are kept as float32 matrices in .npy files on
+local disk, memory mapped; so every worker process on a host shares
+one copy through the page cache. The matrices are immutable segments:
+when the corpus version moves on, only the documents added since are
+read from the database, in binary and in batches, into a new segment;
+documents removed since are masked out of the old ones. A small
+manifest per version names its segments and their removed documents.
+Once there are too many segments, or too much of them is masked out,
+they are compacted into one.
+
+Tenants with more than MAX_ROWS chunks are left to pgvector.
+"""
+
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import time
+import tempfile
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+import logging
+L = logging.getLogger("simon")
+
+# tenants with more chunks than this are searched with pgvector
+MAX_ROWS = 50000
+
+# compact once a version has more segments than this, or once this
+# fraction of its rows is masked out
+MAX_SEGMENTS = 8
+MAX_REMOVED = 0.25
+
+# rows read from the database at a time
+READ_BATCH = 2000
+
+# seconds an unreferenced segment is kept for, in case a concurrent
+# build has published it but not yet its manifest
+GRACE = 300
+
+# where the matrices live; shared by every worker on the host
+STORE_DIR = os.environ.get("SIMON_VECTOR_DIR",
+                           os.path.join(tempfile.gettempdir(), "simon-vectors"))
+
+_ARRAYS = ("embeddings", "tf", "hashes", "seqs")
+_MANIFEST = re.compile(r"^v(\d+)\.json$")
+
+class Segment:
+    """An immutable, memory mapped block of a tenant's chunks
+
+    Parameters
+    ----------
+    path : str
+        The segment's directory.
+    removed : optional, List[str]
+        Hashes of documents since removed, which are masked out.
+    """
+
+    def __init__(self, path, removed=[]):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.removed = list(removed)
+
+        (self.embeddings, self.tf,
+         self.hashes, self.seqs) = [np.load(os.path.join(path, f"{i}.npy"), mmap_mode="r")
+                                    for i in _ARRAYS]
+
+        self.live = ~np.isin(self.hashes, self.removed) if self.removed else np.ones(len(self.seqs), dtype=bool)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.live))
+
+    def documents(self):
+        """The hashes of the documents still live in this segment"""
+
+        return set(np.unique(self.hashes[self.live]).tolist())
+
+class VectorStore:
+    """One version of a tenant's chunk embeddings
+
+    Parameters
+    ----------
+    segments : List[Segment]
+        The segments the version is made of.
+    version : int
+        The corpus version it holds.
+    """
+
+    def __init__(self, segments, version):
+        self.segments = segments
+        self.version = version
+
+    def __len__(self):
+        return sum(len(i) for i in self.segments)
+
+    def documents(self):
+        """The hashes of every document in this version"""
+
+        return set().union(*[i.documents() for i in self.segments])
+
+    def search(self, embeddings, k, tf_threshold):
+        """Find the closest chunks to each query, exactly
+
+        Chunks are ranked by inner product, as pgvector's `<#>` does.
+
+        Parameters
+        ----------
+        embeddings : List[List[float]]
+            The embedded queries.
+        k : int
+            Results per query.
+        tf_threshold : float
+            Only chunks with a TF above this are returned.
+
+        Returns
+        -------
+        List[List[Tuple[str, int]]]
+            (hash, seq) of the closest chunks, best first, per query.
+        """
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+
+        # the best k of each segment, then the best k of those
+        scores, hashes, seqs = [], [], []
+        for segment in self.segments:
+            eligible = np.flatnonzero(segment.live & (segment.tf > tf_threshold))
+            if len(eligible) == 0:
+                continue
+
+            found = segment.embeddings @ queries.T
+            found[~(segment.live & (segment.tf > tf_threshold))] = -np.inf
+
+            n = min(k, len(eligible))
+            top = np.argpartition(-found, n-1, axis=0)[:n]
+
+            scores.append(np.take_along_axis(found, top, axis=0))
+            hashes.append(segment.hashes[top])
+            seqs.append(segment.seqs[top])
+
+        if not scores:
+            return [[] for _ in embeddings]
+
+        scores = np.concatenate(scores)
+        hashes = np.concatenate(hashes)
+        seqs = np.concatenate(seqs)
+
+        order = np.argsort(-scores, axis=0, kind="stable")[:k]
+
+        return [list(zip(np.take_along_axis(hashes, order, axis=0)[:, i].tolist(),
+                         np.take_along_axis(seqs, order, axis=0)[:, i].tolist()))
+                for i in range(order.shape[1])]
+
+def _tenant_dir(uid):
+    return os.path.join(STORE_DIR, hashlib.sha256(uid.encode()).hexdigest())
+
+def _versions(path):
+    try:
+        found = [(int(m.group(1)), i) for i in os.listdir(path)
+                 for m in [_MANIFEST.match(i)] if m]
+    except FileNotFoundError:
+        return []
+
+    return sorted(found, reverse=True)
+
+def _load(tenant, version):
+    with open(os.path.join(tenant, f"v{version}.json")) as df:
+        manifest = json.load(df)
+
+    return VectorStore([Segment(os.path.join(tenant, i["name"]), i["removed"])
+                        for i in manifest["segments"]], version)
+
+def _read(cnx, uid, hashes):
+    # pgvector's binary form is a 2-byte dimension, 2 unused bytes, then
+    # big endian float4s; so each row is dim+1 float4s, the first a header
+    cur = cnx.cursor(name=f"simon_vectorstore_{uuid.uuid4().hex}")
+    cur.itersize = READ_BATCH
+    cur.execute("SELECT hash, seq, tf, vector_send(embedding) FROM simon_paragraphs WHERE uid = %s AND hash = ANY(%s);",
+                (uid, list(hashes)))
+
+    arrays = {i: [] for i in _ARRAYS}
+    while True:
+        rows = cur.fetchmany(READ_BATCH)
+        if not rows:
+            break
+
+        buffer = b"".join(bytes(i[3]) for i in rows)
+        arrays["embeddings"].append(np.frombuffer(buffer, dtype=">f4").reshape(len(rows), -1)[:, 1:].astype(np.float32))
+        arrays["tf"].append(np.asarray([i[2] for i in rows], dtype=np.float32))
+        arrays["hashes"].append(np.asarray([i[0] for i in rows], dtype=str))
+        arrays["seqs"].append(np.asarray([i[1] for i in rows], dtype=np.int32))
+    cur.close()
+
+    if not arrays["seqs"]:
+        return None
+
+    return {k: np.concatenate(v) for k,v in arrays.items()}
+
+def _publish(tenant, arrays):
+    staging = tempfile.mkdtemp(dir=tenant, prefix=".build-")
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array)
+
+    path = os.path.join(tenant, f"s{uuid.uuid4().hex}")
+    os.rename(staging, path)
+
+    return Segment(path)
+
+def _compact(segments):
+    return {i: np.concatenate([getattr(j, i)[j.live] for j in segments]) for i in _ARRAYS}
+
+def _latest(tenant, version):
+    # the newest version on disk below `version`, if any
+    for v, _ in _versions(tenant):
+        if v < version:
+            try:
+                return _load(tenant, v)
+            except FileNotFoundError:
+                # cleaned up by a newer build meanwhile
+                continue
+
+def _rebuild(context, tenant, version, previous):
+    try:
+        return _build(context, version, previous)
+    except FileNotFoundError:
+        # another worker compacted the segments we had away, and they
+        # have since been cleaned up; pick up from what is on disk now
+        L.debug(f"segments to build vector store v{version} from are gone; rebuilding from disk.")
+
+    try:
+        return _build(context, version, _latest(tenant, version))
+    except FileNotFoundError:
+        return _build(context, version, None)
+
+def _build(context, version, previous):
+    cur = context.cnx.cursor()
+
+    cur.execute("SELECT count(*) FROM simon_paragraphs WHERE uid = %s;", (context.uid,))
+    if cur.fetchone()[0] > MAX_ROWS:
+        cur.close()
+        return None
+
+    cur.execute("SELECT hash FROM simon_fulltext WHERE uid = %s;", (context.uid,))
+    current = {i[0] for i in cur.fetchall()}
+    cur.close()
+
+    tenant = _tenant_dir(context.uid)
+    os.makedirs(tenant, exist_ok=True)
+
+    # mask out what was removed from the segments we keep
+    segments = []
+    kept = set()
+    for segment in (previous.segments if previous is not None else []):
+        documents = set(np.unique(segment.hashes).tolist())
+        segment = Segment(segment.path, sorted(documents-current))
+        if len(segment) > 0:
+            segments.append(segment)
+            kept |= segment.documents()
+
+    added = current-kept
+    L.debug(f"building vector store v{version}; {len(kept)} documents kept, {len(added)} read.")
+
+    if added:
+        arrays = _read(context.cnx, context.uid, added)
+        if arrays is not None:
+            segments.append(_publish(tenant, arrays))
+
+    total = sum(len(i.seqs) for i in segments)
+    live = sum(len(i) for i in segments)
+    if len(segments) > MAX_SEGMENTS or (total and (total-live)/total > MAX_REMOVED):
+        L.debug(f"compacting {len(segments)} segments of vector store v{version}...")
+        segments = [_publish(tenant, _compact(segments))]
+
+    # publish the manifest atomically; concurrent builders of the same
+    # version write equivalent ones
+    staging = os.path.join(tenant, f".v{version}-{uuid.uuid4().hex}.json")
+    with open(staging, "w") as df:
+        json.dump({"segments": [{"name": i.name, "removed": i.removed} for i in segments]}, df)
+    os.rename(staging, os.path.join(tenant, f"v{version}.json"))
+
+    _clean(tenant, version, segments)
+
+    return VectorStore(segments, version)
+
+def _clean(tenant, version, segments):
+    # older versions stay readable by whoever has them mapped
+    for old, name in _versions(tenant):
+        if old < version:
+            try:
+                os.remove(os.path.join(tenant, name))
+            except FileNotFoundError:
+                pass
+
+    # drop segments no remaining manifest refers to
+    used = {i.name for i in segments}
+    for _, name in _versions(tenant):
+        try:
+            with open(os.path.join(tenant, name)) as df:
+                used |= {i["name"] for i in json.load(df)["segments"]}
+        except (FileNotFoundError, ValueError):
+            continue
+    for name in os.listdir(tenant):
+        path = os.path.join(tenant, name)
+        try:
+            stale = time.time()-os.path.getmtime(path) > GRACE
+        except FileNotFoundError:
+            continue
+
+        if name.startswith("s") and name not in used and stale:
+            shutil.rmtree(path, ignore_errors=True)
+
+# uid: (version, Optional[VectorStore]); None for tenants left to pgvector
+_STORES = {}
+
+# one lock per uid, so one tenant's build never holds up another's
+_LOCKS = defaultdict(threading.Lock)
+_LOCKS_LOCK = threading.Lock()
+
+def store(context, version):
+    """Get the vector store for a tenant's corpus version
+
+    Parameters
+    ----------
+    context : AgentContext
+        Context pointer to be used for operations.
+    version : int
+        The tenant's current corpus version; see corpus_version. A
+        store for a newer version, if one is loaded, is also fine.
+
+    Returns
+    -------
+    Optional[VectorStore]
+        The store, or None if the tenant is too large for one.
+    """
+
+    loaded = _STORES.get(context.uid)
+    if loaded and loaded[0] >= version:
+        return loaded[1]
+
+    with _LOCKS_LOCK:
+        lock = _LOCKS[context.uid]
+
+    with lock:
+        loaded = _STORES.get(context.uid)
+        if loaded and loaded[0] >= version:
+            return loaded[1]
+
+        tenant = _tenant_dir(context.uid)
+        previous = loaded[1] if loaded else None
+
+        try:
+            # another worker may have built it already
+            res = _load(tenant, version)
+        except FileNotFoundError:
+            if previous is None:
+                # pick up from the newest version on disk, if any
+                previous = _latest(tenant, version)
+            res = _rebuild(context, tenant, version, previous)
+
+        _STORES[context.uid] = (version, res)
+        return res
@@ -32,6 +32,15 @@ def get_db_config(raise_on_missing=False):
 
     return db_config
 
+def get_search_backend():
+    # "pgvector" (default) or "numpy"; see simon.SearchBackend
+    env_config = {
+        **dotenv_values('.env'),
+        **os.environ,  # Override values loaded from file with those set in shell (if any)
+    }
+
+    return env_config.get("SIMON_SEARCH_BACKEND") or "pgvector"
+
 def get_env_vars(raise_on_missing=False):
     # Entries in this list are required.
     needed = ['OPENAI_API_KEY']
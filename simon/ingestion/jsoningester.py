@@ -32,6 +32,7 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 import json
 
 from ..components.documents import *
+from ..components.pipeline import IngestionPipeline
 from ..models import *
 
 
@@ -45,7 +46,7 @@ class JSONIngester:
         self.__context = context
 
     ## Ingest Remote Function ###
-    def ingest(self, url, mappings:Mapping, delim="\n", local=False, load=100):
+    def ingest(self, url, mappings:Mapping, delim="\n", local=False, load=100, streaming=False):
         """Read and index a remote resource into the database with a field mapping
 
         Note
@@ -61,12 +62,15 @@ class JSONIngester:
         mappings : Mapping
             Which fields match with what index? 
         delim : optional, str
-            How do we deliminate chunks? Perhaps smarter in the future but
-            for now we are just splitting by a character.
+            Unused; kept for compatibility. parse_text chunks the
+            text itself.
         local : optional, bool
             Is this JSON a local file?
         load : optional, int
             The load to give to the ingester
+        streaming : optional, bool
+            Parse and index records through a streaming IngestionPipeline,
+            with `load` records per batch.
 
         Return
         ------
@@ -92,9 +96,16 @@ class JSONIngester:
 
         L.debug(f"Succesfuly fetched {url}. Parsing...")
 
+        if streaming:
+            pipeline = IngestionPipeline(context, batch_size=load,
+                                         parser=lambda i: parse_text(**{map.dest.value:i[map.src] for map in mappings.mappings}))
+            hashes = pipeline(data)
+            L.info(f"Done creating JSON index on {url}")
+
+            return hashes
+
         # create documents
-        docs = [parse_text(**{map.dest.value:i[map.src] for map in mappings.mappings},
-                           delim=delim)
+        docs = [parse_text(**{map.dest.value:i[map.src] for map in mappings.mappings})
                 for i in data]
         L.debug(f"Going to index {len(docs)} documents for JSON indexing.")
 
@@ -1,4 +1,5 @@
 from ..components import documents, aws
+from ..components.pipeline import IngestionPipeline
 from ..models import *
 import time
 import os
@@ -94,7 +95,7 @@ class TextFileIngester:
         return document.hash
 
     def _parse_files_segment(self, files):
-        parsed_docs = []
+        contents_list, titles, sources = [], [], []
         for file_path in files:
             title = os.path.basename(file_path)
             source = self._make_source_str(file_path)
@@ -108,21 +109,41 @@ class TextFileIngester:
             logging.info(
                 f'Loaded {file_path} in {(load_et - load_st):.2f} seconds.')
 
-            parse_st = time.time()
-            parsed = documents.parse_text(contents, title=title, source=source)
-            parse_et = time.time()
-            logging.info(
-                f'Parsed {title} in {(parse_et - parse_st):.2f} seconds.')
-            parsed_docs.append(parsed)
+            contents_list.append(contents)
+            titles.append(title)
+            sources.append(source)
+
+        # segment the whole segment at once, possibly in parallel
+        parse_st = time.time()
+        parsed_docs = documents.parse_texts(contents_list, titles, sources)
+        parse_et = time.time()
+        logging.info(
+            f'Parsed {len(parsed_docs)} files in {(parse_et - parse_st):.2f} seconds.')
         return parsed_docs
 
-    def ingest_all(self, files):
+    def _load_and_parse(self, file_path):
+        title = os.path.basename(file_path)
+        source = self._make_source_str(file_path)
+
+        contents = self._load_file(file_path)
+        if not contents:
+            logging.error(f'Error loading {file_path}. Skipping...')
+            return
+
+        return documents.parse_text(contents, title=title, source=source)
+
+    def ingest_all(self, files, streaming=False, **kwargs):
         """Ingest a group of files based on their URIs.
 
         Parameters
         ----------
         file_path : List[str]
             List of file paths (local or S3) to ingest.
+        streaming : optional, bool
+            Load, parse and index files through a streaming
+            IngestionPipeline instead of in segments of 50.
+        **kwargs
+            Passed to IngestionPipeline when streaming.
 
         Returns
         -------
@@ -130,6 +151,10 @@ class TextFileIngester:
             Hashes of the ingested files, used for deletion later.
         """
 
+        if streaming:
+            pipeline = IngestionPipeline(self.agent_context, parser=self._load_and_parse, **kwargs)
+            return pipeline(files)
+
         ingest_all_st = time.time()
         file_hashes = []
         segment_size = 50
@@ -1,5 +1,8 @@
 from .models import *
 from .components.documents import *
+from .components.adocuments import asearch, aassemble_chunks, acorpus_version
+from .components.embeddings import normalize_query
+from .utils.cache import LRUCache
 
 from abc import ABC, abstractproperty, abstractmethod
 from dataclasses import dataclass
@@ -12,8 +15,14 @@ L = logging.getLogger("simon")
 from .agents.querybreaker import QueryBreaker
 
 
+import asyncio
 import itertools
 
+# retrievals shared by every KnowledgeBase in this process, keyed by
+# (uid, normalized inputs, corpus version); any write bumps the
+# version, so stale entries are never hit again and just age out
+_RESULTS = LRUCache(maxsize=1024)
+
 def dedup(k):
     """Dedpulicate an unhashable-type list (i.e. set() can't work)
 
@@ -42,13 +51,27 @@ class KnowledgeBase():
     ----------
     context : AgentContext
         The context with which to seed the kb.
+    persistent_cache : optional, bool
+        Whether query rewrites are also cached in the database.
     """
 
-    def __init__(self, context):
+    def __init__(self, context, persistent_cache=False):
         self.context = context
-        self.__qb = QueryBreaker(context)
+        self.__qb = QueryBreaker(context, persistent=persistent_cache)
 
     def __call__(self, *inputs):
+        key = self.__key(inputs, corpus_version(self.context))
+        cached = _RESULTS.get(key)
+        if cached is not None:
+            L.debug(f"Retrieval for \"{inputs}\" served from cache.")
+            return list(cached)
+
+        res = self.__retrieve(*inputs)
+        self.__store(key, res)
+
+        return res
+
+    def __retrieve(self, *inputs):
         L.info(f"Semantic searching for query \"{inputs}\"...")
         # break the query
         queries = []
@@ -62,11 +85,86 @@ class KnowledgeBase():
             return []
         
         # use both types of search to create all possible hits
-        results_semantic = search(queries=queries, context=self.context, search_type=IndexClass.CHUNK, k=15)
+        results_semantic = search(queries=queries, context=self.context, search_type=IndexClass.CHUNK, k=15,
+                                  batched=True)
 
         # results_semantic = sorted(results_semantic, key=lambda x:x["score"], reverse=True)
         # breakpoint()
 
+        results = self.__filter(inputs, results_semantic)
+
+        # create chunks: list of tuples of (score, title, text with context)
+        L.debug(f"Assembling chunks for \"{inputs}\"...")
+        chunks = assemble_chunks(results, self.context)
+
+        return self.__respond(chunks)
+
+    async def acall(self, *inputs):
+        """Search the knowledge base for each input, asynchronously
+
+        Parameters
+        ----------
+        *inputs : str
+            The questions to search for; they are broken into
+            search queries concurrently.
+
+        Returns
+        -------
+        List[SimonProviderResponse]
+            The assembled resources found.
+        """
+
+        key = self.__key(inputs, await acorpus_version(self.context))
+        cached = _RESULTS.get(key)
+        if cached is not None:
+            L.debug(f"Retrieval for \"{inputs}\" served from cache.")
+            return list(cached)
+
+        res = await self.__aretrieve(*inputs)
+        self.__store(key, res)
+
+        return res
+
+    async def __aretrieve(self, *inputs):
+        L.info(f"Async semantic searching for query \"{inputs}\"...")
+        # break every input at once
+        broken = await asyncio.gather(*[self.__qb.acall(input) for input in inputs])
+        queries = [j for i in broken if i != None for j in i]
+        L.debug(f"Final search queries \"{queries}\"...")
+
+        if len(queries) == 0:
+            return []
+
+        results_semantic = await asearch(queries=queries, context=self.context, search_type=IndexClass.CHUNK, k=15,
+                                         batched=True)
+        results = self.__filter(inputs, results_semantic)
+
+        L.debug(f"Assembling chunks for \"{inputs}\"...")
+        chunks = await aassemble_chunks(results, self.context)
+
+        return self.__respond(chunks)
+
+    def __key(self, inputs, version):
+        return (self.context.uid, tuple(normalize_query(i) for i in inputs), version)
+
+    def __store(self, key, res):
+        # errors aren't cached, so they are retried
+        if isinstance(res, list):
+            _RESULTS.put(key, list(res))
+
+    @staticmethod
+    def cache_stats():
+        """Hit and miss counters for the in-memory retrieval cache
+
+        Returns
+        -------
+        Dict[str, int]
+            hits, misses, hit rate, evictions, current size, and maximum size.
+        """
+
+        return _RESULTS.stats
+
+    def __filter(self, inputs, results_semantic):
         L.debug(f"Results identified for \"{inputs}\" Got {len(results_semantic)} results.")
 
         total_text = "".join(i["text"] for i in results_semantic)
@@ -77,16 +175,13 @@ class KnowledgeBase():
             total_text = "".join(i["text"] for i in results_semantic)
         L.debug(f"Filtering complete for \"{inputs}\". {len(results_semantic)} results remain.")
 
-        results = results_semantic
-
-
-        # create chunks: list of tuples of (score, title, text with context)
-        L.debug(f"Assembling chunks for \"{inputs}\"...")
-        chunks = assemble_chunks(results, self.context)
+        return results_semantic
 
+    def __respond(self, chunks):
         responses = [SimonProviderResponse(title, body, {"source": source,
-                                                         "hash": hash})
-                     for title, body, source, hash in chunks]
+                                                         "hash": hash,
+                                                         "sentences": sentences})
+                     for title, body, source, hash, sentences in chunks]
 
         # remove duplicates from list of lists
         # https://stackoverflow.com/questions/2213923/removing-duplicates-from-a-list-of-lists
@@ -0,0 +1,42 @@
+-- Idempotent upgrades for databases created with an older schema.sql.
+-- Safe to run repeatedly; see simon.provision.migrate.
+
+CREATE TABLE IF NOT EXISTS simon_embedding_cache (
+    hash TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    embedding vector(1536) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS simon_query_cache (
+    hash TEXT PRIMARY KEY,
+    queries TEXT[]
+);
+
+CREATE TABLE IF NOT EXISTS simon_corpus_version (
+    uid TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- the (uid, hash, seq) chunk index isn't built here: a plain CREATE
+-- INDEX would block writes to simon_paragraphs while it builds, and
+-- this runs in one transaction, where CONCURRENTLY can't; run
+-- simon.cluster, which builds it concurrently, after migrating
+
+-- older ingesters could race and index a document twice; keep one
+-- copy of each, and of each of its chunks, before enforcing uniqueness;
+-- ON CONFLICT (uid, hash) needs the index, so it is built here, which
+-- blocks writes to simon_fulltext (one row per document) meanwhile
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE relname = 'simon_fulltext_doc_index') THEN
+        DELETE FROM simon_fulltext a USING simon_fulltext b
+            WHERE a.uid = b.uid AND a.hash = b.hash AND a.ctid > b.ctid;
+        DELETE FROM simon_paragraphs a USING simon_paragraphs b
+            WHERE a.uid = b.uid AND a.hash = b.hash AND a.seq = b.seq AND a.ctid > b.ctid;
+        CREATE UNIQUE INDEX simon_fulltext_doc_index ON simon_fulltext USING BTREE (uid, hash);
+    END IF;
+END $$;
+
+-- sentence offsets, [start, end, start, end, ...], within each chunk;
+-- NULL for chunks indexed before they were stored
+ALTER TABLE simon_paragraphs ADD COLUMN IF NOT EXISTS sentences INTEGER[];
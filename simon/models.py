@@ -13,27 +13,92 @@ class AgentContext:
     embedding: Embeddings
     cnx: Any # psql connection 
     uid: str
+    pool: Any = None # optional ConnectionPool; if set, connections are borrowed per operation
+    apool: Any = None # optional psycopg AsyncConnectionPool for async operations
+    backend: Any = None # optional SearchBackend for chunk search; pgvector if not set
 
-@dataclass
 class ParsedDocument:
-    main_document: str
-    paragraphs: List[str]
-    meta: Dict
+    """A parsed document, ready to be indexed
+
+    The sha256 digest of main_document is computed at most once
+    (or taken from the parser, if it already has it), and
+    recomputed only if main_document is replaced.
+
+    Parameters
+    ----------
+    main_document : str
+        The full text of the document.
+    paragraphs : List[str]
+        The chunks to index.
+    meta : Dict
+        Document metadata (title, source).
+    hash : optional, str
+        The sha256 hex digest of main_document, if already known.
+    """
+
+    __slots__ = ("__main_document", "__digest", "paragraphs", "meta")
+
+    def __init__(self, main_document:str, paragraphs:List[str], meta:Dict, hash:Optional[str]=None):
+        self.__main_document = main_document
+        self.__digest = hash
+        self.paragraphs = paragraphs
+        self.meta = meta
+
+    @property
+    def main_document(self):
+        return self.__main_document
+
+    @main_document.setter
+    def main_document(self, value):
+        self.__main_document = value
+        self.__digest = None
 
     @property
     def hash(self):
-        return hashlib.sha256(self.main_document.encode()).hexdigest()
+        if self.__digest is None:
+            self.__digest = hashlib.sha256(self.__main_document.encode()).hexdigest()
+        return self.__digest
 
     def __hash__(self):
-        try:
-            return hash((self.main_document, self.paragraphs[0], self.paragraphs[-1], self.hash))
-        except IndexError:
-            return hash((self.main_document, "", "$$$NOTFOUND$$$", self.hash))
+        return hash(self.hash)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParsedDocument):
+            return NotImplemented
+        return (self.hash == other.hash and
+                self.paragraphs == other.paragraphs and
+                self.meta == other.meta)
+
+    def __getstate__(self):
+        return (self.__main_document, self.__digest, self.paragraphs, self.meta)
+
+    def __setstate__(self, state):
+        (self.__main_document, self.__digest, self.paragraphs, self.meta) = state
+
+    def __repr__(self):
+        return f"ParsedDocument(hash={self.hash!r}, paragraphs=<{len(self.paragraphs)}>, meta={self.meta!r})"
 
 class IndexClass(Enum):
     CHUNK = 0
     FULLTEXT = 1
 
+class WriteMethod(Enum):
+    VALUES = 0
+    COPY = 1
+
+class VectorIndex(Enum):
+    IVFFLAT = "ivfflat"
+    HNSW = "hnsw"
+
+class SearchBackend(Enum):
+    PGVECTOR = "pgvector"
+    NUMPY = "numpy" # exact, in-process; see components.vectorstore
+
+class StreamFormat(Enum):
+    JSON = "streaming" # JSON objects back to back, unframed
+    SSE = "sse"
+    NDJSON = "ndjson"
+
 class DataType(Enum):
     JSON = 0
 
@@ -1,9 +1,14 @@
 from psycopg2 import connect
-from psycopg2.errors import DuplicateTable, InFailedSqlTransaction, FeatureNotSupported
+from psycopg2.errors import DuplicateTable, InFailedSqlTransaction, FeatureNotSupported, UndefinedObject
 
+from .models import VectorIndex
 from .environment import get_db_config
+from .components.pool import borrow
+from .components.documents import search_results, assemble_chunks
 
 import os
+import math
+import time
 
 import logging
 L = logging.getLogger("simon")
@@ -46,10 +51,270 @@ def setup(context):
     """
     
     L.debug("Running Simon setup...") 
-    cnx = context.cnx
-    __run_setup(cnx)
+    with borrow(context) as context:
+        __run_setup(context.cnx)
     L.info("Successfully set up database tables.") 
 
+def __run_migrate(cnx):
+    abspath = os.path.abspath(__file__)
+    dname = os.path.dirname(abspath)
+
+    with open(os.path.join(dname, "migrate.sql"), "r") as df:
+        migration = df.read()
+
+    try:
+        with cnx.cursor() as cursor:
+            cursor.execute(migration)
+    except InFailedSqlTransaction:
+        cnx.rollback()
+        return __run_migrate(cnx)
+
+    cnx.commit()
+
+def migrate(context):
+    """upgrade an existing simon database to the current schema
+
+    Creates any tables added since the database was set up. Used
+    for side effects, and safe to call more than once. Run `cluster`
+    afterwards to build the chunk index without locking writes.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The agentcontext whose database to upgrade.
+    """
+
+    L.debug("Running Simon migrations...")
+    with borrow(context) as context:
+        __run_migrate(context.cnx)
+    L.info("Successfully migrated database tables.")
+
+#### INDEX MANAGEMENT ####
+EMBEDDING_INDEX = "simon_paragraphs_embedding_ip_idx"
+
+def ivfflat_lists(rows):
+    """pick the ivfflat `lists` for a table of the given size
+
+    Follows pgvector's guidance: rows/1000 lists up to a million
+    rows, and sqrt(rows) beyond that.
+
+    Parameters
+    ----------
+    rows : int
+        Number of rows in simon_paragraphs.
+
+    Returns
+    -------
+    int
+        The number of lists to build.
+    """
+
+    if rows <= 1000000:
+        return max(1, rows//1000)
+    return int(math.sqrt(rows))
+
+def __index_method(cursor, name):
+    cursor.execute("SELECT am.amname FROM pg_class c JOIN pg_am am ON c.relam = am.oid WHERE c.relname = %s;", (name,))
+    res = cursor.fetchone()
+
+    return res[0] if res else None
+
+def __index_size(cursor, name):
+    cursor.execute("SELECT pg_relation_size(%s::regclass), pg_size_pretty(pg_relation_size(%s::regclass));", (name, name))
+    return cursor.fetchone()
+
+def __run_reindex(cnx, method, lists, m, ef_construction):
+    with cnx.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM simon_paragraphs;")
+        rows = cursor.fetchone()[0]
+
+        if method == VectorIndex.HNSW:
+            params = {"m": int(m), "ef_construction": int(ef_construction)}
+        else:
+            params = {"lists": int(lists) if lists else ivfflat_lists(rows)}
+        options = ", ".join(f"{k} = {v}" for k,v in params.items())
+
+        current = __index_method(cursor, EMBEDDING_INDEX)
+        L.info(f"Building {method.value} index on {rows} rows with ({options}); currently {current}...")
+
+        st = time.monotonic()
+        if current == method.value == VectorIndex.IVFFLAT.value:
+            # same kind of index: retune it in place, then rebuild it
+            # next to the old one, which serves reads and writes meanwhile
+            cursor.execute(f"ALTER INDEX {EMBEDDING_INDEX} SET ({options});")
+            cursor.execute(f"REINDEX INDEX CONCURRENTLY {EMBEDDING_INDEX};")
+        else:
+            # otherwise build the new index concurrently, and swap it in
+            staging = EMBEDDING_INDEX+"_new"
+            # a failed concurrent build leaves an invalid index behind
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {staging};")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {staging} ON simon_paragraphs USING {method.value} (embedding vector_ip_ops) WITH ({options});")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {EMBEDDING_INDEX};")
+            cursor.execute(f"ALTER INDEX {staging} RENAME TO {EMBEDDING_INDEX};")
+        elapsed = time.monotonic()-st
+
+        size, pretty = __index_size(cursor, EMBEDDING_INDEX)
+
+    L.info(f"Built {method.value} index in {round(elapsed, 2)} seconds; it takes {pretty}.")
+
+    return {
+        "index": EMBEDDING_INDEX,
+        "method": method.value,
+        "rows": rows,
+        "options": params,
+        "seconds": elapsed,
+        "bytes": size,
+        "size": pretty
+    }
+
+def reindex(context, method=VectorIndex.IVFFLAT, lists=None, m=16, ef_construction=64):
+    """(re)build the approximate nearest neighbor index on chunk embeddings
+
+    The ivfflat index created by `setup` is trained on an empty table,
+    and its `lists` never adapt as the table grows; call this after
+    loading data, and again as it grows. Indices are built
+    concurrently, so reads and writes continue during the build.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The agentcontext whose database to index.
+    method : optional, VectorIndex
+        The kind of index to build.
+    lists : optional, int
+        ivfflat only: the number of lists, or None to size it from
+        the current row count (see `ivfflat_lists`).
+    m : optional, int
+        HNSW only: connections per layer.
+    ef_construction : optional, int
+        HNSW only: size of the candidate list while building.
+
+    Returns
+    -------
+    Dict
+        The index built, its options, the build time in seconds,
+        and its size on disk.
+    """
+
+    with borrow(context) as context:
+        cnx = context.cnx
+        # CONCURRENTLY can't run inside a transaction
+        cnx.commit()
+        autocommit = cnx.autocommit
+        cnx.autocommit = True
+
+        try:
+            return __run_reindex(cnx, method, lists, m, ef_construction)
+        except UndefinedObject as e:
+            if method == VectorIndex.HNSW:
+                raise ValueError(f"{e}\nHint: HNSW indices need pgvector 0.5.0 or newer; upgrade the extension with ALTER EXTENSION vector UPDATE, or use VectorIndex.IVFFLAT.")
+            raise
+        finally:
+            cnx.autocommit = autocommit
+
+#### STORAGE LAYOUT ####
+DOCUMENT_INDEX = "simon_paragraphs_doc_index"
+
+def __sample_results(cursor, uid, rounds, sample):
+    # random chunks, shaped like search() results, to assemble
+    cursor.execute("SELECT text, hash, src, title, tf, seq, total, sentences FROM simon_paragraphs WHERE uid = %s ORDER BY random() LIMIT %s;",
+                   (uid, rounds*sample))
+    results = search_results(cursor.fetchall())
+
+    return [results[i:i+sample] for i in range(0, len(results), sample)]
+
+def __time_assembly(samples, context):
+    if not samples:
+        return None
+
+    times = []
+    for results in samples:
+        st = time.perf_counter()
+        assemble_chunks(results, context)
+        times.append(time.perf_counter()-st)
+    times = sorted(times)
+
+    return {
+        "mean_ms": 1000*sum(times)/len(times),
+        "p95_ms": 1000*times[min(len(times)-1, int(0.95*len(times)))],
+    }
+
+def cluster(context, rounds=20, sample=5):
+    """store each document's chunks together on disk
+
+    Ensures the composite (uid, hash, seq) index that chunk window
+    fetches (get_range_chunks, get_nth_chunk, top_tf, delete_document)
+    filter by (rebuilding it if a previous build was interrupted and
+    left it invalid), drops the single-column indices it replaces, and
+    CLUSTERs simon_paragraphs on it so that neighbouring chunks of a
+    document share heap pages. bulk_index writes each document's
+    chunks contiguously, so new data mostly keeps this layout; run
+    this again after heavy churn.
+
+    CLUSTER rewrites the table and holds an exclusive lock on it
+    while it does; run it during a maintenance window.
+
+    Parameters
+    ----------
+    context : AgentContext
+        The agentcontext whose database to cluster. Latency is
+        sampled from this context's documents.
+    rounds : optional, int
+        Number of assemble_chunks calls to time before and after.
+    sample : optional, int
+        Number of chunks to assemble per call.
+
+    Returns
+    -------
+    Dict
+        Time taken, and assemble_chunks latency before and after
+        (None if the context has no documents).
+    """
+
+    with borrow(context) as context:
+        cnx = context.cnx
+        # CONCURRENTLY can't run inside a transaction
+        cnx.commit()
+        autocommit = cnx.autocommit
+        cnx.autocommit = True
+
+        try:
+            with cnx.cursor() as cursor:
+                samples = __sample_results(cursor, context.uid, rounds, sample)
+                before = __time_assembly(samples, context)
+                L.info(f"assemble_chunks before clustering: {before}")
+
+                st = time.monotonic()
+                # a CREATE INDEX CONCURRENTLY that failed part way (say,
+                # an earlier run was interrupted) leaves the index behind,
+                # marked invalid; IF NOT EXISTS would then skip it, and
+                # CLUSTER refuses invalid indices, so build it again
+                cursor.execute("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s;",
+                               (DOCUMENT_INDEX,))
+                valid = cursor.fetchone()
+                if valid is not None and not valid[0]:
+                    L.warning(f"{DOCUMENT_INDEX} is invalid; rebuilding it.")
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {DOCUMENT_INDEX};")
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {DOCUMENT_INDEX} ON simon_paragraphs USING BTREE (uid, hash, seq);")
+                cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS simon_paragraphs_chunk_hash;")
+                cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS simon_paragraphs_chunk_index;")
+                cursor.execute(f"CLUSTER simon_paragraphs USING {DOCUMENT_INDEX};")
+                cursor.execute("ANALYZE simon_paragraphs;")
+                elapsed = time.monotonic()-st
+
+                after = __time_assembly(samples, context)
+                L.info(f"assemble_chunks after clustering: {after}")
+        finally:
+            cnx.autocommit = autocommit
+
+    L.info(f"Clustered simon_paragraphs in {round(elapsed, 2)} seconds.")
+
+    return {
+        "seconds": elapsed,
+        "before": before,
+        "after": after
+    }
+
 def execute():
     db_config = get_db_config()
 
@@ -0,0 +1,246 @@
+"""
+registry.py
+Process-wide clients and agents, handed out to per-user contexts
+"""
+
+import time
+import threading
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+import logging
+L = logging.getLogger("simon")
+
+from .models import AgentContext
+from .start import make_open_ai
+from .search import Search
+from .kb import KnowledgeBase
+from .store import Datastore
+from .agents import Reason, RIO
+from .utils.cache import LRUCache
+
+# keep-alive connections held open to each host (i.e. OpenAI)
+HTTP_CONNECTIONS = 32
+
+def http_session(connections=HTTP_CONNECTIONS):
+    """Make a pooled HTTP session, and route OpenAI's calls through it
+
+    Parameters
+    ----------
+    connections : optional, int
+        Keep-alive connections to hold open per host.
+
+    Returns
+    -------
+    requests.Session
+        The session.
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    openai.requestssession = session
+
+    return session
+
+class Registry:
+    """Builds Simon's clients and agents once, for a whole process
+
+    The LLM and embedding clients, the HTTP session behind them, and
+    the Reason and RIO agents are built when the registry is. Each
+    user then gets a lightweight AgentContext over them, plus a
+    Search and a Datastore, which are kept for the next request.
+
+    Parameters
+    ----------
+    pool : optional, ConnectionPool
+        The database pool the contexts borrow connections from.
+    apool : optional, AsyncConnectionPool
+        The async database pool, for async operations.
+    openai_api_key : optional, str
+        OpenAI API key to use, or read from enviroment variable.
+    oai_config : optional, dict
+        Full OpenAI Config
+    verbose : optional, bool
+        Whether the chains should be verbose.
+    persistent_cache : optional, bool
+        Whether query rewrites are also cached in the database.
+    maxsize : optional, int
+        How many users' contexts to keep.
+    backend : optional, SearchBackend
+        How the contexts search chunks; pgvector if not set.
+    """
+
+    def __init__(self, pool=None, apool=None, openai_api_key=None, oai_config=None,
+                 verbose=False, persistent_cache=True, maxsize=1024, backend=None):
+        self.pool = pool
+        self.apool = apool
+        self.backend = backend
+        self.verbose = verbose
+        self.persistent_cache = persistent_cache
+
+        st = time.perf_counter()
+        self.session = http_session()
+        (self.llm, self.reason_llm, self.embedding) = make_open_ai(openai_api_key, oai_config)
+        self.__clients_seconds = time.perf_counter()-st
+
+        # the agents only use the LLMs, so any context will do
+        st = time.perf_counter()
+        template = self.__context(None)
+        self.__reason = Reason(template, verbose)
+        self.__rio = RIO(template, verbose)
+        self.__agents_seconds = time.perf_counter()-st
+
+        self.__contexts = LRUCache(maxsize)
+        self.__searches = LRUCache(maxsize)
+        self.__stores = LRUCache(maxsize)
+
+        # kind: [builds, seconds spent building]
+        self.__builds = {"search": [0, 0.0], "store": [0, 0.0]}
+        self.__lock = threading.Lock()
+
+        L.debug(f"Registry ready; clients took {self.__clients_seconds:.3f}s, agents {self.__agents_seconds:.3f}s.")
+
+    def __context(self, uid):
+        return AgentContext(self.llm, self.reason_llm, self.embedding,
+                            None, uid, self.pool, self.apool, self.backend)
+
+    def __get(self, cache, kind, uid, build):
+        res = cache.get(uid)
+        if res is not None:
+            return res
+
+        # two requests may race to build the same entry; either is fine
+        st = time.perf_counter()
+        res = build()
+        elapsed = time.perf_counter()-st
+
+        cache.put(uid, res)
+        if kind:
+            with self.__lock:
+                self.__builds[kind][0] += 1
+                self.__builds[kind][1] += elapsed
+
+        return res
+
+    def context(self, uid):
+        """Get the context for a user
+
+        Parameters
+        ----------
+        uid : str
+            The user.
+
+        Returns
+        -------
+        AgentContext
+            A context over the shared clients and database pools.
+        """
+
+        return self.__get(self.__contexts, None, uid, lambda: self.__context(uid))
+
+    def search(self, uid):
+        """Get the Search for a user
+
+        Parameters
+        ----------
+        uid : str
+            The user.
+
+        Returns
+        -------
+        Search
+            A Search using the shared agents.
+        """
+
+        return self.__get(self.__searches, "search", uid,
+                          lambda: Search(self.context(uid), self.verbose, self.persistent_cache,
+                                         reason=self.__reason, rio=self.__rio))
+
+    def datastore(self, uid):
+        """Get the Datastore for a user
+
+        Parameters
+        ----------
+        uid : str
+            The user.
+
+        Returns
+        -------
+        Datastore
+            The user's Datastore.
+        """
+
+        return self.__get(self.__stores, "store", uid, lambda: Datastore(self.context(uid)))
+
+    @property
+    def stats(self):
+        """What building things once has saved
+
+        Before the registry, every request built its clients, and
+        then its Search or Datastore. `saved_seconds` estimates the
+        time that would have taken for the requests served since,
+        from what building them once here took.
+
+        Returns
+        -------
+        Dict
+            Setup timings, cache counters (including retrievals
+            served from memory), and seconds saved.
+        """
+
+        with self.__lock:
+            builds = {k: {"builds": n, "mean_seconds": (t/n if n else None)}
+                      for k, (n, t) in self.__builds.items()}
+
+        contexts = self.__contexts.stats
+        requests = contexts["hits"]+contexts["misses"]
+
+        saved = requests*self.__clients_seconds
+        for cache, kind in [(self.__searches, "search"), (self.__stores, "store")]:
+            mean = builds[kind]["mean_seconds"]
+            if kind == "search":
+                # agents used to be built with every Search
+                mean = (mean or 0)+self.__agents_seconds
+            saved += cache.hits*(mean or 0)
+
+        return {
+            "clients_seconds": self.__clients_seconds,
+            "agents_seconds": self.__agents_seconds,
+            "builds": builds,
+            "contexts": contexts,
+            "searches": self.__searches.stats,
+            "stores": self.__stores.stats,
+            "results": KnowledgeBase.cache_stats(),
+            "saved_seconds": saved,
+        }
+
+if __name__ == "__main__":
+    # compare the setup each request used to do with the registry's
+    from .components.pool import ConnectionPool
+    from .environment import get_db_config
+
+    pool = ConnectionPool(maxconn=2, **get_db_config())
+    uids = [f"registry-bench-{i%8}" for i in range(64)]
+
+    st = time.perf_counter()
+    for uid in uids:
+        (g3, g4, em) = make_open_ai()
+        Search(AgentContext(g3, g4, em, None, uid, pool), persistent_cache=True)
+    before = (time.perf_counter()-st)/len(uids)
+
+    registry = Registry(pool)
+    st = time.perf_counter()
+    for uid in uids:
+        registry.search(uid)
+    after = (time.perf_counter()-st)/len(uids)
+
+    print(f"per request setup, before: {before*1000:.2f}ms")
+    print(f"per request setup, after:  {after*1000:.2f}ms")
+    print(registry.stats)
+
+    pool.close()
@@ -33,14 +33,35 @@ CREATE TABLE simon_paragraphs (
     title_fuzzy tsvector GENERATED ALWAYS AS (to_tsvector('english', title)) STORED,
     tf FLOAT DEFAULT 0.0,
     seq INTEGER DEFAULT 0,
-    total INTEGER DEFAULT 0
+    total INTEGER DEFAULT 0,
+    sentences INTEGER[]
 );
 
+CREATE TABLE simon_embedding_cache (
+    hash TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    embedding vector(1536) NOT NULL
+);
+
+CREATE TABLE simon_query_cache (
+    hash TEXT PRIMARY KEY,
+    queries TEXT[]
+);
+
+-- bumped whenever a uid's documents change; keys cached retrievals
+CREATE TABLE simon_corpus_version (
+    uid TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+-- trained on an empty table; rebuild with simon.reindex once data is loaded
 CREATE INDEX simon_paragraphs_embedding_ip_idx ON simon_paragraphs USING ivfflat (embedding vector_ip_ops) WITH (lists = 300);
 CREATE INDEX simon_paragraphs_text_index ON simon_paragraphs USING GIN (text_fuzzy);
-CREATE INDEX simon_paragraphs_chunk_index ON simon_paragraphs USING BTREE (seq);
+-- chunk windows are fetched by (uid, hash, seq); see simon.provision.cluster
+CREATE INDEX simon_paragraphs_doc_index ON simon_paragraphs USING BTREE (uid, hash, seq);
 CREATE INDEX simon_paragraphs_tf_index ON simon_paragraphs USING BTREE (tf);
-CREATE INDEX simon_paragraphs_chunk_hash ON simon_paragraphs USING HASH (hash);
 CREATE INDEX simon_paragraphs_title_index ON simon_paragraphs USING GIN (title_fuzzy);
+-- one row per document; lets concurrent ingesters skip with ON CONFLICT DO NOTHING
+CREATE UNIQUE INDEX simon_fulltext_doc_index ON simon_fulltext USING BTREE (uid, hash);
 CREATE INDEX simon_fulltext_text_index ON simon_fulltext USING GIN (text_fuzzy);
 CREATE INDEX simon_fulltext_title_index ON simon_fulltext USING GIN (title_fuzzy);
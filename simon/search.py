@@ -5,6 +5,8 @@ L = logging.getLogger("simon")
 from .models import *
 from .kb import *
 from .components.documents import *
+from .components.adocuments import aautocomplete
+from .utils.delta import delta_stream, adelta_stream
 
 # RIO, Followup, and Reason
 from .agents import *
@@ -26,18 +28,36 @@ def threadpool(f, executor=None):
     return wrap
 
 class Search:
-    def __init__(self, context: AgentContext, verbose=False):
+    """Search, reason over, and brainstorm with a knowledge base
+
+    Parameters
+    ----------
+    context : AgentContext
+        The context to search under.
+    verbose : optional, bool
+        Whether the chains should be verbose.
+    persistent_cache : optional, bool
+        Whether query rewrites are also cached in the database.
+    reason : optional, Reason
+        An existing Reason agent to use; it holds no per-user state,
+        so one can be shared between Searches.
+    rio : optional, RIO
+        An existing RIO agent to use, likewise.
+    """
+
+    def __init__(self, context: AgentContext, verbose=False, persistent_cache=False,
+                 reason=None, rio=None):
         #  knowledge base
-        self.__kb = KnowledgeBase(context)
+        self.__kb = KnowledgeBase(context, persistent_cache)
 
         # agents
-        self.__rio = RIO(context, verbose)
-        self.__reason = Reason(context, verbose)
+        self.__rio = rio or RIO(context, verbose)
+        self.__reason = reason or Reason(context, verbose)
 
         #### Context ####
         self.__context = context
 
-    def query(self, text, streaming=False):
+    def query(self, text, streaming=False, delta=False):
         """invokes the inference cycle
 
         uses all of the Assistant's tools to create an inference
@@ -48,6 +68,9 @@ class Search:
             the string input query
         streaming : optional, bool
             Return a generator for streaming instead
+        delta : optional, bool
+            Stream the resource table once, then only what changed;
+            see utils.delta
 
         Returns
         -------
@@ -78,6 +101,8 @@ class Search:
 
             # L.debug("REASONING")
             output = self.__reason(text, resources, streaming)
+            if streaming and delta and output:
+                output = delta_stream(output, resources)
             return output
 
         results_promise = process()
@@ -91,12 +116,17 @@ class Search:
             results_generator = results_promise.result()
             if not results_generator:
                 results_generator = []
-            for i in results_generator:
-                yield i
+            try:
+                for i in results_generator:
+                    yield i
+            finally:
+                # closing early cancels the LLM call behind the stream
+                if hasattr(results_generator, "close"):
+                    results_generator.close()
 
         return stream_generator()
 
-    def brainstorm(self, text, streaming=False):
+    def brainstorm(self, text, streaming=False, delta=False):
         """Use the RIO to brainstorm followup questions
 
         Uses the RIO to come up with follow-up questions given a
@@ -111,6 +141,9 @@ class Search:
             Whether to call queryfixer
         streaming : optional, bool
             Return a generator for streaming instead
+        delta : optional, bool
+            Stream the resource table once, then only what changed;
+            see utils.delta
 
         Returns
         -------
@@ -133,6 +166,8 @@ class Search:
             L.info(f"Search complete for \"{text}\".")
 
             observation = self.__rio(text, kb, streaming)
+            if streaming and delta and observation:
+                observation = delta_stream(observation, kb)
             return observation
 
         results_promise = process()
@@ -148,8 +183,13 @@ class Search:
             if not results_generator:
                 results_generator = []
 
-            for i in results_generator:
-                yield i
+            try:
+                for i in results_generator:
+                    yield i
+            finally:
+                # closing early cancels the LLM call behind the stream
+                if hasattr(results_generator, "close"):
+                    results_generator.close()
 
         return stream_generator()
         
@@ -162,6 +202,9 @@ class Search:
         # query the kb first
         res = self.__kb(text)
 
+        return self.__serialize(res)
+
+    def __serialize(self, res):
         if type(res) == SimonProviderError:
             return
 
@@ -171,6 +214,7 @@ class Search:
                            "source": r.metadata["source"],
                            "hash": r.metadata["hash"],
                            "title": r.title,
+                           "sentences": r.metadata.get("sentences"),
                        }} for r in res]
 
 
@@ -194,6 +238,113 @@ class Search:
         
         return list(sorted(set(autocomplete(query, self.__context))))
 
+    #### Async ####
+    async def aquery(self, text, streaming=False, delta=False):
+        """invokes the inference cycle, asynchronously
+
+        uses all of the Assistant's tools to create an inference
+
+        Parameters
+        ----------
+        text : str
+            the string input query
+        streaming : optional, bool
+            Return an async generator for streaming instead
+        delta : optional, bool
+            Stream the resource table once, then only what changed;
+            see utils.delta
+
+        Returns
+        -------
+        Optional[dict]
+            the output, with resource information, etc. if not streaming;
+            otherwise its passed to streaming
+        """
+
+        assert type(text) == str, f"Unexpected non-string pased to Search.aquery: {text}"
+        if text.strip() == "":
+            raise ValueError(f"Empty query found to Search.aquery! Please supply a query that is non-empty. Current query: {text}")
+
+        L.info(f"Serving async query \"{text}\"...")
+        resources = await self.asearch(text)
+        L.debug(f"Search on \"{text}\" complete")
+
+        if not resources:
+            if streaming:
+                return self.__empty()
+            return None
+
+        output = await self.__reason.acall(text, resources, streaming)
+        if streaming and delta:
+            return adelta_stream(output, resources)
+        return output
+
+    async def abrainstorm(self, text, streaming=False, delta=False):
+        """Use the RIO to brainstorm followup questions, asynchronously
+
+        Parameters
+        ----------
+        text : str
+            The text to come up with follow up questions
+        streaming : optional, bool
+            Return an async generator for streaming instead
+        delta : optional, bool
+            Stream the resource table once, then only what changed;
+            see utils.delta
+
+        Returns
+        -------
+        List[Dict[str, Union[List[str]|str]]]
+            Each follow up question, and the response if exists.
+        """
+
+        assert type(text) == str, f"Unexpected non-string pased to Search.abrainstorm: {text}"
+        if text.strip() == "":
+            raise ValueError(f"Empty query found to Search.abrainstorm! Please supply a query that is non-empty. Current query: {text}")
+
+        L.info(f"Serving async prefetch \"{text}\"...")
+        kb = await self.asearch(text)
+        L.info(f"Search complete for \"{text}\".")
+
+        observation = await self.__rio.acall(text, kb, streaming)
+
+        if streaming and not observation:
+            return self.__empty()
+        if streaming and delta:
+            return adelta_stream(observation, kb)
+        return observation
+
+    async def asearch(self, text):
+        assert type(text) == str, f"Unexpected non-string pased to Search.asearch: {text}"
+        if text.strip() == "":
+            raise ValueError(f"Empty query found to Search.asearch! Please supply a query that is non-empty. Current query: {text}")
+
+        res = await self.__kb.acall(text)
+
+        return self.__serialize(res)
+
+    async def aautocomplete(self, query:str):
+        """Autocomplete the document with the given title, asynchronously
+
+        Parameters
+        ----------
+        query : str
+            The partial title of the document to start suggesting from.
+
+        Returns
+        -------
+        List[Tuple[str, str]]
+            A list of (title, text).
+        """
+
+        assert type(query) == str, f"Unexpected non-string pased to Search.aautocomplete: {query}"
+
+        return list(sorted(set(await aautocomplete(query, self.__context))))
+
+    async def __empty(self):
+        return
+        yield
+
     def levenshteinDistance(s1, s2):
         if len(s1) > len(s2):
             s1, s2 = s2, s1
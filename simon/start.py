@@ -13,6 +13,7 @@ import logging
 L = logging.getLogger("simon")
 
 from .models import *
+from .components.pool import ConnectionPool
 from .environment import get_env_vars, get_db_config
 
 def make_open_ai(openai_api_key:str=None, oai_config:dict=None):
@@ -59,7 +60,7 @@ def make_open_ai(openai_api_key:str=None, oai_config:dict=None):
 
 def create_context(uid:str, openai_api_key:str=None,
                    db_config:dict=None, oai_config:dict=None,
-                   ssl:bool=False):
+                   ssl:bool=False, pool_size:int=None):
     """Quickstart function to build a Simon context with OpenAI
 
     Parameters
@@ -75,6 +76,10 @@ def create_context(uid:str, openai_api_key:str=None,
         Full OpenAI Config
     ssl : optional, bool
         Whether to forcibly connect to SSL.
+    pool_size : optional, int
+        If given, back the context with a pool of up to this many
+        connections instead of a single connection, so it can be
+        shared between threads.
 
     Returns
     -------
@@ -87,14 +92,16 @@ def create_context(uid:str, openai_api_key:str=None,
 
     (gpt3, gpt4, embedding) = make_open_ai(openai_api_key, oai_config)
 
-    # create db instance
     if ssl:
-        cnx = connect(**db_config, sslmode='require')
+        db_config = {**db_config, "sslmode": "require"}
+
+    # create db instance
+    if pool_size:
+        pool = ConnectionPool(maxconn=pool_size, **db_config)
+        context = AgentContext(gpt3, gpt4, embedding, None, uid, pool)
     else:
         cnx = connect(**db_config)
-
-    # build a context!
-    context = AgentContext(gpt3, gpt4, embedding, cnx, uid)
+        context = AgentContext(gpt3, gpt4, embedding, cnx, uid)
 
     return context
 
@@ -0,0 +1,121 @@
+"""
+cache.py
+Small in-process caches shared by Simon's components
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters
+
+    Parameters
+    ----------
+    maxsize : optional, int
+        The number of entries to keep before evicting the oldest.
+    ttl : optional, float
+        Seconds an entry stays valid for, or None to keep entries
+        until they are evicted.
+    """
+
+    def __init__(self, maxsize=4096, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get an entry, marking it as recently used
+
+        Parameters
+        ----------
+        key : Hashable
+            The key to look up.
+        default : optional, any
+            What to return if the key is missing.
+
+        Returns
+        -------
+        any
+            The cached value, or `default`.
+        """
+
+        with self.__lock:
+            try:
+                expires, value = self.__data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires is not None and expires < time.monotonic():
+                del self.__data[key]
+                self.misses += 1
+                return default
+
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store an entry, evicting the least recently used if full
+
+        Parameters
+        ----------
+        key : Hashable
+            The key to store under.
+        value : any
+            The value to store.
+        """
+
+        expires = time.monotonic()+self.ttl if self.ttl is not None else None
+
+        with self.__lock:
+            self.__data[key] = (expires, value)
+            self.__data.move_to_end(key)
+
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            if key not in self.__data:
+                return default
+            return self.__data.pop(key)[1]
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__data
+
+    def __len__(self):
+        return len(self.__data)
+
+    @property
+    def stats(self):
+        """Counters describing the cache's effectiveness
+
+        Returns
+        -------
+        Dict[str, int]
+            hits, misses, hit rate, evictions, current size, and maximum size.
+        """
+
+        lookups = self.hits+self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits/lookups if lookups else None),
+            "evictions": self.evictions,
+            "size": len(self.__data),
+            "maxsize": self.maxsize,
+        }
@@ -0,0 +1,181 @@
+"""
+delta.py
+Delta encoding for streamed Reason and RIO outputs.
+
+A plain stream re-sends the whole output, knowledge base chunks and
+all, whenever it changes. A delta stream instead sends
+
+1. {"type": "resources", "resources": [...]}, the resource table,
+   once; outputs then refer to chunks by their index in it,
+2. {"type": "delta", "delta": ...} with only what changed, and
+3. {"type": "final", "output": ...}, the whole final output.
+
+A delta of a string is {"append": str} or {"replace": str}; of a
+list, {"set": {index: item}, "length": int}; of a dict within an
+output, {"set": {key: value}, "remove": [key]}; of anything else,
+{"replace": value}. A whole output that is a dict (Reason's) is sent
+as {key: delta of that key} for the keys that changed.
+"""
+
+def _diff_value(old, new):
+    if isinstance(new, str) and isinstance(old, str) and new.startswith(old):
+        return {"append": new[len(old):]}
+    elif isinstance(new, list):
+        old = old if isinstance(old, list) else []
+        return {"set": {indx: i for indx, i in enumerate(new)
+                        if indx >= len(old) or old[indx] != i},
+                "length": len(new)}
+    elif isinstance(new, dict):
+        old = old if isinstance(old, dict) else {}
+        return {"set": {k:v for k,v in new.items() if old.get(k) != v},
+                "remove": [k for k in old if k not in new]}
+
+    return {"replace": new}
+
+def diff(old, new):
+    """Describe how to get from one compacted output to the next
+
+    Parameters
+    ----------
+    old : any
+        The previous output, or None.
+    new : any
+        The current output.
+
+    Returns
+    -------
+    Optional[Dict]
+        The delta, or None if nothing changed.
+    """
+
+    if old == new:
+        return
+
+    if isinstance(new, dict):
+        old = old if isinstance(old, dict) else {}
+        return {k: _diff_value(old.get(k), v) for k,v in new.items()
+                if k not in old or old[k] != v}
+
+    return _diff_value(old, new)
+
+class DeltaEncoder:
+    """Turns a stream of whole outputs into a stream of deltas
+
+    Parameters
+    ----------
+    resources : List[Dict]
+        The knowledge base the outputs cite; its entries are the
+        resource table.
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+
+        self.__ids = {id(i):indx for indx, i in enumerate(resources)}
+        self.__last = None
+
+    def __resource_id(self, chunk):
+        indx = self.__ids.get(id(chunk))
+        if indx is None:
+            # not the same object (i.e. serialized and back); compare
+            indx = next((indx for indx, i in enumerate(self.resources) if i == chunk), None)
+
+        return indx
+
+    def compact(self, output):
+        """Replace every cited chunk in an output by its resource id
+
+        Parameters
+        ----------
+        output : any
+            A Reason or RIO output.
+
+        Returns
+        -------
+        any
+            The output, with "chunk"s as indices into the resource table.
+        """
+
+        if isinstance(output, list):
+            return [self.compact(i) for i in output]
+        elif isinstance(output, dict):
+            return {k: (self.__resource_id(v) if k == "chunk" else self.compact(v))
+                    for k,v in output.items()}
+
+        return output
+
+    def start(self):
+        """The frame with the resource table, to send first"""
+
+        return {"type": "resources", "resources": self.resources, "done": False}
+
+    def encode(self, item):
+        """Encode one streamed item
+
+        Parameters
+        ----------
+        item : Dict
+            {"output": ..., "done": bool}
+
+        Returns
+        -------
+        Optional[Dict]
+            The delta (or final) frame, or None if nothing changed.
+        """
+
+        output = self.compact(item["output"])
+
+        if item["done"]:
+            self.__last = output
+            return {"type": "final", "output": output, "done": True}
+
+        delta = diff(self.__last, output)
+        self.__last = output
+
+        if not delta:
+            return
+
+        return {"type": "delta", "delta": delta, "done": False}
+
+def delta_stream(stream, resources):
+    """Delta encode a stream from Reason or RIO
+
+    Parameters
+    ----------
+    stream : Iterable[Dict]
+        The streamed outputs.
+    resources : List[Dict]
+        The knowledge base the outputs cite.
+
+    Yields
+    ------
+    Dict
+        The resources frame, then deltas, then the final frame.
+    """
+
+    encoder = DeltaEncoder(resources)
+    yield encoder.start()
+
+    try:
+        for item in stream:
+            frame = encoder.encode(item)
+            if frame:
+                yield frame
+    finally:
+        if hasattr(stream, "close"):
+            stream.close()
+
+async def adelta_stream(stream, resources):
+    """Delta encode an async stream from Reason or RIO; see delta_stream"""
+
+    encoder = DeltaEncoder(resources)
+    yield encoder.start()
+
+    try:
+        async for item in stream:
+            frame = encoder.encode(item)
+            if frame:
+                yield frame
+    finally:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
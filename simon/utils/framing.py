@@ -0,0 +1,204 @@
+"""
+framing.py
+Wire framing for streamed outputs: Server-Sent Events and NDJSON.
+"""
+
+import json
+import queue
+import asyncio
+import threading
+
+from ..models import StreamFormat
+
+import logging
+L = logging.getLogger("simon")
+
+# seconds of silence after which a heartbeat is sent; this also
+# bounds how long a disconnected client goes unnoticed
+HEARTBEAT = 15
+
+# outputs buffered ahead of a slow client before the producer waits
+BUFFER = 8
+
+CONTENT_TYPES = {
+    StreamFormat.JSON: "application/json",
+    StreamFormat.SSE: "text/event-stream",
+    StreamFormat.NDJSON: "application/x-ndjson",
+}
+
+HEADERS = {
+    "Cache-Control": "no-cache",
+    # don't let proxies (i.e. nginx) buffer the stream
+    "X-Accel-Buffering": "no",
+}
+
+_END = object()
+
+def frame(item, format, id=None):
+    """Frame one streamed output
+
+    Parameters
+    ----------
+    item : Dict
+        {"output": ..., "done": bool}
+    format : StreamFormat
+        The framing to use.
+    id : optional, int
+        SSE event id.
+
+    Returns
+    -------
+    str
+        The framed output.
+    """
+
+    data = json.dumps(item)
+
+    if format == StreamFormat.SSE:
+        event = "done" if item.get("done") else "update"
+        return (f"id: {id}\n" if id is not None else "")+f"event: {event}\ndata: {data}\n\n"
+    elif format == StreamFormat.NDJSON:
+        return data+"\n"
+
+    return data
+
+def heartbeat(format):
+    """A frame clients ignore, sent to keep the connection alive
+
+    Parameters
+    ----------
+    format : StreamFormat
+        The framing to use.
+
+    Returns
+    -------
+    str
+        An SSE comment, or a blank NDJSON line.
+    """
+
+    if format == StreamFormat.SSE:
+        return ": heartbeat\n\n"
+
+    return "\n"
+
+def frames(stream, format, heartbeat_interval=HEARTBEAT):
+    """Frame a stream of outputs, with heartbeats while it is quiet
+
+    The stream is consumed on a worker thread through a small
+    bounded buffer, so a slow client holds the producer back. When
+    the client goes away, the server closes this generator; the
+    stream is then closed too, which cancels the LLM behind it.
+
+    Parameters
+    ----------
+    stream : Iterable[Dict]
+        Outputs from Search.query or Search.brainstorm.
+    format : StreamFormat
+        The framing to use.
+    heartbeat_interval : optional, float
+        Seconds of silence before a heartbeat is sent.
+
+    Yields
+    ------
+    str
+        Framed outputs and heartbeats.
+    """
+
+    buffer = queue.Queue(BUFFER)
+    stopped = threading.Event()
+
+    def offer(item):
+        # wait for room in the buffer, unless the client is gone
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=heartbeat_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pump():
+        try:
+            for item in stream:
+                if not offer(item):
+                    break
+        except Exception:
+            L.exception("Stream failed while framing.")
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            offer(_END)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+    try:
+        id = 0
+        while True:
+            try:
+                item = buffer.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                yield heartbeat(format)
+                continue
+
+            if item is _END:
+                return
+
+            yield frame(item, format, id)
+            id += 1
+    finally:
+        stopped.set()
+
+async def aframes(stream, format, heartbeat_interval=HEARTBEAT):
+    """Frame an async stream of outputs; see frames
+
+    Parameters
+    ----------
+    stream : AsyncIterable[Dict]
+        Outputs from Search.aquery or Search.abrainstorm.
+    format : StreamFormat
+        The framing to use.
+    heartbeat_interval : optional, float
+        Seconds of silence before a heartbeat is sent.
+
+    Yields
+    ------
+    str
+        Framed outputs and heartbeats.
+    """
+
+    buffer = asyncio.Queue(BUFFER)
+
+    async def pump():
+        try:
+            async for item in stream:
+                await buffer.put(item)
+        except Exception:
+            L.exception("Stream failed while framing.")
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+            # waits for room, so the end is never dropped; if the client
+            # is gone, the pump is cancelled here instead
+            await buffer.put(_END)
+
+    task = asyncio.ensure_future(pump())
+
+    try:
+        id = 0
+        while True:
+            try:
+                item = await asyncio.wait_for(buffer.get(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                if task.done() and buffer.empty():
+                    return
+                yield heartbeat(format)
+                continue
+
+            if item is _END:
+                return
+
+            yield frame(item, format, id)
+            id += 1
+    finally:
+        # cancelling the pump cancels the prediction inside the stream
+        task.cancel()
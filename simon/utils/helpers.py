@@ -1,12 +1,11 @@
-import nltk
-from nltk import sent_tokenize
+from .segmentation import segmenter
 
 import logging
 L = logging.getLogger("simon")
 
 
 def sent_tokenize_d(sentences):
-    """Sentence tokenize `sentences`, or download punkt and then do it
+    """Sentence tokenize `sentences`, downloading punkt first if needed
 
     Parameters
     ----------
@@ -19,10 +18,46 @@ def sent_tokenize_d(sentences):
         The tokenized sentences.
     """
 
-    try:
-        return sent_tokenize(sentences)
-    except LookupError:
-        nltk.download("punkt")
-        return sent_tokenize(sentences)
+    return segmenter().segment(sentences)
 
 
+
+def kb_sentences(kb):
+    """Split each knowledge base entry, title first, into sentences
+
+    Uses the sentence spans stored at index time when an entry has
+    them, and only tokenizes the entries which don't.
+
+    Parameters
+    ----------
+    kb : List[Dict]
+        Serialized search results, with "text" and "metadata".
+
+    Returns
+    -------
+    List[List[str]]
+        The sentences of each entry.
+    """
+
+    sentences = [None]*len(kb)
+    missing = []
+
+    for indx, i in enumerate(kb):
+        title = i["metadata"]["title"] if i["metadata"]["title"] != None else ""
+        spans = i["metadata"].get("sentences")
+
+        if spans:
+            sents = [i["text"][start:end] for (start, end) in spans]
+            # the title runs into the first sentence, as it would if tokenized
+            sents[0] = f"{title} {sents[0]}".strip()
+            sentences[indx] = sents
+        else:
+            missing.append(indx)
+
+    # the tokenizer is only loaded if some entry has no stored spans
+    if len(missing) > 0:
+        for indx, sents in zip(missing, segmenter().segment_many((kb[i]["metadata"]["title"] if kb[i]["metadata"]["title"] != None else "")+" "+kb[i]["text"]
+                                                                 for i in missing)):
+            sentences[indx] = sents
+
+    return sentences
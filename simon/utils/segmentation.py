@@ -0,0 +1,226 @@
+"""
+segmentation.py
+Sentence segmentation with a preloaded punkt model.
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+
+import logging
+L = logging.getLogger("simon")
+
+# batches with fewer characters than this are segmented in-process
+PARALLEL_THRESHOLD = 1000000
+
+def _load_punkt(language):
+    try:
+        # nltk >= 3.8.2 ships punkt as tables rather than a pickle
+        from nltk.tokenize.punkt import PunktTokenizer
+        resource = "punkt_tab"
+        load = lambda: PunktTokenizer(language)
+    except ImportError:
+        resource = "punkt"
+        load = lambda: nltk.data.load(f"tokenizers/punkt/{language}.pickle")
+
+    try:
+        return load()
+    except LookupError:
+        nltk.download(resource)
+        return load()
+
+class SentenceSegmenter:
+    """Splits text into sentences with a punkt model loaded once
+
+    Equivalent to nltk's `sent_tokenize`, without looking the model
+    up again on every call.
+
+    Parameters
+    ----------
+    language : optional, str
+        The punkt model to load.
+    workers : optional, int
+        Processes to spread large `segment_many` batches across;
+        defaults to the number of CPUs. 1 never fans out.
+    """
+
+    def __init__(self, language="english", workers=None):
+        self.language = language
+        self.workers = workers or os.cpu_count() or 1
+
+        self.__tokenizer = _load_punkt(language)
+        self.__executor = None
+        self.__lock = threading.Lock()
+
+    def segment(self, text):
+        """Split a text into sentences
+
+        Parameters
+        ----------
+        text : str
+            The text to split.
+
+        Returns
+        -------
+        List[str]
+            The sentences of the text.
+        """
+
+        return self.__tokenizer.tokenize(text)
+
+    def spans(self, text):
+        """Find where each sentence of a text starts and ends
+
+        Parameters
+        ----------
+        text : str
+            The text to split.
+
+        Returns
+        -------
+        List[Tuple[int, int]]
+            (start, end) character offsets of each sentence.
+        """
+
+        return list(self.__tokenizer.span_tokenize(text))
+
+    def segment_many(self, texts):
+        """Split many texts into sentences
+
+        Batches of more than PARALLEL_THRESHOLD characters are spread
+        across worker processes, each of which loads the model once.
+
+        Parameters
+        ----------
+        texts : List[str]
+            The texts to split.
+
+        Returns
+        -------
+        List[List[str]]
+            The sentences of each text.
+        """
+
+        return self.__map(self.segment, _segment, texts)
+
+    def spans_many(self, texts):
+        """Find the sentence spans of many texts; see segment_many
+
+        Parameters
+        ----------
+        texts : List[str]
+            The texts to split.
+
+        Returns
+        -------
+        List[List[Tuple[int, int]]]
+            (start, end) character offsets of each sentence, per text.
+        """
+
+        return self.__map(self.spans, _spans, texts)
+
+    def __map(self, local, remote, texts):
+        texts = list(texts)
+
+        if (self.workers <= 1 or len(texts) < 2 or
+            sum(len(i) for i in texts) < PARALLEL_THRESHOLD):
+            return [local(i) for i in texts]
+
+        chunksize = max(1, len(texts)//(self.workers*4))
+        L.debug(f"segmenting {len(texts)} texts over {self.workers} processes...")
+
+        return list(self.__pool().map(remote, texts, chunksize=chunksize))
+
+    def __pool(self):
+        with self.__lock:
+            if self.__executor is None:
+                # spawned, not forked: chunk_updates calls us from the
+                # pipeline's threads, and a fork can copy a lock another
+                # thread holds, deadlocking the child
+                self.__executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                      mp_context=multiprocessing.get_context("spawn"),
+                                                      initializer=_initialize,
+                                                      initargs=(self.language,))
+            return self.__executor
+
+# one segmenter per worker process
+_WORKER = None
+
+def _initialize(language):
+    global _WORKER
+    _WORKER = SentenceSegmenter(language, workers=1)
+
+def _segment(text):
+    return _WORKER.segment(text)
+
+def _spans(text):
+    return _WORKER.spans(text)
+
+def sentence_spans(flat):
+    """Pair up sentence offsets as stored in simon_paragraphs.sentences
+
+    Parameters
+    ----------
+    flat : Optional[List[int]]
+        [start, end, start, end, ...], or None if none are stored.
+
+    Returns
+    -------
+    Optional[List[Tuple[int, int]]]
+        (start, end) of each sentence, or None.
+    """
+
+    if flat is None:
+        return None
+
+    return list(zip(flat[0::2], flat[1::2]))
+
+_DEFAULT = None
+_DEFAULT_LOCK = threading.Lock()
+
+def segmenter():
+    """Get the process-wide English SentenceSegmenter, loading it if needed
+
+    Returns
+    -------
+    SentenceSegmenter
+        The shared segmenter.
+    """
+
+    global _DEFAULT
+
+    if _DEFAULT is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT is None:
+                _DEFAULT = SentenceSegmenter()
+
+    return _DEFAULT
+
+if __name__ == "__main__":
+    # benchmark against calling nltk's sent_tokenize directly, which is
+    # what sent_tokenize_d did before it delegated here
+    from nltk import sent_tokenize
+
+    paragraph = ("Simon is a search engine. It reads your documents, and "
+                 "answers questions about them! Does it work on Dr. Smith's "
+                 "notes from Jan. 3rd? It should. ")
+    short = [paragraph*2 for _ in range(5000)]
+    long = [paragraph*200 for _ in range(500)]
+
+    def bench(name, f):
+        st = time.perf_counter()
+        res = f()
+        print(f"{name:<40}{time.perf_counter()-st:>10.3f}s")
+        return res
+
+    seg = segmenter()
+    for label, texts in [("5000 short texts", short), ("500 long texts", long)]:
+        print(label)
+        baseline = bench("  nltk.sent_tokenize, per text", lambda: [sent_tokenize(i) for i in texts])
+        single = bench("  SentenceSegmenter.segment, per text", lambda: [seg.segment(i) for i in texts])
+        batch = bench("  SentenceSegmenter.segment_many", lambda: seg.segment_many(texts))
+        assert baseline == single == batch
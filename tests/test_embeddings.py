@@ -0,0 +1,45 @@
+"""
+test_embeddings.py
+Dispatching embedding requests to the provider.
+"""
+
+import pytest
+from openai.error import Timeout, RateLimitError, InvalidRequestError
+
+from simon.components import embeddings
+
+class FlakyEmbeddings:
+    """Fails with each of `errors` in turn, then embeds"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(i))] for i in texts]
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(embeddings.time, "sleep", lambda _: None)
+
+def test_transient_errors_are_retried():
+    embedding = FlakyEmbeddings([RateLimitError("slow down"), Timeout("timed out")])
+
+    assert embeddings.dispatch(["a", "bb"], embedding) == [[1.0], [2.0]]
+    assert embedding.calls == 3
+
+def test_retries_are_bounded():
+    embedding = FlakyEmbeddings([Timeout("timed out")]*3)
+
+    with pytest.raises(Timeout):
+        embeddings.dispatch(["a"], embedding, max_retries=2)
+
+def test_other_errors_are_not_retried():
+    embedding = FlakyEmbeddings([InvalidRequestError("too long", None)])
+
+    with pytest.raises(InvalidRequestError):
+        embeddings.dispatch(["a"], embedding)
+    assert embedding.calls == 1
@@ -0,0 +1,19 @@
+"""
+test_helpers.py
+Splitting knowledge base entries into sentences.
+"""
+
+from simon.utils import helpers
+
+def entry(text, title, spans=None):
+    return {"text": text, "metadata": {"title": title, "sentences": spans}}
+
+def test_kb_sentences_uses_stored_spans_without_the_tokenizer(monkeypatch):
+    def segmenter():
+        raise AssertionError("the tokenizer was loaded")
+    monkeypatch.setattr(helpers, "segmenter", segmenter)
+
+    kb = [entry("One here. Two here.", "Title", [(0, 9), (10, 19)]),
+          entry("Three.", None, [(0, 6)])]
+
+    assert helpers.kb_sentences(kb) == [["Title One here.", "Two here."], ["Three."]]
@@ -0,0 +1,86 @@
+"""
+test_streaming.py
+Streamed Search.query outputs, end to end through the framing.
+"""
+
+import time
+import threading
+
+import pytest
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+
+from simon.models import AgentContext, StreamFormat
+from simon.search import Search
+from simon.utils.framing import frames
+
+STREAMS = 50
+TOKENS = 100
+DELAY = 0.02 # seconds between tokens, about GPT-4's pace
+MAX_CPU = 0.5 # of one core, across every stream
+
+# one search result, then a one paragraph response citing both resources
+ANSWER = ["Search", " Results", ":\n", "- first", " [0]\n", "Response", ":"]
+ANSWER += [f" word{i}"+(f" [{i//10%2}]" if i%10 == 9 else "") for i in range(TOKENS-len(ANSWER))]
+
+class FakeChat(BaseChatModel):
+    """Streams ANSWER a token at a time, slowly"""
+
+    streaming: bool = False
+    temperature: float = 0.7
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        for i in ANSWER:
+            time.sleep(DELAY)
+            if self.streaming and run_manager:
+                run_manager.on_llm_new_token(i)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(ANSWER)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+class FixedSearch(Search):
+    """Search over two fixed resources, without a database"""
+
+    def search(self, text):
+        text = "A sentence of the knowledge base."
+        return [{"text": text,
+                 "metadata": {"source": "test", "hash": str(i), "title": f"Resource {i}",
+                              "sentences": [(0, len(text))]}}
+                for i in range(2)]
+
+@pytest.fixture
+def search():
+    llm = FakeChat()
+    return FixedSearch(AgentContext(llm, llm, None, None, "streaming-test"))
+
+def test_streaming_query_ends_with_answer(search):
+    out = list(search.query("what are the words?", streaming=True))
+
+    assert all(not i["done"] for i in out[:-1])
+    assert out[-1]["done"]
+    assert out[-1]["output"]["answer"].startswith("word0")
+    assert set(out[-1]["output"]["answer_resources"]) == {0, 1}
+
+def test_concurrent_streams_mostly_wait(search):
+    # consumers block on their queues rather than spinning, so CPU
+    # time stays a small fraction of wall time
+    results = [None]*STREAMS
+
+    def consume(indx):
+        results[indx] = list(frames(search.query("what are the words?", streaming=True),
+                                    StreamFormat.SSE))
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(STREAMS)]
+    [i.start() for i in threads]
+    [i.join() for i in threads]
+    wall, cpu = time.perf_counter()-wall, time.process_time()-cpu
+
+    # every stream ends with the whole, parsed answer
+    assert all(len(i) > 1 and "event: done" in i[-1] and '"answer": "word0' in i[-1] for i in results)
+    assert cpu/wall < MAX_CPU, f"streaming used {100*cpu/wall:.0f}% of a core"
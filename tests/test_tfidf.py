@@ -0,0 +1,32 @@
+"""
+test_tfidf.py
+Batched TFIDF scoring.
+"""
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from simon.components import tfidf
+
+def corpus(documents=40, paragraphs=5):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(200)]
+    return [[" ".join(rng.choice(words, 12)) for _ in range(paragraphs)]
+            for _ in range(documents)]
+
+def test_score_matches_sklearn():
+    paragraphs = corpus()
+    expected = [TfidfVectorizer().fit_transform(i).sum(axis=1).A1.tolist() for i in paragraphs]
+
+    assert np.allclose(np.concatenate(tfidf.score(paragraphs)), np.concatenate(expected))
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_score_batch_fans_out_per_workers(monkeypatch, workers):
+    monkeypatch.setattr(tfidf, "PARALLEL_THRESHOLD", 10)
+    paragraphs = corpus()
+
+    # shards count terms in another order, so the last bits may differ
+    assert np.allclose(np.concatenate(tfidf.score_batch(paragraphs, workers=workers)),
+                       np.concatenate(tfidf.score(paragraphs)))
+    assert tfidf._EXECUTORS[workers]._max_workers == workers
@@ -0,0 +1,116 @@
+"""
+test_vectorstore.py
+The in-process vector store, over a fake database connection.
+"""
+
+import os
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from simon.components import vectorstore
+
+DIM = 8
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.itersize = None
+
+    def execute(self, sql, params):
+        uid = params[0]
+        if sql.startswith("SELECT count(*)"):
+            self.rows = [(sum(len(i) for i in self.db.get(uid, {}).values()),)]
+        elif sql.startswith("SELECT hash FROM simon_fulltext"):
+            self.rows = [(i,) for i in self.db.get(uid, {})]
+        else:
+            # hash, seq, tf, vector_send(embedding)
+            self.rows = [(hash, seq, tf, struct.pack(f">hh{DIM}f", DIM, 0, *em))
+                         for hash in params[1]
+                         for seq, tf, em in self.db.get(uid, {}).get(hash, [])]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchmany(self, n):
+        rows, self.rows = self.rows[:n], self.rows[n:]
+        return rows
+
+    def close(self):
+        pass
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, name=None):
+        return FakeCursor(self.db)
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(vectorstore, "STORE_DIR", str(tmp_path))
+    # segments are cleaned up as soon as nothing refers to them
+    monkeypatch.setattr(vectorstore, "GRACE", -1)
+    monkeypatch.setattr(vectorstore, "_STORES", {})
+    return tmp_path
+
+def document(rng, hash, chunks=3):
+    return {hash: [(seq, 1.0, rng.standard_normal(DIM).astype(np.float32).tolist())
+                   for seq in range(chunks)]}
+
+def brute_force(db, uid, query, k):
+    rows = [(float(np.dot(em, query)), hash, seq)
+            for hash, chunks in db[uid].items() for seq, _, em in chunks]
+    return [(hash, seq) for _, hash, seq in sorted(rows, key=lambda i: -i[0])[:k]]
+
+def test_incremental_builds_match_brute_force(store_dir):
+    rng = np.random.default_rng(0)
+    db = {"u": {}}
+    context = SimpleNamespace(uid="u", cnx=FakeConnection(db))
+    query = rng.standard_normal(DIM).tolist()
+
+    for version in range(1, 6):
+        db["u"].update(document(rng, f"d{version}"))
+        if version == 4:
+            del db["u"]["d2"]
+
+        res = vectorstore.store(context, version).search([query], 5, 0.0)
+        assert res == [brute_force(db, "u", query, 5)]
+
+def test_stale_worker_rebuilds_after_compaction(store_dir, monkeypatch):
+    monkeypatch.setattr(vectorstore, "MAX_SEGMENTS", 2)
+
+    rng = np.random.default_rng(1)
+    db = {"u": {}}
+    context = SimpleNamespace(uid="u", cnx=FakeConnection(db))
+    query = rng.standard_normal(DIM).tolist()
+
+    # this worker builds v1 and v2, then goes quiet
+    db["u"].update(document(rng, "a"))
+    vectorstore.store(context, 1)
+    db["u"].update(document(rng, "b"))
+    stale = vectorstore.store(context, 2)
+    assert len(stale.segments) == 2
+
+    # another worker adds enough segments to compact, which leaves the
+    # stale worker's segments unreferenced, so they are cleaned up
+    vectorstore._STORES.clear()
+    db["u"].update(document(rng, "c"))
+    compacted = vectorstore.store(context, 3)
+    assert len(compacted.segments) == 1
+    assert not any(os.path.exists(i.path) for i in stale.segments)
+
+    # the stale worker then builds the next version from what it has
+    vectorstore._STORES.clear()
+    vectorstore._STORES["u"] = (2, stale)
+    db["u"].update(document(rng, "d"))
+
+    res = vectorstore.store(context, 4).search([query], 6, 0.0)
+    assert res == [brute_force(db, "u", query, 6)]